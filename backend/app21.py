@@ -3,19 +3,25 @@
 import os
 import traceback
 import time
+import json
+import base64
+import hashlib
+import importlib.util
 import psycopg2
 import psycopg2.extras
 import psycopg2.pool
 import bcrypt
 import logging
 import threading
-from flask import Flask, request, jsonify, send_file, send_from_directory
-from werkzeug.utils import secure_filename
+from flask import Flask, Response, request, jsonify, send_file, send_from_directory
+from werkzeug.utils import secure_filename, safe_join
 from flask_cors import CORS
 from datetime import datetime, timedelta
 from functools import wraps
 from contextlib import contextmanager
 import secrets
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 
 from dotenv import load_dotenv
 
@@ -72,6 +78,9 @@ logger.info("Backend Municipal iniciando...")
 connection_pool = None
 pool_lock = threading.RLock()
 
+# Tareas en segundo plano (indexación, post-proceso de uploads)
+tareas_fondo = ThreadPoolExecutor(max_workers=2, thread_name_prefix="tareas")
+
 # Sesiones
 active_sessions = {}
 sessions_lock = threading.Lock()
@@ -149,7 +158,23 @@ def release_db_connection(conn):
 
 #-------------------------
 
-from extract import extract_text_from_file
+from extract import extract_text_from_file, extract_pdf_pages
+from derivados import (obtener_miniatura, generar_miniatura_async, MINIATURA_EXT,
+                       obtener_redimension, tamano_redim, REDIM_FORMATOS, DiskLRUCache, DERIVADOS_DIR)
+from contexto import fragmentar, BM25Index, empaquetar
+from eventos import Notificador
+from mapas import (parse_bbox, parse_ids, tamano_celda, ZOOM_PUNTOS, ZOOM_MAX, MAX_PUNTOS,
+                   TileCache, tile_valido, tile_bbox, bbox_geojson, recortar_geojson, coleccion,
+                   distancia_m, rango_celdas_dup)
+import particiones
+import resumenes
+import exportar
+
+# LISTEN/NOTIFY -> SSE: un hilo listener por proceso, se inicia con el primer stream
+notificador = Notificador(DB_CONNECTION_STRING, ["reportes_eventos", "control_eventos"],
+                          application_name="municipal_api_listener",
+                          keepalives=1, keepalives_idle=60, keepalives_interval=10,
+                          keepalives_count=5, connect_timeout=10)
 
 # -----------------------
 # CONFIG DOCUMENTOS
@@ -170,6 +195,26 @@ ALLOWED_EXTENSIONS = {
 def allowed_file(filename):
     return "." in filename and filename.rsplit(".", 1)[1].lower() in ALLOWED_EXTENSIONS
 
+def miniatura_url(base, extension):
+    """URL de la miniatura si el tipo de archivo admite vista previa."""
+    if (extension or "").lower() in MINIATURA_EXT:
+        return f"{base}/miniatura"
+    return None
+
+def encode_cursor(fecha, row_id):
+    """Cursor opaco de paginación keyset sobre (fecha, id)."""
+    raw = f"{fecha.isoformat()}|{row_id}".encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+def decode_cursor(cursor):
+    """Inverso de encode_cursor; lanza ValueError si el cursor no es válido."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode("utf-8")
+        fecha, _, row_id = raw.rpartition("|")
+        return datetime.fromisoformat(fecha), int(row_id)
+    except Exception:
+        raise ValueError("Cursor inválido")
+
 
 # MEJORA #4: Funciones de gestión de sesiones con expiración
 def create_session(user_id):
@@ -1007,6 +1052,8 @@ def get_proyectos4(current_user_id):
 @app.route("/proyectos_chat", methods=["GET"])
 @session_required
 def get_proyectos_chat(current_user_id):
+    if request.args.get("budget"):
+        return get_proyectos_chat_digest()
     conn = None
     try:
         conn = get_db_connection()
@@ -1049,6 +1096,70 @@ def get_proyectos_chat(current_user_id):
             release_db_connection(conn)
 
 
+def get_proyectos_chat_digest():
+    """
+    Resúmenes compactos (proyectos_digest) empaquetados dentro de `budget` tokens.
+    Filtros opcionales: area_id, estado_id, financiamiento_id, ids (lista separada por comas).
+    Orden: coincidencia BM25 con `q` si viene, luego recencia.
+    """
+    conn = None
+    try:
+        budget = max(1, min(CONTEXTO_BUDGET_MAX, request.args.get("budget", type=int) or CONTEXTO_BUDGET_DEFAULT))
+        q = (request.args.get("q") or "").strip()
+
+        filtros = []
+        params = []
+        for campo in ("area_id", "estado_id", "financiamiento_id"):
+            val = request.args.get(campo, type=int)
+            if val is not None:
+                filtros.append(f"{campo} = %s")
+                params.append(val)
+        ids = request.args.get("ids")
+        if ids:
+            filtros.append("proyecto_id = ANY(%s)")
+            params.append([int(x) for x in ids.split(",") if x.strip().isdigit()])
+        where_clause = ("WHERE " + " AND ".join(filtros)) if filtros else ""
+
+        conn = get_db_connection()
+        with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cur:
+            cur.execute(f"""
+                SELECT proyecto_id, digest, texto, tokens, ult_modificacion
+                FROM proyectos_digest
+                {where_clause}
+                ORDER BY ult_modificacion DESC NULLS LAST, proyecto_id DESC
+            """, params)
+            digests = cur.fetchall()
+
+        puntajes = None
+        if q and digests:
+            scores = BM25Index([d["texto"] for d in digests]).puntajes(q)
+            # Estable: a igual puntaje se mantiene el orden por recencia
+            orden = sorted(range(len(digests)), key=lambda i: -scores[i])
+            if scores[orden[0]] > 0:
+                digests = [digests[i] for i in orden]
+                puntajes = [scores[i] for i in orden]
+
+        elegidos, usados = empaquetar(digests, None, budget)
+
+        return jsonify({
+            "budget": budget,
+            "tokens": usados,
+            "total": len(digests),
+            "incluidos": len(elegidos),
+            "proyectos": [dict(digests[i]["digest"],
+                               texto=digests[i]["texto"],
+                               score=round(puntajes[i], 4) if puntajes else None)
+                          for i in elegidos]
+        })
+    except Exception as e:
+        logger.error(f"Error en get_proyectos_chat_digest: {e}")
+        traceback.print_exc()
+        return jsonify({"message": "Error interno"}), 500
+    finally:
+        if conn:
+            release_db_connection(conn)
+
+
 @app.route("/proyectos", methods=["GET"])
 @session_required
 def get_proyectos(current_user_id):
@@ -1596,6 +1707,7 @@ def upload_biblioteca_doc(current_user_id):
                     VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
                 """, (nombre, tipo, descripcion, url, f.filename, ext, os.path.getsize(fpath), current_user_id))
             conn.commit()
+            generar_miniatura_async(fpath, ext)
             return jsonify({"message": "Documento añadido a biblioteca", "url": url})
         return jsonify({"message": "Tipo de archivo no permitido"}), 400
     except Exception as e:
@@ -1613,13 +1725,44 @@ def get_biblioteca_docs(current_user_id):
         conn = get_db_connection()
         with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cur:
             cur.execute("SELECT * FROM licitaciones_biblioteca ORDER BY fecha_subida DESC")
-            return jsonify(cur.fetchall())
+            docs = cur.fetchall()
+        for d in docs:
+            d["thumbnail_url"] = miniatura_url(f"/licitaciones/biblioteca/{d['id']}", d["archivo_extension"])
+        return jsonify(docs)
     except Exception as e:
         logger.error(f"Error get_biblioteca_docs: {e}")
         return jsonify({"message": "Error interno", "detail": str(e)}), 500
     finally:
         if conn: release_db_connection(conn)
 
+@app.route("/licitaciones/biblioteca/<int:doc_id>/miniatura", methods=["GET"])
+@session_required
+def get_biblioteca_miniatura(current_user_id, doc_id):
+    conn = None
+    try:
+        conn = get_db_connection()
+        with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cur:
+            cur.execute("SELECT url, archivo_extension FROM licitaciones_biblioteca WHERE id = %s", (doc_id,))
+            doc = cur.fetchone()
+        if not doc:
+            return jsonify({"message": "Documento no encontrado"}), 404
+
+        # El nombre en disco solo queda registrado en la url pública
+        fname = os.path.basename(doc["url"])
+        src = os.path.join(DOCS_FOLDER, "licitaciones", "biblioteca", fname)
+        mini = obtener_miniatura(src, doc["archivo_extension"])
+        if not mini:
+            return jsonify({"message": "Vista previa no disponible"}), 404
+
+        resp = send_file(mini[0], mimetype=mini[1])
+        resp.headers["Cache-Control"] = "private, max-age=86400"
+        return resp
+    except Exception as e:
+        logger.error(f"Error get_biblioteca_miniatura: {e}")
+        return jsonify({"message": "Error interno"}), 500
+    finally:
+        if conn: release_db_connection(conn)
+
 @app.route("/licitaciones/<int:lid>/cerrar", methods=["PUT"])
 @session_required
 def cerrar_licitacion(current_user_id, lid):
@@ -2263,6 +2406,9 @@ def upload_documento(current_user_id, pid):
 
         conn.commit()
 
+        generar_miniatura_async(file_path, extension)
+        encolar_indexacion(documento_id, pid, file_path, extension)
+
         log_auditoria(
             current_user_id,
             #1,
@@ -2317,6 +2463,9 @@ def listar_documentos_proyecto(pid):
 
             documentos = cur.fetchall()
 
+        for d in documentos:
+            d["thumbnail_url"] = miniatura_url(f"/documentos/{d['documento_id']}", d["archivo_extension"])
+
         return jsonify({
             "proyecto_id": pid,
             "total": len(documentos),
@@ -2422,6 +2571,9 @@ def get_all_documentos(current_user_id):
             """)
             documentos = cur.fetchall()
 
+        for d in documentos:
+            d["thumbnail_url"] = miniatura_url(f"/documentos/{d['documento_id']}", d["archivo_extension"])
+
         return jsonify(documentos)
 
     except Exception as e:
@@ -2523,6 +2675,86 @@ def view_documento(current_user_id, documento_id):
         if conn:
             release_db_connection(conn)
 
+@app.route("/documentos/<int:documento_id>/miniatura", methods=["GET"])
+@session_required
+def get_documento_miniatura(current_user_id, documento_id):
+    """Vista previa liviana (PNG de la 1ª página o WebP reducido) desde la caché de derivados."""
+    conn = None
+    try:
+        conn = get_db_connection()
+        with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cur:
+            cur.execute("""
+                SELECT proyecto_id, archivo_nombre, archivo_extension
+                FROM proyectos_documentos
+                WHERE documento_id = %s
+            """, (documento_id,))
+            doc = cur.fetchone()
+
+        if not doc:
+            return jsonify({"message": "Documento no encontrado"}), 404
+
+        src = os.path.join(DOCS_FOLDER, str(doc["proyecto_id"]), doc["archivo_nombre"])
+        mini = obtener_miniatura(src, doc["archivo_extension"])
+        if not mini:
+            return jsonify({"message": "Vista previa no disponible"}), 404
+
+        resp = send_file(mini[0], mimetype=mini[1])
+        resp.headers["Cache-Control"] = "private, max-age=86400"
+        return resp
+
+    except Exception as e:
+        logger.error(f"Error get_documento_miniatura: {e}")
+        return jsonify({"message": "Error interno"}), 500
+    finally:
+        if conn:
+            release_db_connection(conn)
+
+@app.route("/documentos/<int:documento_id>/paginas", methods=["GET"])
+@session_required
+def get_documento_paginas(current_user_id, documento_id):
+    """
+    Texto de un rango de páginas de un PDF (para que el chat pida solo lo necesario).
+    Parámetros: desde (default 1), hasta (default última página)
+    """
+    conn = None
+    try:
+        conn = get_db_connection()
+        with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cur:
+            cur.execute("""
+                SELECT proyecto_id, archivo_nombre, archivo_extension, nombre
+                FROM proyectos_documentos
+                WHERE documento_id = %s
+            """, (documento_id,))
+            doc = cur.fetchone()
+
+        if not doc:
+            return jsonify({"message": "Documento no encontrado"}), 404
+
+        if (doc["archivo_extension"] or "").lower() != "pdf":
+            return jsonify({"message": "Solo disponible para documentos PDF"}), 400
+
+        file_path = os.path.join(DOCS_FOLDER, str(doc["proyecto_id"]), doc["archivo_nombre"])
+        if not os.path.exists(file_path):
+            return jsonify({"message": "Archivo no existe en disco"}), 404
+
+        desde = request.args.get("desde", 1, type=int)
+        hasta = request.args.get("hasta", type=int)
+
+        paginas = extract_pdf_pages(file_path, desde, hasta)
+
+        return jsonify({
+            "documento_id": documento_id,
+            "nombre": doc["nombre"],
+            "paginas": [{"pagina": n, "texto": t} for n, t in paginas]
+        })
+
+    except Exception as e:
+        logger.error(f"Error get_documento_paginas: {e}")
+        return jsonify({"message": "Error interno"}), 500
+    finally:
+        if conn:
+            release_db_connection(conn)
+
 def get_texto_documentos_proyecto(proyecto_id):
     conn = None
     textos = []
@@ -2569,6 +2801,236 @@ def get_texto_documentos_proyecto(proyecto_id):
         if conn:
             release_db_connection(conn)
 
+# -----------------------
+# CONTEXTO DOCUMENTAL (fragmentos + BM25)
+# -----------------------
+CONTEXTO_BUDGET_DEFAULT = 4000
+CONTEXTO_BUDGET_MAX = 32000
+CONTEXTO_CACHE_PROYECTOS = 20
+
+contexto_cache = OrderedDict()    # pid -> (version, chunks, indice)
+contexto_lock = threading.Lock()
+
+INDEXADO_MAX_INTENTOS = 3
+INDEXADO_RECLAMO_MIN = 30         # reclamo vencido (proceso caído) se puede retomar
+
+indexando = set()                 # documento_id en cola o en curso en este proceso
+indexando_lock = threading.Lock()
+
+def reclamar_indexacion(conn, documento_id):
+    """
+    Marca indexando_desde en una transacción corta. False si otro proceso
+    ya lo reclamó (y el reclamo no venció) o si el documento no existe.
+    """
+    with conn.cursor() as cur:
+        cur.execute("""
+            UPDATE proyectos_documentos SET indexando_desde = NOW()
+            WHERE documento_id = %s
+              AND (indexando_desde IS NULL
+                   OR indexando_desde < NOW() - make_interval(mins => %s))
+            RETURNING documento_id
+        """, (documento_id, INDEXADO_RECLAMO_MIN))
+        ok = cur.fetchone() is not None
+    conn.commit()
+    return ok
+
+def extraer_fragmentos(file_path, ext):
+    """Texto -> fragmentos, fuera de toda transacción. Retorna (chunks, error)."""
+    if not os.path.exists(file_path):
+        return [], "archivo no encontrado"
+    try:
+        texto = extract_text_from_file(file_path, ext)
+    except Exception as e:
+        return [], str(e)[:500]
+    chunks = fragmentar(texto) if texto else []
+    return chunks, (None if chunks else "sin texto extraíble")
+
+def guardar_fragmentos(conn, documento_id, proyecto_id, chunks, error):
+    """
+    Reemplaza los fragmentos y libera el reclamo en una transacción corta.
+    Sin fragmentos no se marca indexado_en: se cuenta el intento.
+    """
+    with conn.cursor() as cur:
+        # Serializa escrituras del mismo documento si un reclamo vencido se retomó
+        cur.execute("SELECT 1 FROM proyectos_documentos WHERE documento_id = %s FOR UPDATE",
+                    (documento_id,))
+        if cur.fetchone() is None:
+            conn.rollback()
+            return None
+        if not chunks:
+            cur.execute("""
+                UPDATE proyectos_documentos
+                SET indexado_intentos = indexado_intentos + 1, indexado_error = %s,
+                    indexando_desde = NULL
+                WHERE documento_id = %s
+            """, (error, documento_id))
+            conn.commit()
+            logger.warning(f"Documento {documento_id} sin indexar: {error}")
+            return 0
+
+        cur.execute("DELETE FROM proyectos_documentos_chunks WHERE documento_id = %s", (documento_id,))
+        psycopg2.extras.execute_values(cur, """
+            INSERT INTO proyectos_documentos_chunks
+                (documento_id, proyecto_id, orden, texto, tokens)
+            VALUES %s
+        """, [(documento_id, proyecto_id, i, t, tk) for i, (t, tk) in enumerate(chunks)])
+        cur.execute("""
+            UPDATE proyectos_documentos
+            SET indexado_en = NOW(), indexado_intentos = indexado_intentos + 1,
+                indexado_error = NULL, indexando_desde = NULL
+            WHERE documento_id = %s
+        """, (documento_id,))
+    conn.commit()
+    return len(chunks)
+
+def indexar_documento_fondo(documento_id, proyecto_id, file_path, ext):
+    """
+    Reclama, extrae y guarda. La extracción (OCR, LibreOffice) puede tardar
+    minutos: corre sin transacción abierta y sin ocupar una conexión del pool.
+    """
+    conn = None
+    reclamado = False
+    try:
+        conn = get_db_connection()
+        reclamado = reclamar_indexacion(conn, documento_id)
+        release_db_connection(conn)
+        conn = None
+        if not reclamado:
+            return
+
+        chunks, error = extraer_fragmentos(file_path, ext)
+
+        conn = get_db_connection()
+        guardar_fragmentos(conn, documento_id, proyecto_id, chunks, error)
+        reclamado = False
+    except Exception as e:
+        if conn: conn.rollback()
+        logger.error(f"Error indexando documento {documento_id}: {e}")
+        if reclamado:
+            try:
+                if conn is None:
+                    conn = get_db_connection()
+                with conn.cursor() as cur:
+                    cur.execute("UPDATE proyectos_documentos SET indexando_desde = NULL WHERE documento_id = %s",
+                                (documento_id,))
+                conn.commit()
+            except Exception as e2:
+                logger.error(f"No se pudo liberar el reclamo del documento {documento_id}: {e2}")
+    finally:
+        with indexando_lock:
+            indexando.discard(documento_id)
+        if conn: release_db_connection(conn)
+
+def encolar_indexacion(documento_id, proyecto_id, file_path, ext):
+    """Envía el documento a tareas_fondo salvo que ya esté en cola en este proceso."""
+    with indexando_lock:
+        if documento_id in indexando:
+            return False
+        indexando.add(documento_id)
+    tareas_fondo.submit(indexar_documento_fondo, documento_id, proyecto_id, file_path, ext)
+    return True
+
+def encolar_pendientes_proyecto(conn, proyecto_id):
+    """
+    Encola en segundo plano los documentos aún sin fragmentos (subidos antes
+    de existir la tabla o con extracción fallida). Retorna cuántos quedan pendientes.
+    """
+    with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cur:
+        cur.execute("""
+            SELECT documento_id, archivo_nombre, archivo_extension
+            FROM proyectos_documentos
+            WHERE proyecto_id = %s AND indexado_en IS NULL
+              AND indexado_intentos < %s
+        """, (proyecto_id, INDEXADO_MAX_INTENTOS))
+        pendientes = cur.fetchall()
+
+    proyecto_dir = os.path.join(DOCS_FOLDER, str(proyecto_id))
+    for doc in pendientes:
+        ext = (doc["archivo_extension"] or "").lower()
+        file_path = os.path.join(proyecto_dir, doc["archivo_nombre"])
+        encolar_indexacion(doc["documento_id"], proyecto_id, file_path,
+                           ext if ext in ALLOWED_EXTENSIONS else "")
+    return len(pendientes)
+
+def get_indice_contexto(conn, proyecto_id):
+    """Fragmentos + índice BM25 del proyecto, reconstruido solo si cambiaron los fragmentos."""
+    with conn.cursor() as cur:
+        cur.execute("""
+            SELECT COUNT(*), COALESCE(MAX(id), 0)
+            FROM proyectos_documentos_chunks WHERE proyecto_id = %s
+        """, (proyecto_id,))
+        version = tuple(cur.fetchone())
+
+    with contexto_lock:
+        cached = contexto_cache.get(proyecto_id)
+        if cached and cached[0] == version:
+            contexto_cache.move_to_end(proyecto_id)
+            return cached[1], cached[2]
+
+    with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cur:
+        cur.execute("""
+            SELECT c.documento_id, d.nombre AS documento, c.orden, c.texto, c.tokens
+            FROM proyectos_documentos_chunks c
+            JOIN proyectos_documentos d ON d.documento_id = c.documento_id
+            WHERE c.proyecto_id = %s
+            ORDER BY c.documento_id, c.orden
+        """, (proyecto_id,))
+        chunks = cur.fetchall()
+    indice = BM25Index([c["texto"] for c in chunks])
+
+    with contexto_lock:
+        contexto_cache[proyecto_id] = (version, chunks, indice)
+        contexto_cache.move_to_end(proyecto_id)
+        while len(contexto_cache) > CONTEXTO_CACHE_PROYECTOS:
+            contexto_cache.popitem(last=False)
+    return chunks, indice
+
+@app.route("/proyectos/<int:pid>/contexto", methods=["GET"])
+@session_required
+def obtener_contexto_proyecto(current_user_id, pid):
+    """
+    Fragmentos de documentos más relevantes para la pregunta `q`
+    que caben en `budget` tokens (ranking BM25 local).
+    """
+    conn = None
+    try:
+        q = (request.args.get("q") or "").strip()
+        budget = request.args.get("budget", CONTEXTO_BUDGET_DEFAULT, type=int)
+        budget = max(1, min(CONTEXTO_BUDGET_MAX, budget))
+
+        conn = get_db_connection()
+        # Los documentos sin indexar se procesan en segundo plano: se responde
+        # con lo ya indexado e informando cuántos faltan
+        pendientes = encolar_pendientes_proyecto(conn, pid)
+        chunks, indice = get_indice_contexto(conn, pid)
+
+        puntajes = indice.puntajes(q) if q else None
+        elegidos, usados = empaquetar(chunks, puntajes, budget)
+
+        return jsonify({
+            "proyecto_id": pid,
+            "q": q,
+            "budget": budget,
+            "tokens": usados,
+            "total_fragmentos": len(chunks),
+            "documentos_pendientes": pendientes,
+            "fragmentos": [{
+                "documento_id": chunks[i]["documento_id"],
+                "documento": chunks[i]["documento"],
+                "orden": chunks[i]["orden"],
+                "tokens": chunks[i]["tokens"],
+                "score": round(puntajes[i], 4) if puntajes else None,
+                "texto": chunks[i]["texto"]
+            } for i in elegidos]
+        })
+    except Exception as e:
+        if conn: conn.rollback()
+        logger.error(f"Error obtener_contexto_proyecto {pid}: {e}")
+        traceback.print_exc()
+        return jsonify({"message": "Error interno"}), 500
+    finally:
+        if conn: release_db_connection(conn)
+
 @app.route("/proyectos/<int:pid>/documentos/texto", methods=["GET"])
 @session_required
 def obtener_texto_documentos(current_user_id, pid):
@@ -2595,6 +3057,7 @@ def crear_geomapa(current_user_id, pid):
         nombre = data.get("nombre")
         descripcion = data.get("descripcion")
         geojson = data["geojson"]
+        caja = bbox_geojson(geojson) or (None, None, None, None)
 
         conn = get_db_connection()
         if not conn:
@@ -2606,20 +3069,24 @@ def crear_geomapa(current_user_id, pid):
                     proyecto_id,
                     nombre,
                     descripcion,
-                    geojson
+                    geojson,
+                    bbox_oeste, bbox_sur, bbox_este, bbox_norte
                 )
-                VALUES (%s, %s, %s, %s::jsonb)
+                VALUES (%s, %s, %s, %s::jsonb, %s, %s, %s, %s)
                 RETURNING geomapa_id
             """, (
                 pid,
                 nombre,
                 descripcion,
-                json.dumps(geojson)
+                json.dumps(geojson),
+                *caja
             ))
 
             geomapa_id = cur.fetchone()[0]
 
         conn.commit()
+        if caja[0] is not None:
+            tiles_cache.invalidar("geomapas", caja)
 
         log_auditoria(
             current_user_id,
@@ -3336,7 +3803,7 @@ def cleanup():
 # ============================================
 # MOBILE API CONFIGURATION AND UTILITIES
 # ============================================
-from PIL import Image
+from PIL import Image, ImageOps
 from PIL.ExifTags import TAGS, GPSTAGS
 from datetime import timedelta
 import io
@@ -3349,7 +3816,47 @@ from flask import send_from_directory
 
 @app.route('/fotos_reportes/<path:filename>')
 def servir_foto_reporte(filename):
-    return send_from_directory(FOTOS_DIR, filename)
+    """
+    Sin parámetros entrega el original. Con ?w=&h=&fmt= entrega un derivado
+    reducido desde la caché de disco (los archivos subidos no se sobrescriben,
+    así que el derivado es inmutable). w/h se suben al siguiente de
+    REDIM_TAMANOS; mayores a 2048 -> 400.
+    """
+    if not any(k in request.args for k in ("w", "h", "fmt")):
+        return send_from_directory(FOTOS_DIR, filename)
+
+    try:
+        w = int(request.args.get("w") or 0)
+        h = int(request.args.get("h") or 0)
+    except ValueError:
+        return jsonify({"message": "w y h deben ser enteros"}), 400
+    if w < 0 or h < 0:
+        return jsonify({"message": "w y h deben ser positivos"}), 400
+    # Endpoint público: solo lados de REDIM_TAMANOS (se redondea hacia arriba)
+    try:
+        w, h = tamano_redim(w) or 0, tamano_redim(h) or 0
+    except ValueError as e:
+        return jsonify({"message": f"w y h: {e}"}), 400
+
+    src = safe_join(FOTOS_DIR, filename)
+    if src is None or not os.path.isfile(src):
+        return jsonify({"message": "Foto no encontrada"}), 404
+    fmt = request.args.get("fmt") or os.path.splitext(src)[1].lstrip(".").lower() or "jpg"
+    if fmt not in REDIM_FORMATOS:
+        return jsonify({"message": f"Formato no soportado: {fmt}"}), 400
+
+    try:
+        derivado = obtener_redimension(src, w or None, h or None, fmt)
+    except Exception as e:
+        logger.warning(f"No se pudo redimensionar {filename}: {e}")
+        return jsonify({"message": "No se pudo procesar la imagen"}), 415
+    if derivado is None:
+        return jsonify({"message": "Foto no encontrada"}), 404
+
+    path, mimetype = derivado
+    resp = send_file(path, mimetype=mimetype, conditional=True)
+    resp.headers["Cache-Control"] = "public, max-age=31536000, immutable"
+    return resp
 
 # Utilidades para imágenes
 def es_imagen(f): 
@@ -3368,32 +3875,164 @@ def optimizar_imagen(data):
         return out.getvalue()
     except: return data
 
+# Tags EXIF (ids numéricos: _getexif() no usa nombres)
+EXIF_DATETIME_ORIGINAL = 36867
+EXIF_DATETIME = 306
+
 def extraer_gps(data):
+    """Dimensiones, GPS y fecha de captura (EXIF) de una foto. {} si no es imagen."""
     try:
         img = Image.open(io.BytesIO(data))
-        exif = img._getexif()
-        meta = {'ancho_px': img.width, 'alto_px': img.height}
-        if not exif: return meta
-        
-        gps = {}
-        for tag_id, val in exif.items():
-            if TAGS.get(tag_id) == 'GPSInfo':
-                for gps_id in val:
-                    gps[GPSTAGS.get(gps_id, gps_id)] = val[gps_id]
-        
-        if 'GPSLatitude' in gps and 'GPSLongitude' in gps:
-            def to_dec(coords, ref):
-                d = float(coords[0]) + float(coords[1])/60 + float(coords[2])/3600
-                return -d if ref in ['S','W'] else d
+    except (OSError, ValueError) as e:
+        logger.warning(f"extraer_gps: imagen no legible: {e}")
+        return {}
+    meta = {'ancho_px': img.width, 'alto_px': img.height}
+    try:
+        exif = img._getexif() if hasattr(img, '_getexif') else None
+    except Exception as e:
+        logger.warning(f"extraer_gps: EXIF ilegible: {e}")
+        exif = None
+    if not exif: return meta
+
+    gps = {}
+    for tag_id, val in exif.items():
+        if TAGS.get(tag_id) == 'GPSInfo' and isinstance(val, dict):
+            for gps_id in val:
+                gps[GPSTAGS.get(gps_id, gps_id)] = val[gps_id]
+
+    if 'GPSLatitude' in gps and 'GPSLongitude' in gps:
+        def to_dec(coords, ref):
+            d = float(coords[0]) + float(coords[1])/60 + float(coords[2])/3600
+            return -d if ref in ['S','W'] else d
+        try:
             meta['latitud'] = to_dec(gps['GPSLatitude'], gps.get('GPSLatitudeRef','N'))
             meta['longitud'] = to_dec(gps['GPSLongitude'], gps.get('GPSLongitudeRef','E'))
-        
-        dt = exif.get('DateTimeOriginal') or exif.get('DateTime')
-        if dt:
-            try: meta['fecha_captura'] = datetime.strptime(dt, '%Y:%m:%d %H:%M:%S')
-            except: pass
-        return meta
-    except: return {}
+        except (TypeError, ValueError, IndexError, ZeroDivisionError) as e:
+            meta.pop('latitud', None)
+            logger.warning(f"extraer_gps: GPS inválido: {e}")
+
+    dt = exif.get(EXIF_DATETIME_ORIGINAL) or exif.get(EXIF_DATETIME)
+    if isinstance(dt, bytes):
+        dt = dt.decode('ascii', 'ignore')
+    if dt:
+        try: meta['fecha_captura'] = datetime.strptime(dt.strip('\x00 '), '%Y:%m:%d %H:%M:%S')
+        except ValueError: pass
+    return meta
+
+# Variantes generadas fuera del request: nombre -> lado máximo en px
+FOTO_VARIANTES = (("full", 1920), ("medium", 800), ("thumb", 240))
+FOTOS_WORKERS = int(os.getenv("FOTOS_WORKERS", 2))
+fotos_pool = ThreadPoolExecutor(max_workers=FOTOS_WORKERS, thread_name_prefix="fotos")
+
+def generar_variantes_foto(fpath):
+    """
+    Decodifica una sola vez, corrige orientación EXIF y genera cada tamaño a
+    partir del anterior (full -> medium -> thumb), en JPEG y WebP.
+    Retorna {nombre: (ancho, alto, {"jpg": bytes, "webp": bytes})}.
+    """
+    img = Image.open(fpath)
+    img = ImageOps.exif_transpose(img)
+    if img.mode != 'RGB':
+        bg = Image.new('RGB', img.size, (255,255,255))
+        rgba = img.convert('RGBA')
+        bg.paste(rgba, mask=rgba.split()[-1])
+        img = bg
+
+    out = {}
+    for nombre, lado in FOTO_VARIANTES:
+        if max(img.size) > lado:
+            img = img.copy()
+            img.thumbnail((lado, lado), Image.Resampling.LANCZOS)
+        formatos = {}
+        for ext, fmt, opts in (("jpg", "JPEG", {"quality": 85, "optimize": True, "progressive": True}),
+                               ("webp", "WEBP", {"quality": 80, "method": 4})):
+            buf = io.BytesIO()
+            img.save(buf, format=fmt, **opts)
+            formatos[ext] = buf.getvalue()
+        out[nombre] = (img.width, img.height, formatos)
+    return out
+
+def procesar_foto_reporte(foto_id, fpath, url_dir):
+    """Tarea del pool: variantes + metadata EXIF -> reportes_fotos."""
+    conn = None
+    try:
+        with open(fpath, 'rb') as fh:
+            meta = extraer_gps(fh.read())
+
+        stem = os.path.splitext(os.path.basename(fpath))[0]
+        variantes = {}
+        for nombre, (w, h, formatos) in generar_variantes_foto(fpath).items():
+            variantes[nombre] = {"w": w, "h": h}
+            for ext, data in formatos.items():
+                vname = f"{stem}_{nombre}.{ext}"
+                with open(os.path.join(os.path.dirname(fpath), vname), 'wb') as fh:
+                    fh.write(data)
+                variantes[nombre][ext] = f"{url_dir}/{vname}"
+
+        conn = get_db_connection()
+        with conn.cursor() as c:
+            c.execute("""UPDATE reportes_fotos
+                        SET estado_proceso = 'listo', variantes = %s,
+                            latitud = %s, longitud = %s, fecha_captura = %s,
+                            ancho_px = %s, alto_px = %s, procesado_en = NOW()
+                        WHERE id = %s""",
+                     (psycopg2.extras.Json(variantes),
+                      meta.get('latitud'), meta.get('longitud'), meta.get('fecha_captura'),
+                      meta.get('ancho_px'), meta.get('alto_px'), foto_id))
+        conn.commit()
+    except Exception as e:
+        logger.error(f"Error procesando foto {foto_id}: {e}")
+        if conn: conn.rollback()
+        try:
+            if conn is None:
+                conn = get_db_connection()
+            with conn.cursor() as c:
+                c.execute("UPDATE reportes_fotos SET estado_proceso = 'error', procesado_en = NOW() WHERE id = %s",
+                         (foto_id,))
+            conn.commit()
+        except Exception as e2:
+            logger.error(f"No se pudo marcar error en foto {foto_id}: {e2}")
+    finally:
+        if conn: release_db_connection(conn)
+
+FOTOS_REINTENTO_MIN = int(os.getenv("FOTOS_REINTENTO_MIN", 10))
+FOTOS_BARRIDO_LOTE = 200
+
+def reencolar_fotos_pendientes(conn):
+    """
+    Vuelve a enviar al pool las fotos 'pendiente' sin intento en los últimos
+    FOTOS_REINTENTO_MIN minutos (la cola del pool vive en memoria y se pierde
+    al reiniciar). procesado_en marca el intento, así otro proceso que barra
+    a la vez no toma las mismas filas. Retorna cuántas reencoló.
+    """
+    with conn.cursor() as c:
+        c.execute("""
+            UPDATE reportes_fotos SET procesado_en = NOW()
+            WHERE id IN (
+                SELECT id FROM reportes_fotos
+                WHERE estado_proceso = 'pendiente'
+                  AND subido_en < NOW() - make_interval(mins => %s)
+                  AND (procesado_en IS NULL OR procesado_en < NOW() - make_interval(mins => %s))
+                ORDER BY subido_en
+                LIMIT %s
+                FOR UPDATE SKIP LOCKED
+            )
+            RETURNING id, ruta_archivo
+        """, (FOTOS_REINTENTO_MIN, FOTOS_REINTENTO_MIN, FOTOS_BARRIDO_LOTE))
+        filas = c.fetchall()
+    conn.commit()
+
+    prefijo = "/fotos_reportes/"
+    for foto_id, url in filas:
+        rel = url[len(prefijo):] if url and url.startswith(prefijo) else None
+        fpath = safe_join(FOTOS_DIR, rel) if rel else None
+        if fpath is None:
+            logger.warning(f"Foto {foto_id}: ruta no reconocida {url}")
+            continue
+        fotos_pool.submit(procesar_foto_reporte, foto_id, fpath, prefijo + os.path.dirname(rel))
+    if filas:
+        logger.info(f"Fotos pendientes reencoladas: {len(filas)}")
+    return len(filas)
 
 # ============================================
 # MOBILE API: REGISTRO (Simplificado)
@@ -3618,17 +4257,17 @@ def get_perfil(current_user_id):
             c.execute("SELECT user_id, nombre, email, nivel_acceso FROM users WHERE user_id = %s", (current_user_id,))
             user = c.fetchone()
             
-            # Estadísticas
+            # Estadísticas (contadores mantenidos por trigger en reportes_rollup)
             c.execute("""
                 SELECT 
-                    COUNT(*) as total,
-                    COUNT(*) FILTER (WHERE estado_id = 1) as pendientes, -- Reportado
-                    COUNT(*) FILTER (WHERE estado_id IN (2,3)) as en_proceso, -- Verificado/Programado
-                    COUNT(*) FILTER (WHERE estado_id = 4) as resueltos -- Reparado
-                FROM reportes_ciudadanos 
-                WHERE reportado_por = %s AND activo = TRUE
+                    COALESCE(SUM(total), 0) as total,
+                    COALESCE(SUM(total) FILTER (WHERE estado_id = 1), 0) as pendientes, -- Reportado
+                    COALESCE(SUM(total) FILTER (WHERE estado_id IN (2,3)), 0) as en_proceso, -- Verificado/Programado
+                    COALESCE(SUM(total) FILTER (WHERE estado_id = 4), 0) as resueltos -- Reparado
+                FROM reportes_rollup 
+                WHERE nivel = 'usuario' AND user_id = %s
             """, (current_user_id,))
-            stats = c.fetchone()
+            stats = {k: int(v) for k, v in c.fetchone().items()}
             
         return jsonify({"user": user, "stats": stats}), 200
     except Exception as e:
@@ -3678,28 +4317,87 @@ def update_perfil(current_user_id):
 # ============================================
 # MOBILE API: REPORTES
 # ============================================
+REPORTE_CAMPOS_REQUERIDOS = ['categoria_id', 'latitud', 'longitud', 'direccion_referencia']
+
+def insertar_reporte(c, user_id, d):
+    """INSERT compartido por crear_reporte y /api/mobile/sync (cursor RealDict)."""
+    c.execute("""INSERT INTO reportes_ciudadanos 
+                (categoria_id, estado_id, gravedad_id, latitud, longitud, direccion_referencia, 
+                 descripcion, reportado_por, activo)
+                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, TRUE)
+                RETURNING id, numero_folio""",
+             (d['categoria_id'], 1, d.get('gravedad_id', 1), d['latitud'], d['longitud'], 
+              d['direccion_referencia'], d.get('descripcion'), user_id))
+    return c.fetchone()
+
+# Duplicados: mismo categoria_id a menos de DUP_RADIO_M metros en los últimos DUP_DIAS
+DUP_RADIO_M = int(os.getenv("DUP_RADIO_M", 30))
+DUP_DIAS = int(os.getenv("DUP_DIAS", 30))
+ESTADOS_CERRADOS = (4, 5)     # Reparado, Descartado
+
+def buscar_duplicados(c, categoria_id, latitud, longitud, radio_m=DUP_RADIO_M, dias=DUP_DIAS):
+    """
+    Reportes abiertos de la misma categoría cerca del punto. Usa las celdas
+    precalculadas (idx_reportes_dup) para leer solo las vecinas y luego filtra
+    por distancia real. Retorna la lista ordenada por distancia.
+    """
+    lat, lon = float(latitud), float(longitud)
+    x0, x1, y0, y1 = rango_celdas_dup(lat, lon, radio_m)
+    c.execute("""SELECT r.id, r.numero_folio, r.latitud::float8 AS latitud, r.longitud::float8 AS longitud,
+                r.direccion_referencia, r.fecha_reporte, r.estado_id, e.nombre as estado,
+                (SELECT COUNT(*) FROM reportes_adhesiones a WHERE a.reporte_id = r.id) AS adhesiones
+                FROM reportes_ciudadanos r
+                LEFT JOIN estados_reporte e ON e.id = r.estado_id
+                WHERE r.activo = TRUE AND r.categoria_id = %s
+                  AND r.celda_x BETWEEN %s AND %s AND r.celda_y BETWEEN %s AND %s
+                  AND r.fecha_reporte >= NOW() - make_interval(days => %s)
+                  AND r.estado_id <> ALL(%s)""",
+             (categoria_id, x0, x1, y0, y1, dias, list(ESTADOS_CERRADOS)))
+    candidatos = []
+    for r in c.fetchall():
+        dist = distancia_m(lat, lon, r["latitud"], r["longitud"])
+        if dist <= radio_m:
+            r["distancia_m"] = round(dist, 1)
+            candidatos.append(r)
+    candidatos.sort(key=lambda r: r["distancia_m"])
+    return candidatos
+
+def respuesta_duplicados(duplicados):
+    """Cuerpo del 409 de duplicados (crear_reporte y /api/mobile/sync)."""
+    return {"msg": "Existen reportes similares cerca",
+            "duplicados": duplicados,
+            "sumarse_url": f"/api/mobile/reportes/{duplicados[0]['id']}/sumarse"}
+
+class ReporteDuplicado(Exception):
+    """Reportes abiertos similares cerca; `detalle` es el cuerpo del 409."""
+    def __init__(self, duplicados):
+        self.detalle = respuesta_duplicados(duplicados)
+        super().__init__(self.detalle["msg"])
+
 @app.route("/api/mobile/reportes", methods=["POST"])
 @session_required
 def crear_reporte(current_user_id):
+    """
+    Crea un reporte. Si hay reportes abiertos similares cerca responde 409
+    con los candidatos para que el usuario se sume a uno
+    (/api/mobile/reportes/<id>/sumarse); con "forzar": true se crea igual.
+    """
     conn = None
     try:
         d = request.get_json()
-        required = ['categoria_id', 'latitud', 'longitud', 'direccion_referencia']
-        if not all(k in d for k in required):
+        if not all(k in d for k in REPORTE_CAMPOS_REQUERIDOS):
             return jsonify({"msg":"Faltan campos"}), 400
         
         conn = get_db_connection()
         with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as c:
-            c.execute("""INSERT INTO reportes_ciudadanos 
-                        (categoria_id, estado_id, gravedad_id, latitud, longitud, direccion_referencia, 
-                         descripcion, reportado_por, activo)
-                        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, TRUE)
-                        RETURNING id, numero_folio""",
-                     (d['categoria_id'], 1, d.get('gravedad_id', 1), d['latitud'], d['longitud'], 
-                      d['direccion_referencia'], d.get('descripcion'), current_user_id))
-            result = c.fetchone()
+            if not d.get('forzar'):
+                duplicados = buscar_duplicados(c, d['categoria_id'], d['latitud'], d['longitud'])
+                if duplicados:
+                    return jsonify(respuesta_duplicados(duplicados)), 409
+            result = insertar_reporte(c, current_user_id, d)
         
         conn.commit()
+        invalidar_tiles_reporte(d['latitud'], d['longitud'])
         return jsonify({"msg":"Creado","id":result['id'],"numero_folio":result['numero_folio']}), 201
     except Exception as e:
         if conn: conn.rollback()
@@ -3770,36 +4468,414 @@ def get_todos_reportes():
     finally:
         if conn: release_db_connection(conn)
 
-@app.route("/api/mobile/reportes/mis-reportes", methods=["GET"])
-@session_required
-def mis_reportes(current_user_id):
+@app.route("/api/mobile/reportes/mapa", methods=["GET"])
+def get_reportes_mapa():
+    """
+    Reportes dentro del viewport. Bajo ZOOM_PUNTOS agrupa en una grilla
+    (conteo + centroide por celda); desde ese zoom entrega puntos.
+    Parámetros: bbox=oeste,sur,este,norte, zoom, categoria=1,2, estado=1,3
+    """
+    try:
+        oeste, sur, este, norte = parse_bbox(request.args.get("bbox"))
+        zoom = request.args.get("zoom", type=int)
+        if zoom is None or not 0 <= zoom <= ZOOM_MAX:
+            raise ValueError(f"zoom debe estar entre 0 y {ZOOM_MAX}")
+        categorias = parse_ids(request.args.get("categoria"))
+        estados = parse_ids(request.args.get("estado"))
+    except ValueError as e:
+        return jsonify({"msg": str(e)}), 400
+
+    # La expresión coincide con idx_reportes_geo (GiST sobre point)
+    filtros = ["r.activo = TRUE",
+               "point(r.longitud::float8, r.latitud::float8) <@ box(point(%s, %s), point(%s, %s))"]
+    params = [oeste, sur, este, norte]
+    if categorias:
+        filtros.append("r.categoria_id = ANY(%s)")
+        params.append(categorias)
+    if estados:
+        filtros.append("r.estado_id = ANY(%s)")
+        params.append(estados)
+    where_clause = " AND ".join(filtros)
+
     conn = None
     try:
         conn = get_db_connection()
         with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as c:
-            c.execute("""SELECT r.id, r.numero_folio, c.nombre as categoria, e.nombre as estado,
-                        r.direccion_referencia, r.descripcion, r.fecha_reporte
+            if zoom < ZOOM_PUNTOS:
+                celda = tamano_celda(zoom)
+                c.execute(f"""SELECT COUNT(*) AS total,
+                            AVG(r.latitud)::float8 AS latitud, AVG(r.longitud)::float8 AS longitud,
+                            MIN(r.id) AS id
+                            FROM reportes_ciudadanos r
+                            WHERE {where_clause}
+                            GROUP BY floor(r.longitud::float8 / %s), floor(r.latitud::float8 / %s)""",
+                          params + [celda, celda])
+                clusters = c.fetchall()
+                for cl in clusters:
+                    if cl["total"] > 1:
+                        cl["id"] = None     # el id solo identifica celdas de un reporte
+                return jsonify({"modo": "clusters", "zoom": zoom, "celda": celda,
+                                "items": clusters}), 200
+
+            c.execute(f"""SELECT r.id, r.numero_folio, r.latitud::float8 AS latitud,
+                        r.longitud::float8 AS longitud, r.categoria_id, c.nombre as categoria,
+                        r.estado_id, e.nombre as estado, r.gravedad_id, r.direccion_referencia
                         FROM reportes_ciudadanos r
                         LEFT JOIN categorias_reporte c ON c.id = r.categoria_id
                         LEFT JOIN estados_reporte e ON e.id = r.estado_id
-                        WHERE r.reportado_por = %s AND r.activo = TRUE
-                        ORDER BY r.fecha_reporte DESC""", (current_user_id,))
-            reportes = c.fetchall()
-        return jsonify(reportes), 200
+                        WHERE {where_clause}
+                        ORDER BY r.fecha_reporte DESC
+                        LIMIT %s""", params + [MAX_PUNTOS + 1])
+            puntos = c.fetchall()
+        return jsonify({"modo": "puntos", "zoom": zoom,
+                        "truncado": len(puntos) > MAX_PUNTOS,
+                        "items": puntos[:MAX_PUNTOS]}), 200
     except Exception as e:
-        logger.error(f"Error mis reportes: {e}")
+        logger.error(f"Error mapa viewport: {e}")
         return jsonify({"msg":"Error"}), 500
     finally:
         if conn: release_db_connection(conn)
 
 # ============================================
-# MOBILE API: AUXILIAR (Categorías)
+# TILES GEOJSON (reportes / geomapas)
 # ============================================
-@app.route("/api/mobile/categorias", methods=["GET"])
-def get_categorias_mobile():
+tiles_cache = TileCache()
+_geomapas_bbox_listo = False
+
+
+def invalidar_tiles_reporte(latitud, longitud):
+    lat, lon = float(latitud), float(longitud)
+    tiles_cache.invalidar("reportes", (lon, lat, lon, lat))
+
+
+def tile_reportes(cur, z, bbox):
+    """Clusters por celda bajo ZOOM_PUNTOS, reportes individuales desde ahí."""
+    filtro = """r.activo = TRUE AND point(r.longitud::float8, r.latitud::float8)
+                <@ box(point(%s, %s), point(%s, %s))"""
+    if z < ZOOM_PUNTOS:
+        celda = tamano_celda(z)
+        cur.execute(f"""SELECT COUNT(*) AS total,
+                    AVG(r.latitud)::float8 AS latitud, AVG(r.longitud)::float8 AS longitud
+                    FROM reportes_ciudadanos r
+                    WHERE {filtro}
+                    GROUP BY floor(r.longitud::float8 / %s), floor(r.latitud::float8 / %s)""",
+                    (*bbox, celda, celda))
+        return [{"type": "Feature",
+                 "geometry": {"type": "Point", "coordinates": [row["longitud"], row["latitud"]]},
+                 "properties": {"cluster": True, "total": row["total"]}}
+                for row in cur.fetchall()]
+
+    cur.execute(f"""SELECT r.id, r.numero_folio, r.latitud::float8 AS latitud,
+                r.longitud::float8 AS longitud, r.categoria_id, r.estado_id, r.gravedad_id
+                FROM reportes_ciudadanos r
+                WHERE {filtro}
+                LIMIT %s""", (*bbox, MAX_PUNTOS))
+    return [{"type": "Feature",
+             "geometry": {"type": "Point", "coordinates": [row.pop("longitud"), row.pop("latitud")]},
+             "properties": row}
+            for row in cur.fetchall()]
+
+
+def completar_bbox_geomapas(conn):
+    """Calcula el bbox de geomapas anteriores a la columna (una vez por proceso)."""
+    global _geomapas_bbox_listo
+    with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cur:
+        cur.execute("SELECT geomapa_id, geojson FROM proyectos_geomapas WHERE bbox_oeste IS NULL")
+        for row in cur.fetchall():
+            caja = bbox_geojson(row["geojson"])
+            if caja:
+                cur.execute("""UPDATE proyectos_geomapas
+                               SET bbox_oeste = %s, bbox_sur = %s, bbox_este = %s, bbox_norte = %s
+                               WHERE geomapa_id = %s""", (*caja, row["geomapa_id"]))
+    conn.commit()
+    _geomapas_bbox_listo = True
+
+
+def tile_geomapas(cur, z, bbox):
+    cur.execute("""SELECT geomapa_id, proyecto_id, nombre, geojson
+                   FROM proyectos_geomapas
+                   WHERE box(point(bbox_oeste, bbox_sur), point(bbox_este, bbox_norte))
+                         && box(point(%s, %s), point(%s, %s))""", bbox)
+    features = []
+    for row in cur.fetchall():
+        features.extend(recortar_geojson(row["geojson"], bbox, z, {
+            "geomapa_id": row["geomapa_id"],
+            "proyecto_id": row["proyecto_id"],
+            "nombre": row["nombre"],
+        }))
+    return features
+
+
+def servir_tile(capa, z, x, y, generar):
+    if not tile_valido(z, x, y):
+        return jsonify({"message": "Tile fuera de rango"}), 404
+
+    key = (capa, z, x, y)
+    tile = tiles_cache.get(key)
+    if tile is None:
+        generacion = tiles_cache.generacion
+        conn = None
+        try:
+            conn = get_db_connection()
+            if capa == "geomapas" and not _geomapas_bbox_listo:
+                completar_bbox_geomapas(conn)
+            with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cur:
+                tile = coleccion(generar(cur, z, tile_bbox(z, x, y)))
+        except Exception as e:
+            logger.error(f"Error tile {capa}/{z}/{x}/{y}: {e}")
+            return jsonify({"message": "Error interno"}), 500
+        finally:
+            if conn: release_db_connection(conn)
+        tiles_cache.put(key, tile, generacion)
+
+    data, etag = tile
+    resp = app.response_class(data, mimetype="application/geo+json")
+    resp.set_etag(etag)
+    # Siempre revalidar: tras una invalidación el ETag cambia, si no responde 304
+    resp.headers["Cache-Control"] = "no-cache"
+    return resp.make_conditional(request)
+
+
+@app.route("/tiles/reportes/<int:z>/<int:x>/<int:y>", methods=["GET"])
+def tiles_reportes(z, x, y):
+    return servir_tile("reportes", z, x, y, tile_reportes)
+
+
+@app.route("/tiles/geomapas/<int:z>/<int:x>/<int:y>", methods=["GET"])
+@session_required
+def tiles_geomapas(current_user_id, z, x, y):
+    return servir_tile("geomapas", z, x, y, tile_geomapas)
+
+@app.route("/api/mobile/reportes/estadisticas", methods=["GET"])
+def get_estadisticas_reportes():
+    """
+    Conteos de reportes activos desde reportes_rollup (sin recorrer la tabla).
+    Parámetros opcionales: desde, hasta (YYYY-MM-DD) para la serie diaria
+    (por defecto los últimos 30 días), categoria=1,2 para filtrar la serie.
+    """
     conn = None
     try:
-        conn = get_db_connection()
+        hasta = request.args.get("hasta") or datetime.now().strftime("%Y-%m-%d")
+        desde = request.args.get("desde") or (datetime.strptime(hasta, "%Y-%m-%d") - timedelta(days=29)).strftime("%Y-%m-%d")
+        datetime.strptime(desde, "%Y-%m-%d")
+        categorias = parse_ids(request.args.get("categoria"))
+    except ValueError:
+        return jsonify({"msg":"Fechas en formato YYYY-MM-DD"}), 400
+
+    try:
+        conn = get_db_connection()
+        with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as c:
+            c.execute("""SELECT r.categoria_id, c.nombre as categoria, r.estado_id, e.nombre as estado,
+                        r.gravedad_id, g.nombre as gravedad, r.total
+                        FROM reportes_rollup r
+                        LEFT JOIN categorias_reporte c ON c.id = r.categoria_id
+                        LEFT JOIN estados_reporte e ON e.id = r.estado_id
+                        LEFT JOIN reportes_gravedad g ON g.id = r.gravedad_id
+                        WHERE r.nivel = 'cat_estado' AND r.total > 0""")
+            celdas = c.fetchall()
+
+            filtro_cat = "AND categoria_id = ANY(%s)" if categorias else ""
+            c.execute(f"""SELECT dia, SUM(total)::int AS total
+                        FROM reportes_rollup
+                        WHERE nivel = 'dia' AND dia BETWEEN %s AND %s {filtro_cat}
+                        GROUP BY dia HAVING SUM(total) > 0 ORDER BY dia""",
+                     (desde, hasta, categorias) if categorias else (desde, hasta))
+            por_dia = [{"dia": r["dia"].isoformat(), "total": r["total"]} for r in c.fetchall()]
+
+        def agrupar(id_key, nombre_key):
+            acc = {}
+            for cel in celdas:
+                k = cel[id_key]
+                if k not in acc:
+                    acc[k] = {id_key: k, nombre_key: cel[nombre_key], "total": 0}
+                acc[k]["total"] += cel["total"]
+            return sorted(acc.values(), key=lambda x: x[id_key])
+
+        return jsonify({
+            "total": sum(cel["total"] for cel in celdas),
+            "por_estado": agrupar("estado_id", "estado"),
+            "por_categoria": agrupar("categoria_id", "categoria"),
+            "por_gravedad": agrupar("gravedad_id", "gravedad"),
+            "categoria_estado": celdas,
+            "por_dia": por_dia,
+            "desde": desde,
+            "hasta": hasta
+        }), 200
+    except Exception as e:
+        logger.error(f"Error estadisticas reportes: {e}")
+        return jsonify({"msg":"Error"}), 500
+    finally:
+        if conn: release_db_connection(conn)
+
+BUSCAR_LIMITE_DEFAULT = 50
+BUSCAR_LIMITE_MAX = 200
+# Texto buscable: misma expresión que idx_reportes_texto_trgm
+REPORTE_TEXTO_SQL = "(COALESCE(r.numero_folio, '') || ' ' || r.direccion_referencia || ' ' || COALESCE(r.descripcion, ''))"
+
+@app.route("/api/mobile/reportes/buscar", methods=["GET"])
+@session_required
+def buscar_reportes(current_user_id):
+    """
+    Listado paginado de reportes activos para administración.
+    Filtros: estado, categoria, gravedad (listas 1,2), revisado (true/false),
+    desde/hasta (YYYY-MM-DD), reportado_por, q (folio/dirección/descripción),
+    mios=1. Paginación keyset por (fecha_reporte, id) descendente vía `cursor`.
+    En la primera página (o con facetas=1) se agregan conteos por estado,
+    categoría, gravedad y revisado en la misma consulta (GROUPING SETS).
+    Usuarios sin nivel de funcionario solo ven sus propios reportes.
+    """
+    conn = None
+    try:
+        limite = max(1, min(BUSCAR_LIMITE_MAX, request.args.get("limite", BUSCAR_LIMITE_DEFAULT, type=int)))
+        cursor = request.args.get("cursor")
+        keyset = decode_cursor(cursor) if cursor else None
+        filtros = ["r.activo = TRUE"]
+        params = []
+        for arg, col in (("estado", "estado_id"), ("categoria", "categoria_id"), ("gravedad", "gravedad_id")):
+            ids = parse_ids(request.args.get(arg))
+            if ids:
+                filtros.append(f"r.{col} = ANY(%s)")
+                params.append(ids)
+        revisado = request.args.get("revisado")
+        if revisado in ("true", "false", "1", "0"):
+            filtros.append("r.revisado = %s")
+            params.append(revisado in ("true", "1"))
+        if request.args.get("desde"):
+            filtros.append("r.fecha_reporte >= %s")
+            params.append(datetime.strptime(request.args["desde"], "%Y-%m-%d"))
+        if request.args.get("hasta"):
+            filtros.append("r.fecha_reporte < %s")
+            params.append(datetime.strptime(request.args["hasta"], "%Y-%m-%d") + timedelta(days=1))
+        q = (request.args.get("q") or "").strip()
+        if q:
+            filtros.append(f"{REPORTE_TEXTO_SQL} ILIKE %s")
+            params.append(f"%{q}%")
+    except ValueError as e:
+        return jsonify({"msg": str(e) or "Parámetros inválidos"}), 400
+
+    try:
+        conn = get_db_connection()
+        with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as c:
+            c.execute("SELECT nivel_acceso FROM users WHERE user_id = %s", (current_user_id,))
+            u = c.fetchone()
+            es_funcionario = bool(u and (u['nivel_acceso'] or 0) >= 1)
+            reportado_por = request.args.get("reportado_por", type=int)
+            if request.args.get("mios") in ("1", "true") or not es_funcionario:
+                reportado_por = current_user_id
+            if reportado_por is not None:
+                filtros.append("r.reportado_por = %s")
+                params.append(reportado_por)
+            where_clause = " AND ".join(filtros)
+
+            pagina_where = where_clause
+            pagina_params = list(params)
+            if keyset:
+                pagina_where += " AND (r.fecha_reporte, r.id) < (%s, %s)"
+                pagina_params += list(keyset)
+
+            con_facetas = keyset is None or request.args.get("facetas") in ("1", "true")
+            facetas_sql = ""
+            facetas_select = "NULL::json"
+            if con_facetas:
+                facetas_sql = f""",
+                facetas AS (
+                    SELECT CASE WHEN GROUPING(r.estado_id) = 0 THEN 'estado'
+                                WHEN GROUPING(r.categoria_id) = 0 THEN 'categoria'
+                                WHEN GROUPING(r.gravedad_id) = 0 THEN 'gravedad'
+                                WHEN GROUPING(r.revisado) = 0 THEN 'revisado'
+                                ELSE 'total' END AS faceta,
+                           r.estado_id, r.categoria_id, r.gravedad_id, r.revisado,
+                           COUNT(*) AS total
+                    FROM reportes_ciudadanos r
+                    WHERE {where_clause}
+                    GROUP BY GROUPING SETS ((r.estado_id), (r.categoria_id), (r.gravedad_id), (r.revisado), ())
+                )"""
+                facetas_select = """(SELECT json_agg(json_build_object(
+                                'faceta', f.faceta, 'estado_id', f.estado_id, 'categoria_id', f.categoria_id,
+                                'gravedad_id', f.gravedad_id, 'revisado', f.revisado, 'total', f.total,
+                                'nombre', COALESCE(e.nombre, c.nombre, g.nombre)))
+                        FROM facetas f
+                        LEFT JOIN estados_reporte e ON f.faceta = 'estado' AND e.id = f.estado_id
+                        LEFT JOIN categorias_reporte c ON f.faceta = 'categoria' AND c.id = f.categoria_id
+                        LEFT JOIN reportes_gravedad g ON f.faceta = 'gravedad' AND g.id = f.gravedad_id)"""
+
+            c.execute(f"""
+                WITH pagina AS (
+                    SELECT r.id, r.numero_folio, r.categoria_id, c.nombre as categoria,
+                           r.estado_id, e.nombre as estado, r.gravedad_id, g.nombre as gravedad,
+                           r.latitud, r.longitud, r.direccion_referencia, r.descripcion, r.revisado,
+                           r.fecha_reporte, r.fecha_actualizacion,
+                           r.reportado_por, u_rep.nombre as reportado_por_nombre
+                    FROM reportes_ciudadanos r
+                    LEFT JOIN categorias_reporte c ON c.id = r.categoria_id
+                    LEFT JOIN estados_reporte e ON e.id = r.estado_id
+                    LEFT JOIN reportes_gravedad g ON g.id = r.gravedad_id
+                    LEFT JOIN users u_rep ON u_rep.user_id = r.reportado_por
+                    WHERE {pagina_where}
+                    ORDER BY r.fecha_reporte DESC, r.id DESC
+                    LIMIT %s
+                ){facetas_sql}
+                SELECT (SELECT COALESCE(json_agg(p ORDER BY p.fecha_reporte DESC, p.id DESC), '[]'::json)
+                        FROM pagina p) AS items,
+                       {facetas_select} AS facetas
+            """, pagina_params + [limite + 1] + (params if con_facetas else []))
+            row = c.fetchone()
+
+        items = row["items"]
+        siguiente = None
+        if len(items) > limite:
+            items = items[:limite]
+            ultimo = items[-1]
+            siguiente = encode_cursor(datetime.fromisoformat(ultimo["fecha_reporte"]), ultimo["id"])
+
+        facetas = None
+        if con_facetas:
+            facetas = {"total": 0, "estado": [], "categoria": [], "gravedad": [], "revisado": []}
+            claves = {"estado": "estado_id", "categoria": "categoria_id", "gravedad": "gravedad_id", "revisado": "revisado"}
+            for f in row["facetas"] or []:
+                if f["faceta"] == "total":
+                    facetas["total"] = f["total"]
+                    continue
+                facetas[f["faceta"]].append({"valor": f[claves[f["faceta"]]], "nombre": f["nombre"], "total": f["total"]})
+
+        return jsonify({"items": items, "siguiente_cursor": siguiente,
+                        "limite": limite, "facetas": facetas}), 200
+    except Exception as e:
+        logger.error(f"Error buscar reportes: {e}")
+        return jsonify({"msg":"Error"}), 500
+    finally:
+        if conn: release_db_connection(conn)
+
+@app.route("/api/mobile/reportes/mis-reportes", methods=["GET"])
+@session_required
+def mis_reportes(current_user_id):
+    conn = None
+    try:
+        conn = get_db_connection()
+        with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as c:
+            c.execute("""SELECT r.id, r.numero_folio, c.nombre as categoria, e.nombre as estado,
+                        r.direccion_referencia, r.descripcion, r.fecha_reporte
+                        FROM reportes_ciudadanos r
+                        LEFT JOIN categorias_reporte c ON c.id = r.categoria_id
+                        LEFT JOIN estados_reporte e ON e.id = r.estado_id
+                        WHERE r.reportado_por = %s AND r.activo = TRUE
+                        ORDER BY r.fecha_reporte DESC""", (current_user_id,))
+            reportes = c.fetchall()
+        return jsonify(reportes), 200
+    except Exception as e:
+        logger.error(f"Error mis reportes: {e}")
+        return jsonify({"msg":"Error"}), 500
+    finally:
+        if conn: release_db_connection(conn)
+
+# ============================================
+# MOBILE API: AUXILIAR (Categorías)
+# ============================================
+@app.route("/api/mobile/categorias", methods=["GET"])
+def get_categorias_mobile():
+    conn = None
+    try:
+        conn = get_db_connection()
         with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cur:
             cur.execute("SELECT id, nombre FROM categorias_reporte ORDER BY id")
             rows = cur.fetchall()
@@ -3854,9 +4930,186 @@ def add_comentario(current_user_id, rid):
     finally:
         if conn: release_db_connection(conn)
 
+# ============================================
+# MOBILE API: EVENTOS EN VIVO (SSE)
+# ============================================
+def sse_response(gen):
+    return Response(gen, mimetype="text/event-stream", headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no",      # nginx: no acumular el stream
+    })
+
+@app.route("/api/mobile/reportes/eventos", methods=["GET"])
+@session_required
+def reportes_eventos(current_user_id):
+    """
+    Stream SSE de cambios de reportes (creado, actualizado) y comentarios nuevos.
+    Filtros: reporte_id=1,2 (reportes puntuales), mios=1 (reportes del usuario).
+    Sin filtros recibe todo (mapa de administración). EventSource no permite
+    headers: el token va en ?token=. Reanuda desde el header Last-Event-ID.
+    """
+    ids = set(parse_ids(request.args.get("reporte_id")) or [])
+    mios = request.args.get("mios") in ("1", "true")
+
+    def filtro(ev):
+        if ids and ev.get("reporte_id") not in ids:
+            return False
+        if mios and ev.get("user_id") != current_user_id:
+            return False
+        return True
+
+    ultimo_id = request.headers.get("Last-Event-ID") or request.args.get("last_event_id")
+    return sse_response(notificador.stream("reportes_eventos", filtro, ultimo_id))
+
+# ============================================
+# MOBILE API: DUPLICADOS (sumarse / fusionar)
+# ============================================
+@app.route("/api/mobile/reportes/<int:rid>/sumarse", methods=["POST"])
+@session_required
+def sumarse_reporte(current_user_id, rid):
+    """El usuario apoya un reporte existente en vez de crear uno duplicado."""
+    conn = None
+    try:
+        d = request.get_json(silent=True) or {}
+        conn = get_db_connection()
+        with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as c:
+            c.execute("SELECT 1 FROM reportes_ciudadanos WHERE id = %s AND activo = TRUE", (rid,))
+            if not c.fetchone():
+                return jsonify({"msg":"Reporte no encontrado"}), 404
+            c.execute("""INSERT INTO reportes_adhesiones (reporte_id, user_id) VALUES (%s, %s)
+                        ON CONFLICT DO NOTHING""", (rid, current_user_id))
+            if d.get('comentario'):
+                c.execute("INSERT INTO reportes_comentarios (reporte_id, user_id, comentario) VALUES (%s, %s, %s)",
+                         (rid, current_user_id, d['comentario']))
+            c.execute("SELECT COUNT(*) AS n FROM reportes_adhesiones WHERE reporte_id = %s", (rid,))
+            total = c.fetchone()['n']
+        conn.commit()
+        return jsonify({"msg":"Te sumaste al reporte","id":rid,"adhesiones":total}), 200
+    except Exception as e:
+        if conn: conn.rollback()
+        logger.error(f"Error sumarse reporte: {e}")
+        return jsonify({"msg":"Error"}), 500
+    finally:
+        if conn: release_db_connection(conn)
+
+@app.route("/api/mobile/reportes/<int:rid>/duplicados", methods=["GET"])
+@session_required
+def get_duplicados_reporte(current_user_id, rid):
+    """Candidatos a duplicado de un reporte existente (para la vista de gestión)."""
+    conn = None
+    try:
+        conn = get_db_connection()
+        with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as c:
+            c.execute("SELECT categoria_id, latitud, longitud FROM reportes_ciudadanos WHERE id = %s", (rid,))
+            r = c.fetchone()
+            if not r:
+                return jsonify({"msg":"Reporte no encontrado"}), 404
+            radio = request.args.get("radio", DUP_RADIO_M, type=int)
+            dias = request.args.get("dias", DUP_DIAS, type=int)
+            candidatos = [x for x in buscar_duplicados(c, r['categoria_id'], r['latitud'], r['longitud'], radio, dias)
+                          if x['id'] != rid]
+        return jsonify(candidatos), 200
+    except Exception as e:
+        logger.error(f"Error duplicados reporte: {e}")
+        return jsonify({"msg":"Error"}), 500
+    finally:
+        if conn: release_db_connection(conn)
+
+@app.route("/api/mobile/reportes/<int:rid>/fusionar", methods=["POST"])
+@session_required
+def fusionar_reportes(current_user_id, rid):
+    """
+    Fusiona duplicados en el reporte `rid` (solo funcionarios): mueve fotos,
+    comentarios y adhesiones, suma a los autores de los duplicados como
+    adhesiones y desactiva los duplicados dejando fusionado_en = rid.
+    Body: {"duplicados": [id, ...]}
+    """
+    conn = None
+    try:
+        d = request.get_json() or {}
+        dups = [int(x) for x in d.get('duplicados') or [] if int(x) != rid]
+        if not dups:
+            return jsonify({"msg":"Sin duplicados para fusionar"}), 400
+
+        conn = get_db_connection()
+        with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as c:
+            c.execute("SELECT nivel_acceso FROM users WHERE user_id = %s", (current_user_id,))
+            u = c.fetchone()
+            if not u or (u['nivel_acceso'] or 0) < 1:
+                return jsonify({"msg":"No autorizado"}), 403
+
+            c.execute("SELECT reportado_por FROM reportes_ciudadanos WHERE id = %s AND activo = TRUE FOR UPDATE", (rid,))
+            principal = c.fetchone()
+            if not principal:
+                return jsonify({"msg":"Reporte no encontrado"}), 404
+
+            c.execute("""SELECT id FROM reportes_ciudadanos
+                        WHERE id = ANY(%s) AND activo = TRUE FOR UPDATE""", (dups,))
+            dups = [row['id'] for row in c.fetchall()]
+            if not dups:
+                return jsonify({"msg":"Duplicados no encontrados o ya fusionados"}), 404
+
+            c.execute("UPDATE reportes_fotos SET reporte_id = %s WHERE reporte_id = ANY(%s)", (rid, dups))
+            fotos = c.rowcount
+            c.execute("UPDATE reportes_comentarios SET reporte_id = %s WHERE reporte_id = ANY(%s)", (rid, dups))
+            comentarios = c.rowcount
+            c.execute("""INSERT INTO reportes_adhesiones (reporte_id, user_id, creado_en)
+                        SELECT %s, user_id, creado_en FROM reportes_adhesiones WHERE reporte_id = ANY(%s)
+                        UNION ALL
+                        SELECT %s, reportado_por, fecha_reporte FROM reportes_ciudadanos WHERE id = ANY(%s)
+                        ON CONFLICT DO NOTHING""", (rid, dups, rid, dups))
+            c.execute("DELETE FROM reportes_adhesiones WHERE reporte_id = ANY(%s) OR (reporte_id = %s AND user_id = %s)",
+                     (dups, rid, principal['reportado_por']))
+            c.execute("""UPDATE reportes_ciudadanos
+                        SET activo = FALSE, fusionado_en = %s,
+                            actualizado_por = %s, fecha_actualizacion = NOW()
+                        WHERE id = ANY(%s)
+                        RETURNING id, latitud, longitud""", (rid, current_user_id, dups))
+            fusionados = c.fetchall()
+        conn.commit()
+
+        for r in fusionados:
+            invalidar_tiles_reporte(r['latitud'], r['longitud'])
+        log_control(current_user_id, "fusionar_reportes", modulo='reportes',
+                    entidad_tipo='reporte', entidad_id=rid,
+                    detalle=f"Fusionó reportes {dups} en {rid}")
+        return jsonify({"msg":"Reportes fusionados","id":rid,"fusionados":dups,
+                        "fotos_movidas":fotos,"comentarios_movidos":comentarios}), 200
+    except Exception as e:
+        if conn: conn.rollback()
+        logger.error(f"Error fusionar reportes: {e}")
+        return jsonify({"msg":"Error"}), 500
+    finally:
+        if conn: release_db_connection(conn)
+
 # ============================================
 # MOBILE API: ACTUALIZACIÓN ESTADO/GRAVEDAD
 # ============================================
+def campos_actualizacion_reporte(d):
+    """SET de la actualización de un reporte a partir del body (lista vacía si no hay nada)."""
+    updates = []
+    vals = []
+    
+    if 'estado_id' in d:
+        updates.append("estado_id = %s")
+        vals.append(int(d['estado_id']))
+    if 'gravedad_id' in d:
+        updates.append("gravedad_id = %s")
+        vals.append(int(d['gravedad_id']))
+    if 'revisado' in d:
+        updates.append("revisado = %s")
+        vals.append(bool(d['revisado']))
+    if 'direccion_referencia' in d:
+        updates.append("direccion_referencia = %s")
+        vals.append(d['direccion_referencia'])
+    if 'descripcion' in d:
+        updates.append("descripcion = %s")
+        vals.append(d['descripcion'])
+    if 'categoria_id' in d:
+        updates.append("categoria_id = %s")
+        vals.append(int(d['categoria_id']))
+    return updates, vals
+
 @app.route("/api/mobile/reportes/<int:rid>/actualizar", methods=["POST"])
 @session_required
 def actualizar_reporte(current_user_id, rid):
@@ -3864,27 +5117,7 @@ def actualizar_reporte(current_user_id, rid):
     try:
         d = request.get_json()
         
-        updates = []
-        vals = []
-        
-        if 'estado_id' in d:
-            updates.append("estado_id = %s")
-            vals.append(int(d['estado_id']))
-        if 'gravedad_id' in d:
-            updates.append("gravedad_id = %s")
-            vals.append(int(d['gravedad_id']))
-        if 'revisado' in d:
-            updates.append("revisado = %s")
-            vals.append(bool(d['revisado']))
-        if 'direccion_referencia' in d:
-            updates.append("direccion_referencia = %s")
-            vals.append(d['direccion_referencia'])
-        if 'descripcion' in d:
-            updates.append("descripcion = %s")
-            vals.append(d['descripcion'])
-        if 'categoria_id' in d:
-            updates.append("categoria_id = %s")
-            vals.append(int(d['categoria_id']))
+        updates, vals = campos_actualizacion_reporte(d)
             
         if not updates:
             return jsonify({"msg":"Nada que actualizar"}), 400
@@ -3898,13 +5131,14 @@ def actualizar_reporte(current_user_id, rid):
         
         conn = get_db_connection()
         with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as c:
-            c.execute(f"UPDATE reportes_ciudadanos SET {', '.join(updates)} WHERE id = %s RETURNING id", tuple(vals))
+            c.execute(f"UPDATE reportes_ciudadanos SET {', '.join(updates)} WHERE id = %s RETURNING id, latitud, longitud", tuple(vals))
             result = c.fetchone()
             
             if not result:
                 return jsonify({"msg":"Reporte no encontrado"}), 404
             
         conn.commit()
+        invalidar_tiles_reporte(result['latitud'], result['longitud'])
         return jsonify({"msg":"Reporte actualizado"}), 200
     except Exception as e:
         if conn: conn.rollback()
@@ -3929,7 +5163,9 @@ def ver_fotos_reporte(rid):
     try:
         conn = get_db_connection()
         with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as c:
-            c.execute("SELECT id, ruta_archivo FROM reportes_fotos WHERE reporte_id = %s", (rid,))
+            c.execute("""SELECT id, ruta_archivo, estado_proceso, variantes,
+                        latitud, longitud, fecha_captura, ancho_px, alto_px
+                        FROM reportes_fotos WHERE reporte_id = %s ORDER BY id""", (rid,))
             fotos = c.fetchall()
         return jsonify(fotos), 200
     except Exception as e:
@@ -3953,33 +5189,40 @@ def subir_fotos(current_user_id, rid):
         if not files: 
             return jsonify({"msg":"Sin fotos recibidas en backend"}), 400
         
-        conn = get_db_connection()
-        guardadas = []
         ym = time.strftime("%Y/%m")
         udir = os.path.join(FOTOS_DIR, ym)
         os.makedirs(udir, exist_ok=True)
-        
+
+        # 1. Volcar cada archivo a disco en streaming (sin leerlo completo en memoria)
+        archivos = []
         for i, f in enumerate(files):
             if not f: continue
-            
-            logger.info(f"Procesando archivo: {f.filename} ({f.content_type})")
-            
-            # Guardado DIRECTO sin optimización para probar
+
             ts = int(time.time()*1000) + i
             fname = secure_filename(f"rep_{rid}_{ts}_{f.filename}")
             fpath = os.path.join(udir, fname)
-            f.save(fpath) # Guardado nativo de Flask/Werkzeug
-            
-            logger.info(f"Guardado en disco: {fpath}")
-            
-            url = f"/fotos_reportes/{ym}/{fname}"
-            with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as c:
-                c.execute("INSERT INTO reportes_fotos (reporte_id, ruta_archivo, subido_por) VALUES (%s, %s, %s) RETURNING id",
-                         (rid, url, current_user_id))
-                fid = c.fetchone()['id']
-            guardadas.append({"id":fid,"url":url})
-        
+            f.save(fpath)
+            archivos.append((fpath, f"/fotos_reportes/{ym}/{fname}"))
+
+        if not archivos:
+            return jsonify({"msg":"Sin fotos recibidas en backend"}), 400
+
+        # 2. Un solo INSERT multi-fila
+        conn = get_db_connection()
+        with conn.cursor() as c:
+            rows = psycopg2.extras.execute_values(c,
+                """INSERT INTO reportes_fotos (reporte_id, ruta_archivo, subido_por, estado_proceso)
+                   VALUES %s RETURNING id""",
+                [(rid, url, current_user_id, 'pendiente') for _, url in archivos],
+                fetch=True)
         conn.commit()
+
+        # 3. Variantes y EXIF en el pool, fuera del request
+        guardadas = []
+        for (fpath, url), (fid,) in zip(archivos, rows):
+            fotos_pool.submit(procesar_foto_reporte, fid, fpath, f"/fotos_reportes/{ym}")
+            guardadas.append({"id":fid,"url":url,"estado_proceso":"pendiente"})
+
         logger.info(f"--- FIN SUBIDA: {len(guardadas)} guardadas ---")
         return jsonify({"msg":f"{len(guardadas)} fotos subidas","fotos":guardadas}), 200
     except Exception as e:
@@ -3990,39 +5233,438 @@ def subir_fotos(current_user_id, rid):
         if conn: release_db_connection(conn)
 
 
+# ============================================
+# MOBILE API: SINCRONIZACIÓN OFFLINE (lotes idempotentes)
+# ============================================
+SYNC_MAX_OPS = 100
+SYNC_RETENCION_HORAS = int(os.getenv("SYNC_RETENCION_HORAS", 72))
+_sync_ultima_purga = 0.0
+
+
+def _sync_reporte_id(datos, refs):
+    """reporte_id directo o `reporte_ref` a un reporte creado antes en el mismo lote."""
+    if datos.get("reporte_ref") is not None:
+        if datos["reporte_ref"] not in refs:
+            raise ValueError(f"reporte_ref desconocida: {datos['reporte_ref']}")
+        return refs[datos["reporte_ref"]]
+    if datos.get("reporte_id") is None:
+        raise ValueError("Falta reporte_id o reporte_ref")
+    return int(datos["reporte_id"])
+
+
+def _sync_crear_reporte(c, user_id, datos, refs, despues, archivos):
+    if not all(k in datos for k in REPORTE_CAMPOS_REQUERIDOS):
+        raise ValueError("Faltan campos")
+    if not datos.get("forzar"):
+        duplicados = buscar_duplicados(c, datos['categoria_id'], datos['latitud'], datos['longitud'])
+        if duplicados:
+            raise ReporteDuplicado(duplicados)
+    r = insertar_reporte(c, user_id, datos)
+    despues.append(lambda: invalidar_tiles_reporte(datos['latitud'], datos['longitud']))
+    return {"id": r["id"], "numero_folio": r["numero_folio"]}
+
+
+def _sync_comentario(c, user_id, datos, refs, despues, archivos):
+    texto = datos.get("comentario")
+    if not texto:
+        raise ValueError("Texto vacío")
+    c.execute("INSERT INTO reportes_comentarios (reporte_id, user_id, comentario) VALUES (%s, %s, %s) RETURNING id",
+             (_sync_reporte_id(datos, refs), user_id, texto))
+    return {"id": c.fetchone()["id"]}
+
+
+def _sync_actualizar_reporte(c, user_id, datos, refs, despues, archivos):
+    updates, vals = campos_actualizacion_reporte(datos)
+    if not updates:
+        raise ValueError("Nada que actualizar")
+    updates += ["actualizado_por = %s", "fecha_actualizacion = NOW()"]
+    vals += [user_id, _sync_reporte_id(datos, refs)]
+    c.execute(f"UPDATE reportes_ciudadanos SET {', '.join(updates)} WHERE id = %s RETURNING id, latitud, longitud", tuple(vals))
+    r = c.fetchone()
+    if not r:
+        raise LookupError("Reporte no encontrado")
+    despues.append(lambda: invalidar_tiles_reporte(r['latitud'], r['longitud']))
+    return {"id": r["id"]}
+
+
+def _sync_foto(c, user_id, datos, refs, despues, archivos):
+    """
+    La foto viaja como parte multipart; `archivo` es el nombre del campo.
+    La ruta escrita se anota en `archivos` para borrarla si la operación
+    o el lote se revierten.
+    """
+    f = request.files.get(datos.get("archivo") or "")
+    if not f:
+        raise ValueError("Archivo no incluido en el lote")
+    rid = _sync_reporte_id(datos, refs)
+    ym = time.strftime("%Y/%m")
+    udir = os.path.join(FOTOS_DIR, ym)
+    os.makedirs(udir, exist_ok=True)
+    fname = secure_filename(f"rep_{rid}_{int(time.time()*1000)}_{f.filename}")
+    fpath = os.path.join(udir, fname)
+    archivos.append(fpath)
+    f.save(fpath)
+    url = f"/fotos_reportes/{ym}/{fname}"
+    c.execute("""INSERT INTO reportes_fotos (reporte_id, ruta_archivo, subido_por, estado_proceso)
+                 VALUES (%s, %s, %s, 'pendiente') RETURNING id""", (rid, url, user_id))
+    fid = c.fetchone()["id"]
+    despues.append(lambda: fotos_pool.submit(procesar_foto_reporte, fid, fpath, f"/fotos_reportes/{ym}"))
+    return {"id": fid, "url": url, "estado_proceso": "pendiente"}
+
+
+SYNC_OPERACIONES = {
+    "crear_reporte": _sync_crear_reporte,
+    "comentario": _sync_comentario,
+    "actualizar_reporte": _sync_actualizar_reporte,
+    "foto": _sync_foto,
+}
+
+
+def _sync_validar(op):
+    """Mensaje de error si la operación está mal formada, None si es válida."""
+    if not isinstance(op, dict):
+        return "La operación debe ser un objeto"
+    clave = op.get("clave")
+    if not clave or not isinstance(clave, str) or len(clave) > 100:
+        return "La operación requiere una clave (máx. 100 caracteres)"
+    tipo = op.get("tipo")
+    if not isinstance(tipo, str) or tipo not in SYNC_OPERACIONES:
+        return f"Tipo de operación no soportado: {tipo}"
+    if not isinstance(op.get("datos") or {}, dict):
+        return "datos debe ser un objeto"
+    if op.get("ref") is not None and not isinstance(op["ref"], (str, int)):
+        return "ref debe ser texto o número"
+    return None
+
+
+def _sync_borrar_archivos(archivos):
+    """Borra fotos escritas por operaciones que no llegaron a confirmarse."""
+    for fpath in archivos:
+        try:
+            os.remove(fpath)
+        except OSError as e:
+            logger.warning(f"sync: no se pudo borrar {fpath}: {e}")
+
+
+def _sync_purgar_claves(c):
+    """Borra claves vencidas como máximo una vez cada 10 minutos por proceso."""
+    global _sync_ultima_purga
+    if time.time() - _sync_ultima_purga < 600:
+        return
+    _sync_ultima_purga = time.time()
+    c.execute("DELETE FROM mobile_sync_claves WHERE creado_en < NOW() - make_interval(hours => %s)",
+              (SYNC_RETENCION_HORAS,))
+
+
+@app.route("/api/mobile/sync", methods=["POST"])
+@session_required
+def mobile_sync(current_user_id):
+    """
+    Aplica un lote de operaciones offline en una sola transacción.
+
+    Body JSON (o campo multipart `operaciones` con el JSON si hay fotos):
+      {"atomico": false,
+       "operaciones": [{"clave": "<uuid>", "tipo": "crear_reporte", "ref": "tmp1", "datos": {...}},
+                       {"clave": "<uuid>", "tipo": "comentario", "datos": {"reporte_ref": "tmp1", ...}},
+                       {"clave": "<uuid>", "tipo": "foto", "datos": {"reporte_ref": "tmp1", "archivo": "f1"}}]}
+
+    crear_reporte revisa duplicados igual que POST /api/mobile/reportes: si
+    hay reportes abiertos similares cerca la operación falla con
+    `duplicados` y `sumarse_url` (con "forzar": true en datos se crea igual).
+
+    Cada operación corre en un SAVEPOINT: si falla (o está mal formada) se
+    informa su error y el resto del lote sigue (con atomico=true cualquier
+    error revierte todo). Las fotos de operaciones revertidas se borran.
+    La clave de idempotencia se guarda junto al resultado en la misma
+    transacción; un reintento con la misma clave devuelve el resultado
+    guardado (`repetida: true`) sin volver a aplicar la operación.
+    """
+    conn = None
+    archivos = []   # fotos escritas en disco, hasta el COMMIT
+    try:
+        if request.files or request.form:
+            try:
+                body = json.loads(request.form.get("operaciones") or "{}")
+            except ValueError:
+                return jsonify({"msg":"Campo operaciones no es JSON válido"}), 400
+        else:
+            body = request.get_json(silent=True) or {}
+        if isinstance(body, list):
+            body = {"operaciones": body}
+        if not isinstance(body, dict) or not isinstance(body.get("operaciones") or [], list):
+            return jsonify({"msg":"Se espera una lista de operaciones"}), 400
+        ops = body.get("operaciones") or []
+        atomico = bool(body.get("atomico"))
+        if not ops:
+            return jsonify({"msg":"Lote vacío"}), 400
+        if len(ops) > SYNC_MAX_OPS:
+            return jsonify({"msg":f"Máximo {SYNC_MAX_OPS} operaciones por lote"}), 400
+
+        resultados = []
+        refs = {}
+        despues = []
+        conn = get_db_connection()
+        with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as c:
+            _sync_purgar_claves(c)
+            for op in ops:
+                error = _sync_validar(op)
+                if error:
+                    res = {"clave": None, "tipo": None, "ok": False, "error": error}
+                    if isinstance(op, dict):
+                        res.update(clave=op.get("clave"), tipo=op.get("tipo"))
+                    resultados.append(res)
+                    if atomico:
+                        conn.rollback()
+                        _sync_borrar_archivos(archivos)
+                        return jsonify({"msg":"Lote revertido", "ok": False, "resultados": resultados}), 409
+                    continue
+                clave, tipo = op["clave"], op["tipo"]
+                res = {"clave": clave, "tipo": tipo}
+                c.execute("SAVEPOINT sync_op")
+                # Reservar la clave: bloquea reintentos concurrentes hasta el COMMIT
+                # y recupera claves vencidas que aún no se purgan
+                c.execute("""INSERT INTO mobile_sync_claves (user_id, clave, tipo, resultado)
+                             VALUES (%s, %s, %s, '{}'::jsonb)
+                             ON CONFLICT (user_id, clave) DO UPDATE
+                                SET tipo = EXCLUDED.tipo, resultado = EXCLUDED.resultado, creado_en = NOW()
+                                WHERE mobile_sync_claves.creado_en < NOW() - make_interval(hours => %s)
+                             RETURNING 1""", (current_user_id, clave, tipo, SYNC_RETENCION_HORAS))
+                if c.fetchone() is None:
+                    c.execute("RELEASE SAVEPOINT sync_op")
+                    c.execute("SELECT resultado FROM mobile_sync_claves WHERE user_id = %s AND clave = %s",
+                              (current_user_id, clave))
+                    res.update(ok=True, repetida=True, resultado=c.fetchone()["resultado"])
+                else:
+                    n_despues, n_archivos = len(despues), len(archivos)
+                    try:
+                        resultado = SYNC_OPERACIONES[tipo](c, current_user_id, op.get("datos") or {},
+                                                           refs, despues, archivos)
+                        c.execute("UPDATE mobile_sync_claves SET resultado = %s WHERE user_id = %s AND clave = %s",
+                                  (psycopg2.extras.Json(resultado), current_user_id, clave))
+                        c.execute("RELEASE SAVEPOINT sync_op")
+                        res.update(ok=True, repetida=False, resultado=resultado)
+                    except Exception as e:
+                        c.execute("ROLLBACK TO SAVEPOINT sync_op")
+                        _sync_borrar_archivos(archivos[n_archivos:])
+                        del despues[n_despues:], archivos[n_archivos:]
+                        res.update(ok=False, error=str(e))
+                        if isinstance(e, ReporteDuplicado):
+                            res.update(duplicados=e.detalle["duplicados"], sumarse_url=e.detalle["sumarse_url"])
+                        if atomico:
+                            conn.rollback()
+                            _sync_borrar_archivos(archivos)
+                            resultados.append(res)
+                            return jsonify({"msg":"Lote revertido", "ok": False, "resultados": resultados}), 409
+                if res["ok"] and tipo == "crear_reporte" and op.get("ref") is not None:
+                    refs[op["ref"]] = res["resultado"]["id"]
+                resultados.append(res)
+        conn.commit()
+        archivos = []
+
+        for fn in despues:
+            try:
+                fn()
+            except Exception as e:
+                logger.warning(f"sync: tarea posterior falló: {e}")
+
+        return jsonify({"ok": all(r["ok"] for r in resultados), "refs": refs,
+                        "resultados": resultados}), 200
+    except Exception as e:
+        if conn: conn.rollback()
+        _sync_borrar_archivos(archivos)
+        logger.error(f"Error sync: {e}", exc_info=True)
+        return jsonify({"msg":"Error"}), 500
+    finally:
+        if conn: release_db_connection(conn)
+
+
 # ================================================================
 # MÓDULO DE CONTROL – Endpoints de auditoría y trazabilidad
 # ================================================================
 
+# Registro de acciones de solo lectura enviadas por el frontend (en lotes)
+REGISTRO_MAX_EVENTOS = 200                                            # por request
+REGISTRO_DEDUP_S = int(os.getenv("CONTROL_DEDUP_S", 30))             # 0 = sin dedup
+REGISTRO_MUESTREO = float(os.getenv("CONTROL_MUESTREO_VISTAS", 1.0))  # fracción de vistas que se guarda
+REGISTRO_DEDUP_MAX = 50000
+
+vistas_recientes = OrderedDict()    # (user_id, accion, entidad_tipo, entidad_id) -> último registro
+vistas_lock = threading.Lock()
+
+
+def _es_vista(accion):
+    return accion.startswith("ver_")
+
+
+def filtrar_vistas(user_id, eventos):
+    """
+    Descarta vistas repetidas (mismo usuario, acción y entidad dentro de
+    REGISTRO_DEDUP_S) y, si REGISTRO_MUESTREO < 1, guarda solo esa fracción
+    de las vistas. Las acciones que no son vistas pasan siempre.
+    """
+    ahora = time.monotonic()
+    resultado = []
+    with vistas_lock:
+        for ev in eventos:
+            if not _es_vista(ev["accion"]):
+                resultado.append(ev)
+                continue
+            if REGISTRO_DEDUP_S > 0:
+                clave = (user_id, ev["accion"], ev["entidad_tipo"], ev["entidad_id"])
+                ultimo = vistas_recientes.get(clave)
+                if ultimo is not None and ahora - ultimo < REGISTRO_DEDUP_S:
+                    continue
+                vistas_recientes[clave] = ahora
+                vistas_recientes.move_to_end(clave)
+                while len(vistas_recientes) > REGISTRO_DEDUP_MAX:
+                    vistas_recientes.popitem(last=False)
+            if REGISTRO_MUESTREO < 1 and secrets.randbelow(10**6) >= REGISTRO_MUESTREO * 10**6:
+                continue
+            resultado.append(ev)
+    return resultado
+
+
+def _evento_registro(data):
+    """Normaliza un evento del frontend; None si no es un objeto."""
+    if not isinstance(data, dict):
+        return None
+    entidad_id = data.get("entidad_id")
+    try:
+        entidad_id = int(entidad_id) if entidad_id not in (None, "") else None
+    except (TypeError, ValueError):
+        entidad_id = None
+    return {
+        "accion":         str(data.get("accion") or "accion_desconocida")[:80],
+        "modulo":         str(data.get("modulo") or "proyectos")[:40],
+        "entidad_tipo":   data.get("entidad_tipo"),
+        "entidad_id":     entidad_id,
+        "entidad_nombre": data.get("entidad_nombre"),
+        "exitoso":        data.get("exitoso", True) is not False,
+        "detalle":        data.get("detalle"),
+    }
+
+
 @app.route("/control/registrar", methods=["POST"])
 @session_required
 def control_registrar(current_user_id):
     """
     Endpoint que el frontend llama para registrar acciones de solo-lectura
     (ver_proyecto, ver_dashboard, ver_lista, etc.) que no pasan por otros endpoints.
+    Acepta un evento, una lista de eventos o {"eventos": [...]}; también el
+    cuerpo text/plain de navigator.sendBeacon (token en ?token=). Todo el
+    lote se escribe con un solo INSERT multi-fila.
     """
     conn = None
     try:
-        data = request.get_json() or {}
-        accion        = data.get("accion", "accion_desconocida")[:80]
-        modulo        = data.get("modulo", "proyectos")[:40]
-        entidad_tipo  = data.get("entidad_tipo")
-        entidad_id    = data.get("entidad_id")
-        entidad_nombre= data.get("entidad_nombre")
-        detalle       = data.get("detalle")
-
-        log_control(
-            current_user_id, accion, modulo,
-            entidad_tipo=entidad_tipo,
-            entidad_id=entidad_id,
-            entidad_nombre=entidad_nombre,
-            detalle=detalle
-        )
-        return jsonify({"ok": True}), 201
+        data = request.get_json(force=True, silent=True)
+        if isinstance(data, dict) and isinstance(data.get("eventos"), list):
+            data = data["eventos"]
+        if not isinstance(data, list):
+            data = [data or {}]
+        if len(data) > REGISTRO_MAX_EVENTOS:
+            return jsonify({"error": f"Máximo {REGISTRO_MAX_EVENTOS} eventos por request"}), 413
+
+        eventos = [ev for ev in map(_evento_registro, data) if ev]
+        guardar = filtrar_vistas(current_user_id, eventos)
+        if guardar:
+            ip = request.remote_addr
+            ua = request.headers.get('User-Agent', '')[:500]
+            ep = request.path[:200]
+            conn = get_db_connection()
+            with conn.cursor() as cur:
+                psycopg2.extras.execute_values(cur, """
+                    INSERT INTO control_actividad
+                        (user_id, accion, modulo,
+                         entidad_tipo, entidad_id, entidad_nombre,
+                         exitoso, detalle,
+                         ip_origen, user_agent, endpoint)
+                    VALUES %s
+                """, [(current_user_id, ev["accion"], ev["modulo"],
+                       ev["entidad_tipo"], ev["entidad_id"], ev["entidad_nombre"],
+                       ev["exitoso"], ev["detalle"],
+                       ip, ua, ep) for ev in guardar], page_size=REGISTRO_MAX_EVENTOS)
+            conn.commit()
+        return jsonify({"ok": True, "recibidos": len(eventos), "registrados": len(guardar)}), 201
     except Exception as e:
+        if conn: conn.rollback()
         logger.error(f"Error en control_registrar: {e}")
         return jsonify({"error": str(e)}), 500
+    finally:
+        if conn: release_db_connection(conn)
+
+
+
+# Texto libre de control_actividad; idx_ctrl_texto_trgm (control.sql) indexa
+# exactamente esta expresión
+CONTROL_TEXTO_SQL = "(COALESCE(ca.detalle, '') || E'\\n' || COALESCE(ca.entidad_nombre, ''))"
+
+# Conteo exacto de /control/actividad: solo a pedido y cacheado por filtros
+CONTEO_ACTIVIDAD_TTL_S = int(os.getenv("CONTROL_CONTEO_TTL_S", 60))
+CONTEO_ACTIVIDAD_MAX = 200
 
+conteos_actividad = OrderedDict()    # (where, params) -> (expira, total)
+conteos_actividad_lock = threading.Lock()
+
+
+def conteo_actividad_estimado(cur, where_clause, params):
+    """
+    Sin filtros: suma de reltuples de las particiones (estadísticas de
+    ANALYZE); las que aún no tienen ANALYZE (reltuples = -1, p. ej. recién
+    creadas por particiones.mantener) usan la estimación del planner, o 0
+    si están vacías en disco. Con filtros: filas estimadas por el planner
+    para la consulta.
+    """
+    if not where_clause:
+        cur.execute("""
+            SELECT
+                COALESCE(SUM(c.reltuples) FILTER (WHERE c.reltuples >= 0), 0)::BIGINT AS total,
+                ARRAY_AGG(c.oid::regclass::TEXT) FILTER (
+                    WHERE c.reltuples < 0 AND pg_relation_size(c.oid) > 0) AS sin_analyze
+            FROM pg_inherits i
+            JOIN pg_class c ON c.oid = i.inhrelid
+            WHERE i.inhparent = 'control_actividad'::regclass
+        """)
+        row = cur.fetchone()
+        total = row["total"]
+        for particion in row["sin_analyze"] or []:
+            # Nombre desde pg_class (regclass ya entrecomillado)
+            cur.execute(f"EXPLAIN (FORMAT JSON) SELECT 1 FROM {particion}")
+            total += int(cur.fetchone()["QUERY PLAN"][0]["Plan"]["Plan Rows"])
+        return total
+    cur.execute(f"""
+        EXPLAIN (FORMAT JSON)
+        SELECT 1
+        FROM control_actividad ca
+        LEFT JOIN users u ON u.user_id = ca.user_id
+        {where_clause}
+    """, params)
+    plan = cur.fetchone()["QUERY PLAN"]
+    return int(plan[0]["Plan"]["Plan Rows"])
+
+
+def conteo_actividad_exacto(cur, where_clause, params):
+    key = (where_clause, tuple(params))
+    ahora = time.time()
+    with conteos_actividad_lock:
+        cached = conteos_actividad.get(key)
+        if cached and cached[0] > ahora:
+            conteos_actividad.move_to_end(key)
+            return cached[1]
+
+    cur.execute(f"""
+        SELECT COUNT(*) AS total
+        FROM control_actividad ca
+        LEFT JOIN users u ON u.user_id = ca.user_id
+        {where_clause}
+    """, params)
+    total = cur.fetchone()["total"]
+
+    with conteos_actividad_lock:
+        conteos_actividad[key] = (ahora + CONTEO_ACTIVIDAD_TTL_S, total)
+        conteos_actividad.move_to_end(key)
+        while len(conteos_actividad) > CONTEO_ACTIVIDAD_MAX:
+            conteos_actividad.popitem(last=False)
+    return total
 
 
 @app.route("/control/actividad", methods=["GET"])
@@ -4031,11 +5673,19 @@ def control_actividad(current_user_id):
     """
     Historial completo de actividad de usuarios.
     Parámetros: user_id, accion, modulo, fecha_desde, fecha_hasta,
-                entidad_tipo, entidad_id, page (default 1), per_page (default 50)
+                entidad_tipo, entidad_id, q, per_page (default 50)
+    Paginación keyset por (fecha, id) descendente con `cursor` (la respuesta
+    trae `siguiente_cursor`); `page` se mantiene por compatibilidad (OFFSET).
+    `total` es una estimación (total_estimado=true) salvo con conteo=exacto,
+    que se cachea por combinación de filtros CONTROL_CONTEO_TTL_S segundos.
     """
     conn = None
     try:
-        conn = get_db_connection()
+        cursor = request.args.get("cursor")
+        try:
+            keyset = decode_cursor(cursor) if cursor else None
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
 
         # Filtros opcionales
         filtros = []
@@ -4063,8 +5713,8 @@ def control_actividad(current_user_id):
 
         fecha_hasta = request.args.get("fecha_hasta")
         if fecha_hasta:
-            filtros.append("ca.fecha <= %s")
-            params.append(fecha_hasta + " 23:59:59")
+            filtros.append("ca.fecha < %s::date + 1")
+            params.append(fecha_hasta)
 
         entidad_tipo = request.args.get("entidad_tipo")
         if entidad_tipo:
@@ -4076,30 +5726,33 @@ def control_actividad(current_user_id):
             filtros.append("ca.entidad_id = %s")
             params.append(int(entidad_id))
 
-        # Búsqueda por texto libre
+        # Búsqueda por texto libre: trigramas sobre CONTROL_TEXTO_SQL y, para
+        # el nombre de usuario, ids resueltos antes (initplan) para que el OR
+        # sea un BitmapOr de índices y no un filtro sobre el join completo
         q = request.args.get("q")
         if q:
-            filtros.append("(ca.detalle ILIKE %s OR ca.entidad_nombre ILIKE %s OR u.nombre ILIKE %s)")
-            params += [f"%{q}%", f"%{q}%", f"%{q}%"]
+            filtros.append(f"""({CONTROL_TEXTO_SQL} ILIKE %s
+                OR ca.user_id = ANY(ARRAY(SELECT user_id FROM users WHERE nombre ILIKE %s)))""")
+            params += [f"%{q}%", f"%{q}%"]
 
         where_clause = ("WHERE " + " AND ".join(filtros)) if filtros else ""
 
         # Paginación
-        page     = max(1, int(request.args.get("page", 1)))
         per_page = min(200, max(10, int(request.args.get("per_page", 50))))
-        offset   = (page - 1) * per_page
+        page = request.args.get("page", type=int) if not keyset else None
+        pagina_filtros = list(filtros)
+        pagina_params = list(params)
+        offset_sql = ""
+        if keyset:
+            pagina_filtros.append("(ca.fecha, ca.id) < (%s, %s)")
+            pagina_params += [keyset[0], keyset[1]]
+        elif page and page > 1:
+            offset_sql = f"OFFSET {(page - 1) * per_page}"
+        pagina_where = ("WHERE " + " AND ".join(pagina_filtros)) if pagina_filtros else ""
 
+        conn = get_db_connection()
         with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cur:
-            # Total
-            cur.execute(f"""
-                SELECT COUNT(*) AS total
-                FROM control_actividad ca
-                LEFT JOIN users u ON u.user_id = ca.user_id
-                {where_clause}
-            """, params)
-            total = cur.fetchone()["total"]
-
-            # Registros paginados
+            # Registros de la página (+1 para saber si hay siguiente)
             cur.execute(f"""
                 SELECT
                     ca.id,
@@ -4118,19 +5771,34 @@ def control_actividad(current_user_id):
                     ca.fecha
                 FROM control_actividad ca
                 LEFT JOIN users u ON u.user_id = ca.user_id
-                {where_clause}
-                ORDER BY ca.fecha DESC
-                LIMIT %s OFFSET %s
-            """, params + [per_page, offset])
+                {pagina_where}
+                ORDER BY ca.fecha DESC, ca.id DESC
+                LIMIT %s {offset_sql}
+            """, pagina_params + [per_page + 1])
             rows = cur.fetchall()
 
-        return jsonify({
+            exacto = request.args.get("conteo") == "exacto"
+            if exacto:
+                total = conteo_actividad_exacto(cur, where_clause, params)
+            else:
+                total = conteo_actividad_estimado(cur, where_clause, params)
+
+        siguiente = None
+        if len(rows) > per_page:
+            rows = rows[:per_page]
+            siguiente = encode_cursor(rows[-1]["fecha"], rows[-1]["id"])
+
+        resp = {
             "total": total,
-            "page": page,
+            "total_estimado": not exacto,
             "per_page": per_page,
-            "pages": (total + per_page - 1) // per_page,
+            "siguiente_cursor": siguiente,
             "data": rows
-        })
+        }
+        if page:
+            resp["page"] = page
+            resp["pages"] = (total + per_page - 1) // per_page
+        return jsonify(resp)
     except Exception as e:
         logger.error(f"Error en control_actividad: {e}")
         traceback.print_exc()
@@ -4211,6 +5879,192 @@ def control_actividad_usuario(current_user_id, uid):
         if conn: release_db_connection(conn)
 
 
+# Bordes de las ventanas móviles: las horas completas salen del rollup
+# (control_rollup_hora) y solo la hora parcial del borde se cuenta en crudo.
+KPI_CORTES_SQL = """
+    cortes AS (
+        SELECT d1, d7, d30,
+               (date_trunc('hour', d1  AT TIME ZONE 'UTC') AT TIME ZONE 'UTC') + INTERVAL '1 hour' AS h1,
+               (date_trunc('hour', d7  AT TIME ZONE 'UTC') AT TIME ZONE 'UTC') + INTERVAL '1 hour' AS h7,
+               (date_trunc('hour', d30 AT TIME ZONE 'UTC') AT TIME ZONE 'UTC') + INTERVAL '1 hour' AS h30
+        FROM (SELECT NOW() - INTERVAL '24 hours' AS d1,
+                     NOW() - INTERVAL '7 days'   AS d7,
+                     NOW() - INTERVAL '30 days'  AS d30) lim
+    )
+"""
+
+
+def _rango_dias(col, desde, hasta):
+    """Condición SQL (y parámetros) que acota `col` a los días [desde, hasta] de Santiago."""
+    sql, params = ["TRUE"], []
+    if desde:
+        sql.append(f"{col} >= (%s::date)::timestamp AT TIME ZONE 'America/Santiago'")
+        params.append(desde)
+    if hasta:
+        sql.append(f"{col} < (%s::date + 1)::timestamp AT TIME ZONE 'America/Santiago'")
+        params.append(hasta)
+    return " AND ".join(sql), params
+
+
+def control_kpi_datos(cur, desde=None, hasta=None):
+    """
+    KPIs del módulo de control calculados sobre control_rollup_hora.
+    El costo depende del número de horas×dimensiones, no del largo del log;
+    las únicas lecturas crudas son la hora parcial de cada ventana y las
+    últimas 20 acciones (ambas por idx_ctrl_fecha_id).
+    Con desde/hasta (YYYY-MM-DD) los totales y rankings se acotan a esos
+    días; la serie diaria y las últimas acciones no cambian.
+    """
+    rango_r, rango_params = _rango_dias("r.hora", desde, hasta)
+    rango_r2, _ = _rango_dias("r2.hora", desde, hasta)
+    rango_ca, _ = _rango_dias("ca.fecha", desde, hasta)
+    rango_h, _ = _rango_dias("hora", desde, hasta)
+
+    # Totales generales
+    cur.execute(f"""
+        WITH {KPI_CORTES_SQL},
+        cola AS (
+            SELECT ca.user_id,
+                   ca.fecha >= c.d1 AND ca.fecha < c.h1 AS en_24h,
+                   ca.fecha >= c.d7 AND ca.fecha < c.h7 AS en_7d
+            FROM control_actividad ca, cortes c
+            WHERE ca.fecha >= NOW() - INTERVAL '7 days'     -- poda de particiones
+              AND ((ca.fecha >= c.d1 AND ca.fecha < c.h1)
+                OR (ca.fecha >= c.d7 AND ca.fecha < c.h7))
+              AND {rango_ca}
+        )
+        SELECT
+            COALESCE(SUM(r.total), 0)                              AS total_acciones,
+            COUNT(DISTINCT NULLIF(r.user_id, 0))                   AS usuarios_activos,
+            COUNT(DISTINCT NULLIF(r.entidad_id, 0))
+                FILTER (WHERE r.entidad_tipo = 'proyecto')         AS proyectos_accedidos,
+            COALESCE(SUM(r.fallidas), 0)                           AS acciones_fallidas,
+            COALESCE(SUM(r.total) FILTER (WHERE r.hora >= c.h1), 0)
+                + (SELECT COUNT(*) FROM cola WHERE en_24h)         AS acciones_hoy,
+            COALESCE(SUM(r.total) FILTER (WHERE r.hora >= c.h7), 0)
+                + (SELECT COUNT(*) FROM cola WHERE en_7d)          AS acciones_semana,
+            (SELECT COUNT(DISTINCT u) FROM (
+                SELECT NULLIF(r2.user_id, 0) AS u
+                FROM control_rollup_hora r2, cortes c2 WHERE r2.hora >= c2.h7 AND {rango_r2}
+                UNION
+                SELECT user_id FROM cola WHERE en_7d
+            ) s)                                                   AS usuarios_semana
+        FROM control_rollup_hora r
+        CROSS JOIN cortes c
+        WHERE {rango_r}
+    """, rango_params * 3)
+    totales = cur.fetchone()
+
+    # Acciones por módulo
+    cur.execute(f"""
+        SELECT NULLIF(modulo, '') AS modulo, SUM(total) AS total
+        FROM control_rollup_hora
+        WHERE {rango_h}
+        GROUP BY modulo ORDER BY total DESC
+    """, rango_params)
+    por_modulo = cur.fetchall()
+
+    # Top 10 acciones
+    cur.execute(f"""
+        SELECT accion, SUM(total) AS total
+        FROM control_rollup_hora
+        WHERE {rango_h}
+        GROUP BY accion ORDER BY total DESC LIMIT 10
+    """, rango_params)
+    top_acciones = cur.fetchall()
+
+    # Últimos 30 días por día y por hora del día (hora local)
+    cur.execute(f"""
+        WITH {KPI_CORTES_SQL},
+        serie AS (
+            SELECT r.hora AS instante, r.total
+            FROM control_rollup_hora r, cortes c
+            WHERE r.hora >= c.h30
+            UNION ALL
+            SELECT ca.fecha, 1
+            FROM control_actividad ca, cortes c
+            WHERE ca.fecha >= NOW() - INTERVAL '30 days'    -- poda de particiones
+              AND ca.fecha >= c.d30 AND ca.fecha < c.h30
+        )
+        SELECT
+            DATE(instante AT TIME ZONE 'America/Santiago')                  AS dia,
+            EXTRACT(HOUR FROM instante AT TIME ZONE 'America/Santiago')::INT AS hora,
+            SUM(total) AS total,
+            GROUPING(DATE(instante AT TIME ZONE 'America/Santiago'))        AS g_dia
+        FROM serie
+        GROUP BY GROUPING SETS (
+            (DATE(instante AT TIME ZONE 'America/Santiago')),
+            (EXTRACT(HOUR FROM instante AT TIME ZONE 'America/Santiago')::INT)
+        )
+    """)
+    actividad_diaria, por_hora = [], []
+    for row in cur.fetchall():
+        if row["g_dia"] == 0:
+            actividad_diaria.append({"dia": row["dia"], "total": row["total"]})
+        else:
+            por_hora.append({"hora": row["hora"], "total": row["total"]})
+    actividad_diaria.sort(key=lambda r: r["dia"])
+    por_hora.sort(key=lambda r: r["hora"])
+
+    # Top 10 usuarios más activos
+    cur.execute(f"""
+        SELECT
+            NULLIF(r.user_id, 0) AS user_id, u.nombre, u.email,
+            r.total_acciones, r.ultima_actividad
+        FROM (
+            SELECT user_id, SUM(total) AS total_acciones, MAX(ultima) AS ultima_actividad
+            FROM control_rollup_hora
+            WHERE {rango_h}
+            GROUP BY user_id
+            ORDER BY total_acciones DESC LIMIT 10
+        ) r
+        LEFT JOIN users u ON u.user_id = r.user_id
+        ORDER BY r.total_acciones DESC
+    """, rango_params)
+    top_usuarios = cur.fetchall()
+
+    # Top 10 proyectos más visitados (nombre = el último registrado)
+    cur.execute(f"""
+        SELECT
+            entidad_id AS proyecto_id,
+            (ARRAY_AGG(entidad_nombre ORDER BY ultima DESC)
+                FILTER (WHERE entidad_nombre IS NOT NULL))[1] AS nombre_proyecto,
+            SUM(total) AS total_accesos,
+            COUNT(DISTINCT NULLIF(user_id, 0)) AS usuarios_distintos,
+            MAX(ultima) AS ultimo_acceso
+        FROM control_rollup_hora
+        WHERE entidad_tipo = 'proyecto' AND entidad_id <> 0 AND {rango_h}
+        GROUP BY entidad_id
+        ORDER BY total_accesos DESC LIMIT 10
+    """, rango_params)
+    top_proyectos = cur.fetchall()
+
+    # Últimas 20 acciones
+    cur.execute("""
+        SELECT
+            ca.id, ca.accion, ca.modulo,
+            ca.user_id, u.nombre AS nombre_usuario,
+            ca.entidad_tipo, ca.entidad_nombre,
+            ca.exitoso, ca.detalle,
+            ca.ip_origen::TEXT, ca.fecha
+        FROM control_actividad ca
+        LEFT JOIN users u ON u.user_id = ca.user_id
+        ORDER BY ca.fecha DESC, ca.id DESC LIMIT 20
+    """)
+    ultimas_acciones = cur.fetchall()
+
+    return {
+        "totales": totales,
+        "por_modulo": por_modulo,
+        "top_acciones": top_acciones,
+        "actividad_diaria": actividad_diaria,
+        "top_usuarios": top_usuarios,
+        "top_proyectos": top_proyectos,
+        "ultimas_acciones": ultimas_acciones,
+        "por_hora": por_hora
+    }
+
+
 @app.route("/control/kpi", methods=["GET"])
 @session_required
 def control_kpi(current_user_id):
@@ -4223,118 +6077,14 @@ def control_kpi(current_user_id):
     - top 10 proyectos más visitados
     - top 5 acciones más frecuentes
     - últimas 20 acciones
+    Se calculan desde el rollup horario (ver control_kpi_datos).
     """
     conn = None
     try:
         conn = get_db_connection()
         with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cur:
-
-            # Totales generales
-            cur.execute("""
-                SELECT
-                    COUNT(*)                                        AS total_acciones,
-                    COUNT(DISTINCT user_id)                         AS usuarios_activos,
-                    COUNT(DISTINCT entidad_id)
-                        FILTER (WHERE entidad_tipo = 'proyecto')    AS proyectos_accedidos,
-                    COUNT(*) FILTER (WHERE exitoso = FALSE)         AS acciones_fallidas,
-                    COUNT(*) FILTER (WHERE fecha >= NOW() - INTERVAL '24 hours') AS acciones_hoy,
-                    COUNT(*) FILTER (WHERE fecha >= NOW() - INTERVAL '7 days')   AS acciones_semana,
-                    COUNT(DISTINCT user_id) FILTER (WHERE fecha >= NOW() - INTERVAL '7 days') AS usuarios_semana
-                FROM control_actividad
-            """)
-            totales = cur.fetchone()
-
-            # Acciones por módulo
-            cur.execute("""
-                SELECT modulo, COUNT(*) AS total
-                FROM control_actividad
-                GROUP BY modulo ORDER BY total DESC
-            """)
-            por_modulo = cur.fetchall()
-
-            # Top 10 acciones
-            cur.execute("""
-                SELECT accion, COUNT(*) AS total
-                FROM control_actividad
-                GROUP BY accion ORDER BY total DESC LIMIT 10
-            """)
-            top_acciones = cur.fetchall()
-
-            # Actividad últimos 30 días (agrupada por día)
-            cur.execute("""
-                SELECT
-                    DATE(fecha AT TIME ZONE 'America/Santiago') AS dia,
-                    COUNT(*) AS total
-                FROM control_actividad
-                WHERE fecha >= NOW() - INTERVAL '30 days'
-                GROUP BY dia ORDER BY dia ASC
-            """)
-            actividad_diaria = cur.fetchall()
-
-            # Top 10 usuarios más activos
-            cur.execute("""
-                SELECT
-                    ca.user_id, u.nombre, u.email,
-                    COUNT(*) AS total_acciones,
-                    MAX(ca.fecha) AS ultima_actividad
-                FROM control_actividad ca
-                LEFT JOIN users u ON u.user_id = ca.user_id
-                GROUP BY ca.user_id, u.nombre, u.email
-                ORDER BY total_acciones DESC LIMIT 10
-            """)
-            top_usuarios = cur.fetchall()
-
-            # Top 10 proyectos más visitados
-            cur.execute("""
-                SELECT
-                    ca.entidad_id AS proyecto_id,
-                    ca.entidad_nombre AS nombre_proyecto,
-                    COUNT(*) AS total_accesos,
-                    COUNT(DISTINCT ca.user_id) AS usuarios_distintos,
-                    MAX(ca.fecha) AS ultimo_acceso
-                FROM control_actividad ca
-                WHERE ca.entidad_tipo = 'proyecto'
-                  AND ca.entidad_id IS NOT NULL
-                GROUP BY ca.entidad_id, ca.entidad_nombre
-                ORDER BY total_accesos DESC LIMIT 10
-            """)
-            top_proyectos = cur.fetchall()
-
-            # Últimas 20 acciones
-            cur.execute("""
-                SELECT
-                    ca.id, ca.accion, ca.modulo,
-                    ca.user_id, u.nombre AS nombre_usuario,
-                    ca.entidad_tipo, ca.entidad_nombre,
-                    ca.exitoso, ca.detalle,
-                    ca.ip_origen::TEXT, ca.fecha
-                FROM control_actividad ca
-                LEFT JOIN users u ON u.user_id = ca.user_id
-                ORDER BY ca.fecha DESC LIMIT 20
-            """)
-            ultimas_acciones = cur.fetchall()
-
-            # Distribución por hora del día
-            cur.execute("""
-                SELECT
-                    EXTRACT(HOUR FROM fecha AT TIME ZONE 'America/Santiago')::INT AS hora,
-                    COUNT(*) AS total
-                FROM control_actividad
-                WHERE fecha >= NOW() - INTERVAL '30 days'
-                GROUP BY hora ORDER BY hora ASC
-            """)
-            por_hora = cur.fetchall()
-
-        return jsonify({
-            "totales": totales,
-            "por_modulo": por_modulo,
-            "top_acciones": top_acciones,
-            "actividad_diaria": actividad_diaria,
-            "top_usuarios": top_usuarios,
-            "top_proyectos": top_proyectos,
-            "ultimas_acciones": ultimas_acciones,
-            "por_hora": por_hora
-        })
+            datos = control_kpi_datos(cur)
+        return jsonify(datos)
     except Exception as e:
         logger.error(f"Error en control_kpi: {e}")
         traceback.print_exc()
@@ -4343,10 +6093,40 @@ def control_kpi(current_user_id):
         if conn: release_db_connection(conn)
 
 
+@app.route("/control/eventos", methods=["GET"])
+@session_required
+def control_eventos(current_user_id):
+    """
+    Stream SSE de las filas nuevas de control_actividad (evento `actividad`,
+    mismos campos que ultimas_acciones de /control/kpi) al confirmarse;
+    `lote` si una sola inserción trae muchas filas. Filtros opcionales:
+    user_id=1,2 y modulo=proyectos. El token va en ?token= y se reanuda
+    desde Last-Event-ID, igual que /api/mobile/reportes/eventos.
+    """
+    usuarios = set(parse_ids(request.args.get("user_id")) or [])
+    modulo = request.args.get("modulo") or None
+
+    def filtro(ev):
+        if ev.get("tipo") != "actividad":
+            return True
+        if usuarios and ev.get("user_id") not in usuarios:
+            return False
+        if modulo and ev.get("modulo") != modulo:
+            return False
+        return True
+
+    ultimo_id = request.headers.get("Last-Event-ID") or request.args.get("last_event_id")
+    return sse_response(notificador.stream("control_eventos", filtro, ultimo_id))
+
+
 @app.route("/control/resumen_usuarios", methods=["GET"])
 @session_required
 def control_resumen_usuarios(current_user_id):
-    """Tabla resumen de KPIs por usuario (desde vista materializada o cálculo directo)."""
+    """
+    Tabla resumen de KPIs por usuario, desde control_resumen_usuario
+    (actualizada de forma incremental por el programador). `computed_at`
+    indica hasta cuándo están al día los contadores.
+    """
     conn = None
     try:
         conn = get_db_connection()
@@ -4358,19 +6138,20 @@ def control_resumen_usuarios(current_user_id):
                     u.email,
                     u.nivel_acceso,
                     u.activo,
-                    COUNT(ca.id)                                                   AS total_acciones,
-                    COUNT(ca.id) FILTER (WHERE ca.accion = 'ver_proyecto')         AS vistas_proyecto,
-                    COUNT(ca.id) FILTER (WHERE ca.accion = 'editar_proyecto')      AS ediciones_proyecto,
-                    COUNT(ca.id) FILTER (WHERE ca.exitoso = FALSE)                 AS acciones_fallidas,
-                    MAX(ca.fecha)                                                   AS ultima_actividad
+                    COALESCE(r.total_acciones, 0)      AS total_acciones,
+                    COALESCE(r.vistas_proyecto, 0)     AS vistas_proyecto,
+                    COALESCE(r.ediciones_proyecto, 0)  AS ediciones_proyecto,
+                    COALESCE(r.acciones_fallidas, 0)   AS acciones_fallidas,
+                    r.ultima_actividad
                 FROM users u
-                LEFT JOIN control_actividad ca ON ca.user_id = u.user_id
+                LEFT JOIN control_resumen_usuario r ON r.user_id = u.user_id
                 WHERE u.activo = TRUE
-                GROUP BY u.user_id, u.nombre, u.email, u.nivel_acceso, u.activo
                 ORDER BY total_acciones DESC, u.nombre ASC
             """)
             rows = cur.fetchall()
-        return jsonify(rows)
+            cur.execute("SELECT watermark, computed_at FROM control_resumen_estado")
+            est = cur.fetchone() or {}
+        return jsonify({"computed_at": est.get("computed_at"), "data": rows})
     except Exception as e:
         logger.error(f"Error en control_resumen_usuarios: {e}")
         return jsonify({"error": str(e)}), 500
@@ -4381,38 +6162,18 @@ def control_resumen_usuarios(current_user_id):
 @app.route("/control/refresh_stats", methods=["POST"])
 @session_required
 def control_refresh_stats(current_user_id):
-    """Refresca las vistas materializadas de estadísticas de control."""
+    """
+    Pone al día los resúmenes de control ahora (solo las filas nuevas desde
+    el último watermark) en vez de esperar la próxima vuelta del programador.
+    """
     conn = None
     try:
         conn = get_db_connection()
-
-        # Refrescar control_resumen_usuario
-        try:
-            with conn.cursor() as cur:
-                cur.execute("REFRESH MATERIALIZED VIEW CONCURRENTLY control_resumen_usuario")
-            conn.commit()
-        except Exception as e1:
-            conn.rollback()
-            logger.warning(f"CONCURRENT falló para control_resumen_usuario ({e1}), usando modo normal")
-            with conn.cursor() as cur:
-                cur.execute("REFRESH MATERIALIZED VIEW control_resumen_usuario")
-            conn.commit()
-
-        # Refrescar control_resumen_proyecto
-        try:
-            with conn.cursor() as cur:
-                cur.execute("REFRESH MATERIALIZED VIEW CONCURRENTLY control_resumen_proyecto")
-            conn.commit()
-        except Exception as e2:
-            conn.rollback()
-            logger.warning(f"CONCURRENT falló para control_resumen_proyecto ({e2}), usando modo normal")
-            with conn.cursor() as cur:
-                cur.execute("REFRESH MATERIALIZED VIEW control_resumen_proyecto")
-            conn.commit()
+        resultado = resumenes.actualizar(conn)
 
         log_control(current_user_id, "refresh_stats_control", modulo="control",
-                    detalle="Vistas materializadas refrescadas")
-        return jsonify({"ok": True, "mensaje": "Estadísticas actualizadas"})
+                    detalle=f"Resúmenes actualizados ({resultado['procesadas']} filas nuevas)")
+        return jsonify({"ok": True, "mensaje": "Estadísticas actualizadas", **resultado})
     except Exception as e:
         logger.error(f"Error en refresh_stats: {e}")
         return jsonify({"error": str(e)}), 500
@@ -4420,205 +6181,300 @@ def control_refresh_stats(current_user_id):
         if conn: release_db_connection(conn)
 
 
-@app.route("/control/export_pdf", methods=["GET"])
+# Tareas periódicas del módulo de control: (nombre, cada_s, función(conn))
+TAREAS_CONTROL = [
+    ("particiones", 6 * 3600, particiones.mantener),
+    ("resumenes", resumenes.INTERVALO_S, resumenes.actualizar),
+    ("fotos_pendientes", FOTOS_REINTENTO_MIN * 60 // 2, reencolar_fotos_pendientes),
+]
+
+
+def _programador_control():
+    """Hilo único que corre TAREAS_CONTROL; cada tarea usa su propia conexión del pool."""
+    time.sleep(30)
+    proxima = {nombre: 0 for nombre, _, _ in TAREAS_CONTROL}
+    while True:
+        for nombre, cada_s, tarea in TAREAS_CONTROL:
+            if time.time() < proxima[nombre]:
+                continue
+            proxima[nombre] = time.time() + cada_s
+            conn = None
+            try:
+                conn = get_db_connection()
+                resultado = tarea(conn)
+                logger.debug(f"Tarea de control {nombre}: {resultado}")
+            except Exception as e:
+                logger.error(f"Error en tarea de control {nombre}: {e}")
+            finally:
+                if conn: release_db_connection(conn)
+        time.sleep(5)
+
+
+threading.Thread(target=_programador_control, name="programador_control", daemon=True).start()
+
+
+@app.route("/control/particiones/mantener", methods=["POST"])
 @session_required
-def control_export_pdf(current_user_id):
-    """
-    Genera un PDF ejecutivo con los KPIs del módulo de control.
-    Usa reportlab si está disponible; si no, genera HTML like fallback.
-    """
-    import io, json as _json
-    from datetime import datetime as dt
+def control_mantener_particiones(current_user_id):
+    """Ejecuta la mantención de particiones ahora (solo administradores)."""
+    conn = None
+    try:
+        conn = get_db_connection()
+        with conn.cursor() as cur:
+            cur.execute("SELECT nivel_acceso FROM users WHERE user_id = %s", (current_user_id,))
+            row = cur.fetchone()
+        if not row or row[0] < 10:
+            return jsonify({"error": "Solo administradores"}), 403
+
+        resultado = particiones.mantener(conn)
+        if resultado is None:
+            return jsonify({"error": "Mantención en curso en otro proceso"}), 409
+        log_control(current_user_id, "mantener_particiones", modulo="control",
+                    detalle=f"{resultado['creadas']} creadas, {len(resultado['archivadas'])} archivadas",
+                    datos_despues=resultado)
+        return jsonify(resultado)
+    except Exception as e:
+        logger.error(f"Error en control_mantener_particiones: {e}")
+        return jsonify({"error": str(e)}), 500
+    finally:
+        if conn: release_db_connection(conn)
+
 
+# Informe ejecutivo PDF: se genera en segundo plano una vez por
+# (tipo, versión de datos, rango) y queda en disco
+INFORMES_MAX_MB = int(os.getenv("INFORMES_MAX_MB", 256))
+INFORMES_RETRY_S = 2
+
+informes_cache = DiskLRUCache(os.path.join(DERIVADOS_DIR, "informes"), INFORMES_MAX_MB * 1024 * 1024)
+informes_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="informes")
+informes_trabajos = {}      # job_id -> Future (ruta del PDF)
+informes_lock = threading.Lock()
+
+
+def informe_id(tipo, version, desde, hasta):
+    return hashlib.sha1(f"{tipo}|{version}|{desde or ''}|{hasta or ''}".encode("utf-8")).hexdigest()
+
+
+def render_pdf_control(datos, desde=None, hasta=None):
+    """Documento reportlab del informe ejecutivo de control; retorna los bytes del PDF."""
+    import io
+    from datetime import datetime as dt
+    from reportlab.lib.pagesizes import A4, landscape
+    from reportlab.lib import colors
+    from reportlab.lib.units import cm
+    from reportlab.platypus import (SimpleDocTemplate, Paragraph, Spacer,
+                                    Table, TableStyle, HRFlowable)
+    from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+    from reportlab.lib.enums import TA_CENTER, TA_LEFT
+
+    totales = dict(datos["totales"])
+    top_usuarios = datos["top_usuarios"]
+    top_proyectos = datos["top_proyectos"]
+    top_acciones = datos["top_acciones"]
+
+    buf = io.BytesIO()
+    doc = SimpleDocTemplate(buf, pagesize=A4,
+                            leftMargin=2*cm, rightMargin=2*cm,
+                            topMargin=2*cm, bottomMargin=2*cm)
+    styles = getSampleStyleSheet()
+    story  = []
+
+    # Estilo personalizado
+    title_style = ParagraphStyle('title_ctrl',
+        parent=styles['Heading1'],
+        fontSize=18, textColor=colors.HexColor('#4f46e5'),
+        spaceAfter=6, alignment=TA_CENTER)
+    sub_style = ParagraphStyle('sub_ctrl',
+        parent=styles['Normal'],
+        fontSize=10, textColor=colors.grey,
+        spaceAfter=16, alignment=TA_CENTER)
+    h2_style = ParagraphStyle('h2_ctrl',
+        parent=styles['Heading2'],
+        fontSize=13, textColor=colors.HexColor('#1e293b'),
+        spaceBefore=16, spaceAfter=8)
+
+    now_str = dt.now().strftime("%d/%m/%Y %H:%M")
+    story.append(Paragraph("📊 MÓDULO DE CONTROL – INFORME EJECUTIVO", title_style))
+    periodo = f" · Período: {desde or 'inicio'} a {hasta or 'hoy'}" if (desde or hasta) else ""
+    story.append(Paragraph(f"Generado: {now_str}{periodo}", sub_style))
+    story.append(HRFlowable(width="100%", thickness=2,
+                            color=colors.HexColor('#4f46e5')))
+    story.append(Spacer(1, 0.4*cm))
+
+    # ── KPI Globales ──
+    story.append(Paragraph("1. KPI Globales del Sistema", h2_style))
+    kpi_data = [
+        ["Indicador", "Valor"],
+        ["Total Acciones Registradas",   str(totales.get("total_acciones", 0))],
+        ["Usuarios Únicos Activos",       str(totales.get("usuarios_activos", 0))],
+        ["Proyectos Accedidos",           str(totales.get("proyectos_accedidos", 0))],
+        ["Acciones Fallidas",             str(totales.get("acciones_fallidas", 0))],
+        ["Acciones Hoy (24h)",            str(totales.get("acciones_hoy", 0))],
+        ["Acciones Última Semana",        str(totales.get("acciones_semana", 0))],
+    ]
+    t = Table(kpi_data, colWidths=[10*cm, 5*cm])
+    t.setStyle(TableStyle([
+        ('BACKGROUND', (0,0), (-1,0), colors.HexColor('#4f46e5')),
+        ('TEXTCOLOR',  (0,0), (-1,0), colors.white),
+        ('FONTNAME',   (0,0), (-1,0), 'Helvetica-Bold'),
+        ('FONTSIZE',   (0,0), (-1,-1), 10),
+        ('ALIGN',      (1,0), (1,-1), 'CENTER'),
+        ('ROWBACKGROUNDS', (0,1), (-1,-1),
+            [colors.HexColor('#f8fafc'), colors.white]),
+        ('GRID',       (0,0), (-1,-1), 0.5, colors.HexColor('#e2e8f0')),
+        ('BOTTOMPADDING', (0,0), (-1,-1), 6),
+        ('TOPPADDING',    (0,0), (-1,-1), 6),
+    ]))
+    story.append(t)
+    story.append(Spacer(1, 0.5*cm))
+
+    # ── Top usuarios ──
+    story.append(Paragraph("2. Top 10 Usuarios Más Activos", h2_style))
+    u_data = [["#", "Usuario", "Total Acciones"]]
+    for i, row in enumerate(top_usuarios, 1):
+        u_data.append([str(i), row.get("nombre") or "—", str(row.get("total_acciones",0))])
+    t2 = Table(u_data, colWidths=[1*cm, 10*cm, 4*cm])
+    t2.setStyle(TableStyle([
+        ('BACKGROUND', (0,0), (-1,0), colors.HexColor('#10b981')),
+        ('TEXTCOLOR',  (0,0), (-1,0), colors.white),
+        ('FONTNAME',   (0,0), (-1,0), 'Helvetica-Bold'),
+        ('FONTSIZE',   (0,0), (-1,-1), 9),
+        ('ROWBACKGROUNDS', (0,1), (-1,-1),
+            [colors.HexColor('#f0fdf4'), colors.white]),
+        ('GRID',       (0,0), (-1,-1), 0.5, colors.HexColor('#e2e8f0')),
+        ('BOTTOMPADDING', (0,0), (-1,-1), 5),
+        ('TOPPADDING',    (0,0), (-1,-1), 5),
+    ]))
+    story.append(t2)
+    story.append(Spacer(1, 0.5*cm))
+
+    # ── Top proyectos ──
+    story.append(Paragraph("3. Top 10 Proyectos Más Accedidos", h2_style))
+    p_data = [["#", "Proyecto", "Total Accesos"]]
+    for i, row in enumerate(top_proyectos, 1):
+        nombre = (row.get("nombre_proyecto") or "—")[:60]
+        p_data.append([str(i), nombre, str(row.get("total_accesos",0))])
+    t3 = Table(p_data, colWidths=[1*cm, 10*cm, 4*cm])
+    t3.setStyle(TableStyle([
+        ('BACKGROUND', (0,0), (-1,0), colors.HexColor('#f59e0b')),
+        ('TEXTCOLOR',  (0,0), (-1,0), colors.white),
+        ('FONTNAME',   (0,0), (-1,0), 'Helvetica-Bold'),
+        ('FONTSIZE',   (0,0), (-1,-1), 9),
+        ('ROWBACKGROUNDS', (0,1), (-1,-1),
+            [colors.HexColor('#fffbeb'), colors.white]),
+        ('GRID',       (0,0), (-1,-1), 0.5, colors.HexColor('#e2e8f0')),
+        ('BOTTOMPADDING', (0,0), (-1,-1), 5),
+        ('TOPPADDING',    (0,0), (-1,-1), 5),
+    ]))
+    story.append(t3)
+    story.append(Spacer(1, 0.5*cm))
+
+    # ── Top acciones ──
+    story.append(Paragraph("4. Acciones Más Frecuentes", h2_style))
+    a_data = [["Acción", "Frecuencia"]]
+    for row in top_acciones:
+        a_data.append([row.get("accion","—"), str(row.get("total",0))])
+    t4 = Table(a_data, colWidths=[10*cm, 5*cm])
+    t4.setStyle(TableStyle([
+        ('BACKGROUND', (0,0), (-1,0), colors.HexColor('#8b5cf6')),
+        ('TEXTCOLOR',  (0,0), (-1,0), colors.white),
+        ('FONTNAME',   (0,0), (-1,0), 'Helvetica-Bold'),
+        ('FONTSIZE',   (0,0), (-1,-1), 9),
+        ('ROWBACKGROUNDS', (0,1), (-1,-1),
+            [colors.HexColor('#f5f3ff'), colors.white]),
+        ('GRID',       (0,0), (-1,-1), 0.5, colors.HexColor('#e2e8f0')),
+        ('BOTTOMPADDING', (0,0), (-1,-1), 5),
+        ('TOPPADDING',    (0,0), (-1,-1), 5),
+    ]))
+    story.append(t4)
+
+    doc.build(story)
+    return buf.getvalue()
+
+
+def _generar_informe_control(job_id, desde, hasta):
     conn = None
     try:
         conn = get_db_connection()
         with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cur:
-            cur.execute("""
-                SELECT
-                    COUNT(*) AS total_acciones,
-                    COUNT(DISTINCT user_id) AS usuarios_activos,
-                    COUNT(DISTINCT entidad_id) FILTER (WHERE entidad_tipo='proyecto') AS proyectos_accedidos,
-                    COUNT(*) FILTER (WHERE exitoso = FALSE) AS acciones_fallidas,
-                    COUNT(*) FILTER (WHERE fecha >= NOW() - INTERVAL '24 hours') AS acciones_hoy,
-                    COUNT(*) FILTER (WHERE fecha >= NOW() - INTERVAL '7 days') AS acciones_semana
-                FROM control_actividad
-            """)
-            totales = dict(cur.fetchone())
+            datos = control_kpi_datos(cur, desde, hasta)
+    finally:
+        if conn: release_db_connection(conn)
+    return informes_cache.put(f"{job_id}.pdf", render_pdf_control(datos, desde, hasta))
 
-            cur.execute("""
-                SELECT ca.user_id, u.nombre, COUNT(*) AS total
-                FROM control_actividad ca
-                LEFT JOIN users u ON u.user_id = ca.user_id
-                GROUP BY ca.user_id, u.nombre ORDER BY total DESC LIMIT 10
-            """)
-            top_usuarios = cur.fetchall()
 
-            cur.execute("""
-                SELECT entidad_id, entidad_nombre, COUNT(*) AS total
-                FROM control_actividad WHERE entidad_tipo='proyecto' AND entidad_id IS NOT NULL
-                GROUP BY entidad_id, entidad_nombre ORDER BY total DESC LIMIT 10
-            """)
-            top_proyectos = cur.fetchall()
+def _enviar_informe(path):
+    return send_file(path, mimetype="application/pdf", as_attachment=True,
+                     download_name=f"informe_control_{datetime.now().strftime('%Y%m%d_%H%M')}.pdf")
 
-            cur.execute("""
-                SELECT accion, COUNT(*) AS total
-                FROM control_actividad GROUP BY accion ORDER BY total DESC LIMIT 10
-            """)
-            top_acciones = cur.fetchall()
 
-            cur.execute("""
-                SELECT DATE(fecha AT TIME ZONE 'America/Santiago') AS dia, COUNT(*) AS total
-                FROM control_actividad WHERE fecha >= NOW() - INTERVAL '30 days'
-                GROUP BY dia ORDER BY dia
-            """)
-            actividad_diaria = cur.fetchall()
+def _informe_pendiente(job_id):
+    url = f"/control/export_pdf/{job_id}"
+    resp = jsonify({"estado": "generando", "job_id": job_id, "url": url})
+    resp.status_code = 202
+    resp.headers["Location"] = url
+    resp.headers["Retry-After"] = str(INFORMES_RETRY_S)
+    return resp
+
 
-        # ─── Intentar generar PDF con reportlab ───
+@app.route("/control/export_pdf", methods=["GET"])
+@session_required
+def control_export_pdf(current_user_id):
+    """
+    Informe ejecutivo PDF con los KPIs del módulo de control (desde/hasta
+    opcionales, YYYY-MM-DD). Si el PDF de la versión actual de los datos ya
+    está en disco se entrega de inmediato; si no, se encola (una sola vez
+    por clave aunque lo pidan varios) y se responde 202 con la URL a
+    consultar. La versión es el watermark de los resúmenes de control.
+    Sin reportlab instalado retorna los datos en JSON.
+    """
+    conn = None
+    try:
+        desde = request.args.get("desde") or None
+        hasta = request.args.get("hasta") or None
         try:
-            from reportlab.lib.pagesizes import A4, landscape
-            from reportlab.lib import colors
-            from reportlab.lib.units import cm
-            from reportlab.platypus import (SimpleDocTemplate, Paragraph, Spacer,
-                                            Table, TableStyle, HRFlowable)
-            from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-            from reportlab.lib.enums import TA_CENTER, TA_LEFT
+            for f in (desde, hasta):
+                if f:
+                    datetime.strptime(f, "%Y-%m-%d")
+        except ValueError:
+            return jsonify({"error": "desde/hasta deben ser YYYY-MM-DD"}), 400
 
-            buf = io.BytesIO()
-            doc = SimpleDocTemplate(buf, pagesize=A4,
-                                    leftMargin=2*cm, rightMargin=2*cm,
-                                    topMargin=2*cm, bottomMargin=2*cm)
-            styles = getSampleStyleSheet()
-            story  = []
-
-            # Estilo personalizado
-            title_style = ParagraphStyle('title_ctrl',
-                parent=styles['Heading1'],
-                fontSize=18, textColor=colors.HexColor('#4f46e5'),
-                spaceAfter=6, alignment=TA_CENTER)
-            sub_style = ParagraphStyle('sub_ctrl',
-                parent=styles['Normal'],
-                fontSize=10, textColor=colors.grey,
-                spaceAfter=16, alignment=TA_CENTER)
-            h2_style = ParagraphStyle('h2_ctrl',
-                parent=styles['Heading2'],
-                fontSize=13, textColor=colors.HexColor('#1e293b'),
-                spaceBefore=16, spaceAfter=8)
-
-            now_str = dt.now().strftime("%d/%m/%Y %H:%M")
-            story.append(Paragraph("📊 MÓDULO DE CONTROL – INFORME EJECUTIVO", title_style))
-            story.append(Paragraph(f"Generado: {now_str}", sub_style))
-            story.append(HRFlowable(width="100%", thickness=2,
-                                    color=colors.HexColor('#4f46e5')))
-            story.append(Spacer(1, 0.4*cm))
-
-            # ── KPI Globales ──
-            story.append(Paragraph("1. KPI Globales del Sistema", h2_style))
-            kpi_data = [
-                ["Indicador", "Valor"],
-                ["Total Acciones Registradas",   str(totales.get("total_acciones", 0))],
-                ["Usuarios Únicos Activos",       str(totales.get("usuarios_activos", 0))],
-                ["Proyectos Accedidos",           str(totales.get("proyectos_accedidos", 0))],
-                ["Acciones Fallidas",             str(totales.get("acciones_fallidas", 0))],
-                ["Acciones Hoy (24h)",            str(totales.get("acciones_hoy", 0))],
-                ["Acciones Última Semana",        str(totales.get("acciones_semana", 0))],
-            ]
-            t = Table(kpi_data, colWidths=[10*cm, 5*cm])
-            t.setStyle(TableStyle([
-                ('BACKGROUND', (0,0), (-1,0), colors.HexColor('#4f46e5')),
-                ('TEXTCOLOR',  (0,0), (-1,0), colors.white),
-                ('FONTNAME',   (0,0), (-1,0), 'Helvetica-Bold'),
-                ('FONTSIZE',   (0,0), (-1,-1), 10),
-                ('ALIGN',      (1,0), (1,-1), 'CENTER'),
-                ('ROWBACKGROUNDS', (0,1), (-1,-1),
-                    [colors.HexColor('#f8fafc'), colors.white]),
-                ('GRID',       (0,0), (-1,-1), 0.5, colors.HexColor('#e2e8f0')),
-                ('BOTTOMPADDING', (0,0), (-1,-1), 6),
-                ('TOPPADDING',    (0,0), (-1,-1), 6),
-            ]))
-            story.append(t)
-            story.append(Spacer(1, 0.5*cm))
-
-            # ── Top usuarios ──
-            story.append(Paragraph("2. Top 10 Usuarios Más Activos", h2_style))
-            u_data = [["#", "Usuario", "Total Acciones"]]
-            for i, row in enumerate(top_usuarios, 1):
-                u_data.append([str(i), row.get("nombre","—"), str(row.get("total",0))])
-            t2 = Table(u_data, colWidths=[1*cm, 10*cm, 4*cm])
-            t2.setStyle(TableStyle([
-                ('BACKGROUND', (0,0), (-1,0), colors.HexColor('#10b981')),
-                ('TEXTCOLOR',  (0,0), (-1,0), colors.white),
-                ('FONTNAME',   (0,0), (-1,0), 'Helvetica-Bold'),
-                ('FONTSIZE',   (0,0), (-1,-1), 9),
-                ('ROWBACKGROUNDS', (0,1), (-1,-1),
-                    [colors.HexColor('#f0fdf4'), colors.white]),
-                ('GRID',       (0,0), (-1,-1), 0.5, colors.HexColor('#e2e8f0')),
-                ('BOTTOMPADDING', (0,0), (-1,-1), 5),
-                ('TOPPADDING',    (0,0), (-1,-1), 5),
-            ]))
-            story.append(t2)
-            story.append(Spacer(1, 0.5*cm))
-
-            # ── Top proyectos ──
-            story.append(Paragraph("3. Top 10 Proyectos Más Accedidos", h2_style))
-            p_data = [["#", "Proyecto", "Total Accesos"]]
-            for i, row in enumerate(top_proyectos, 1):
-                nombre = (row.get("entidad_nombre") or "—")[:60]
-                p_data.append([str(i), nombre, str(row.get("total",0))])
-            t3 = Table(p_data, colWidths=[1*cm, 10*cm, 4*cm])
-            t3.setStyle(TableStyle([
-                ('BACKGROUND', (0,0), (-1,0), colors.HexColor('#f59e0b')),
-                ('TEXTCOLOR',  (0,0), (-1,0), colors.white),
-                ('FONTNAME',   (0,0), (-1,0), 'Helvetica-Bold'),
-                ('FONTSIZE',   (0,0), (-1,-1), 9),
-                ('ROWBACKGROUNDS', (0,1), (-1,-1),
-                    [colors.HexColor('#fffbeb'), colors.white]),
-                ('GRID',       (0,0), (-1,-1), 0.5, colors.HexColor('#e2e8f0')),
-                ('BOTTOMPADDING', (0,0), (-1,-1), 5),
-                ('TOPPADDING',    (0,0), (-1,-1), 5),
-            ]))
-            story.append(t3)
-            story.append(Spacer(1, 0.5*cm))
-
-            # ── Top acciones ──
-            story.append(Paragraph("4. Acciones Más Frecuentes", h2_style))
-            a_data = [["Acción", "Frecuencia"]]
-            for row in top_acciones:
-                a_data.append([row.get("accion","—"), str(row.get("total",0))])
-            t4 = Table(a_data, colWidths=[10*cm, 5*cm])
-            t4.setStyle(TableStyle([
-                ('BACKGROUND', (0,0), (-1,0), colors.HexColor('#8b5cf6')),
-                ('TEXTCOLOR',  (0,0), (-1,0), colors.white),
-                ('FONTNAME',   (0,0), (-1,0), 'Helvetica-Bold'),
-                ('FONTSIZE',   (0,0), (-1,-1), 9),
-                ('ROWBACKGROUNDS', (0,1), (-1,-1),
-                    [colors.HexColor('#f5f3ff'), colors.white]),
-                ('GRID',       (0,0), (-1,-1), 0.5, colors.HexColor('#e2e8f0')),
-                ('BOTTOMPADDING', (0,0), (-1,-1), 5),
-                ('TOPPADDING',    (0,0), (-1,-1), 5),
-            ]))
-            story.append(t4)
-
-            doc.build(story)
-            buf.seek(0)
-            log_control(current_user_id, "exportar_pdf", modulo="control",
-                        detalle="PDF de control exportado")
-            return send_file(buf, mimetype="application/pdf",
-                             as_attachment=True,
-                             download_name=f"informe_control_{dt.now().strftime('%Y%m%d_%H%M')}.pdf")
-
-        except ImportError:
+        conn = get_db_connection()
+        if importlib.util.find_spec("reportlab") is None:
             # Fallback: JSON estructurado si reportlab no está instalado
+            with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cur:
+                datos = control_kpi_datos(cur, desde, hasta)
             log_control(current_user_id, "exportar_pdf_fallback", modulo="control",
                         detalle="reportlab no disponible – retornando JSON")
             return jsonify({
                 "advertencia": "reportlab no instalado – datos en JSON",
-                "totales": totales,
-                "top_usuarios": top_usuarios,
-                "top_proyectos": top_proyectos,
-                "top_acciones": top_acciones
+                "totales": datos["totales"],
+                "top_usuarios": datos["top_usuarios"],
+                "top_proyectos": datos["top_proyectos"],
+                "top_acciones": datos["top_acciones"]
             })
 
+        with conn.cursor() as cur:
+            version, _ = resumenes.estado(cur)
+        conn.commit()
+        job_id = informe_id("ejecutivo", version, desde, hasta)
+
+        log_control(current_user_id, "exportar_pdf", modulo="control",
+                    detalle="PDF de control exportado")
+        path = informes_cache.get(f"{job_id}.pdf")
+        if path:
+            return _enviar_informe(path)
+
+        with informes_lock:
+            # Los terminados con éxito ya están en informes_cache
+            for k in [k for k, f in informes_trabajos.items()
+                      if k != job_id and f.done() and f.exception() is None]:
+                informes_trabajos.pop(k)
+            fut = informes_trabajos.get(job_id)
+            if fut is None or (fut.done() and fut.exception() is not None):
+                informes_trabajos[job_id] = informes_pool.submit(
+                    _generar_informe_control, job_id, desde, hasta)
+        return _informe_pendiente(job_id)
     except Exception as e:
         logger.error(f"Error en control_export_pdf: {e}")
         traceback.print_exc()
@@ -4627,6 +6483,173 @@ def control_export_pdf(current_user_id):
         if conn: release_db_connection(conn)
 
 
+@app.route("/control/export_pdf/<job_id>", methods=["GET"])
+@session_required
+def control_export_pdf_estado(current_user_id, job_id):
+    """Estado de un informe encolado: 202 mientras se genera, el PDF cuando está listo."""
+    if len(job_id) != 40 or any(c not in "0123456789abcdef" for c in job_id):
+        return jsonify({"error": "Informe no encontrado"}), 404
+
+    path = informes_cache.get(f"{job_id}.pdf")
+    with informes_lock:
+        fut = informes_trabajos.get(job_id)
+        if path or (fut is not None and fut.done()):
+            informes_trabajos.pop(job_id, None)
+    if path:
+        return _enviar_informe(path)
+    if fut is None:
+        return jsonify({"error": "Informe no encontrado"}), 404
+    if not fut.done():
+        return _informe_pendiente(job_id)
+    if fut.exception() is not None:
+        logger.error(f"Error generando informe de control: {fut.exception()}")
+        return jsonify({"error": str(fut.exception())}), 500
+    return _enviar_informe(fut.result())
+
+
+# Exportación masiva: columnas por tabla y tipos para Parquet. El nombre de
+# usuario va como subconsulta escalar para no romper el orden del índice
+# (un join obligaría a ordenar todo el rango antes de empezar a enviar).
+EXPORT_TABLAS = {
+    "actividad": {
+        "columnas": """
+            ca.id, ca.user_id,
+            (SELECT nombre FROM users WHERE user_id = ca.user_id) AS usuario,
+            ca.accion, ca.modulo, ca.entidad_tipo, ca.entidad_id, ca.entidad_nombre,
+            ca.exitoso, ca.detalle, ca.ip_origen::TEXT AS ip_origen, ca.user_agent,
+            ca.endpoint, ca.datos_antes::TEXT AS datos_antes,
+            ca.datos_despues::TEXT AS datos_despues, {fecha} AS fecha""",
+        "desde_sql": "FROM control_actividad ca",
+        "fecha": "ca.fecha",
+        "orden": "ca.fecha, ca.id",
+        "zona": True,
+        "tipos": {"id": "int64", "user_id": "int32", "usuario": "string", "accion": "string",
+                  "modulo": "string", "entidad_tipo": "string", "entidad_id": "int32",
+                  "entidad_nombre": "string", "exitoso": "bool", "detalle": "string",
+                  "ip_origen": "string", "user_agent": "string", "endpoint": "string",
+                  "datos_antes": "string", "datos_despues": "string", "fecha": "timestamptz"},
+    },
+    "auditoria": {
+        "columnas": """
+            a.audit_id, a.user_id,
+            (SELECT nombre FROM users WHERE user_id = a.user_id) AS usuario,
+            a.accion, a.descripcion, {fecha} AS fecha""",
+        "desde_sql": "FROM auditoria a",
+        "fecha": "a.fecha",
+        "orden": "a.audit_id",
+        "zona": False,
+        "tipos": {"audit_id": "int32", "user_id": "int32", "usuario": "string",
+                  "accion": "string", "descripcion": "string", "fecha": "timestamp"},
+    },
+}
+EXPORT_FORMATOS = {
+    "csv": ("text/csv", "csv.gz"),
+    "jsonl": ("application/x-ndjson", "jsonl.gz"),
+    "parquet": ("application/vnd.apache.parquet", "parquet"),
+}
+
+
+@app.route("/control/export", methods=["GET"])
+@session_required
+def control_export(current_user_id):
+    """
+    Descarga completa de control_actividad (tabla=actividad, por defecto;
+    ordenada por fecha) o auditoria (tabla=auditoria; ordenada por audit_id),
+    en streaming:
+    COPY (SELECT ...) TO STDOUT -> gzip (csv, jsonl) o Parquet -> cliente.
+    Parámetros: formato=csv|jsonl|parquet, desde/hasta (YYYY-MM-DD, inclusive).
+    La memoria usada es constante: si el cliente lee lento, el COPY espera.
+    Solo administradores.
+    """
+    tabla = request.args.get("tabla", "actividad")
+    formato = request.args.get("formato", "csv")
+    desde = request.args.get("desde") or None
+    hasta = request.args.get("hasta") or None
+    spec = EXPORT_TABLAS.get(tabla)
+    if spec is None or formato not in EXPORT_FORMATOS:
+        return jsonify({"error": "tabla debe ser actividad|auditoria y formato csv|jsonl|parquet"}), 400
+    try:
+        for f in (desde, hasta):
+            if f:
+                datetime.strptime(f, "%Y-%m-%d")
+    except ValueError:
+        return jsonify({"error": "desde/hasta deben ser YYYY-MM-DD"}), 400
+    if formato == "parquet" and importlib.util.find_spec("pyarrow") is None:
+        return jsonify({"error": "Exportación Parquet no disponible (pyarrow no instalado)"}), 501
+
+    conn = None
+    try:
+        conn = get_db_connection()
+        with conn.cursor() as cur:
+            cur.execute("SELECT nivel_acceso FROM users WHERE user_id = %s", (current_user_id,))
+            row = cur.fetchone()
+        if not row or row[0] < 10:
+            return jsonify({"error": "Solo administradores"}), 403
+
+        if spec["zona"]:
+            rango, params = _rango_dias(spec["fecha"], desde, hasta)
+        else:
+            rango, params = "TRUE", []
+            if desde:
+                rango += f" AND {spec['fecha']} >= %s::date"
+                params.append(desde)
+            if hasta:
+                rango += f" AND {spec['fecha']} < %s::date + 1"
+                params.append(hasta)
+
+        # Parquet lee el CSV con tipos fijos: la fecha va en ISO 8601
+        if formato == "parquet":
+            fecha = (f"to_char({spec['fecha']} AT TIME ZONE 'UTC', 'YYYY-MM-DD\"T\"HH24:MI:SS.US\"Z\"')"
+                     if spec["zona"] else f"to_char({spec['fecha']}, 'YYYY-MM-DD\"T\"HH24:MI:SS.US')")
+        else:
+            fecha = spec["fecha"]
+        with conn.cursor() as cur:
+            consulta = cur.mogrify(
+                f"SELECT {spec['columnas'].format(fecha=fecha)} {spec['desde_sql']} "
+                f"WHERE {rango} ORDER BY {spec['orden']}", params).decode("utf-8")
+
+        if formato == "jsonl":
+            # CSV con comilla/delimitador que no aparecen en JSON: una línea por fila, sin escapes
+            sql = (f"COPY (SELECT row_to_json(t) FROM ({consulta}) t) TO STDOUT "
+                   f"WITH (FORMAT csv, QUOTE E'\\x01', DELIMITER E'\\x02')")
+            productor = exportar.copiar(conn, sql)
+        elif formato == "parquet":
+            sql = f"COPY ({consulta}) TO STDOUT WITH (FORMAT csv, HEADER true)"
+            productor = exportar.copiar_parquet(conn, sql, spec["tipos"])
+        else:
+            sql = f"COPY ({consulta}) TO STDOUT WITH (FORMAT csv, HEADER true)"
+            productor = exportar.copiar(conn, sql)
+
+        log_control(current_user_id, "exportar_datos", modulo="control",
+                    detalle=f"{tabla} {formato} {desde or 'inicio'}..{hasta or 'hoy'}")
+
+        exp = exportar.Exportacion(productor, comprimir=(formato != "parquet"))
+        conn_export, conn = conn, None      # la libera el cierre de la respuesta
+
+        def liberar():
+            if not exp.cerrar():
+                # COPY interrumpido: la conexión puede quedar a medio protocolo
+                try:
+                    conn_export.close()
+                except Exception:
+                    pass
+            release_db_connection(conn_export)
+
+        mimetype, extension = EXPORT_FORMATOS[formato]
+        nombre = f"{tabla}_{desde or 'inicio'}_{hasta or datetime.now().strftime('%Y-%m-%d')}.{extension}"
+        resp = Response(exp.bloques(), mimetype=mimetype if formato == "parquet" else "application/gzip")
+        resp.headers["Content-Disposition"] = f'attachment; filename="{nombre}"'
+        resp.headers["Cache-Control"] = "no-store"
+        resp.call_on_close(liberar)
+        return resp
+    except Exception as e:
+        logger.error(f"Error en control_export: {e}")
+        traceback.print_exc()
+        return jsonify({"error": str(e)}), 500
+    finally:
+        if conn: release_db_connection(conn)
+
+
 # ── Fin Módulo de Control ──────────────────────────────────────
 
 # -----------------------
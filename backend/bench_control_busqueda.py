@@ -0,0 +1,170 @@
+# bench_control_busqueda.py - Benchmark del filtro `q` de /control/actividad
+#
+# Crea un esquema temporal con un log sintético de control_actividad
+# (por defecto 3 millones de filas) y mide la consulta de la primera página
+# y el conteo con el filtro anterior (ILIKE sobre el join) y el actual
+# (trigramas + ids de usuario resueltos antes), sin y con índices.
+#
+#   python bench_control_busqueda.py --filas 3000000 --repeticiones 5
+#
+# Requiere DATABASE_URL y permiso para CREATE SCHEMA / CREATE EXTENSION.
+import os
+import time
+import argparse
+import statistics
+
+import psycopg2
+from dotenv import load_dotenv
+
+load_dotenv()
+DB_URL = os.getenv("DATABASE_URL")
+ESQUEMA = "bench_control"
+
+# Igual que CONTROL_TEXTO_SQL en app21.py
+TEXTO_SQL = "(COALESCE(ca.detalle, '') || E'\\n' || COALESCE(ca.entidad_nombre, ''))"
+
+FILTRO_ANTERIOR = "(ca.detalle ILIKE %s OR ca.entidad_nombre ILIKE %s OR u.nombre ILIKE %s)"
+FILTRO_ACTUAL = f"""({TEXTO_SQL} ILIKE %s
+    OR ca.user_id = ANY(ARRAY(SELECT user_id FROM users WHERE nombre ILIKE %s)))"""
+
+CONSULTAS = {
+    "pagina": """
+        SELECT ca.id, ca.fecha, u.nombre
+        FROM control_actividad ca
+        LEFT JOIN users u ON u.user_id = ca.user_id
+        WHERE {filtro}
+        ORDER BY ca.fecha DESC, ca.id DESC
+        LIMIT 50
+    """,
+    "conteo": """
+        SELECT COUNT(*)
+        FROM control_actividad ca
+        LEFT JOIN users u ON u.user_id = ca.user_id
+        WHERE {filtro}
+    """,
+}
+
+# Términos: raro (pocas filas), medio, nombre de usuario
+TERMINOS = ["Proyecto 48213", "alcantarillado", "Usuaria 4173"]
+
+
+def preparar(cur, filas, usuarios):
+    cur.execute(f"DROP SCHEMA IF EXISTS {ESQUEMA} CASCADE")
+    cur.execute(f"CREATE SCHEMA {ESQUEMA}")
+    cur.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    cur.execute(f"SET search_path = {ESQUEMA}, public")
+    cur.execute("""
+        CREATE TABLE users (
+            user_id INT PRIMARY KEY,
+            nombre  TEXT NOT NULL
+        )
+    """)
+    cur.execute("""
+        INSERT INTO users
+        SELECT g, (ARRAY['Usuario','Usuaria','Funcionario','Funcionaria'])[1 + g % 4] || ' ' || g
+        FROM generate_series(1, %s) g
+    """, (usuarios,))
+    cur.execute("""
+        CREATE TABLE control_actividad (
+            id              BIGINT PRIMARY KEY,
+            user_id         INT,
+            accion          VARCHAR(80) NOT NULL,
+            entidad_tipo    VARCHAR(40),
+            entidad_id      INT,
+            entidad_nombre  TEXT,
+            detalle         TEXT,
+            fecha           TIMESTAMP WITH TIME ZONE NOT NULL
+        )
+    """)
+    t = time.perf_counter()
+    cur.execute("""
+        INSERT INTO control_actividad
+        SELECT
+            g,
+            1 + (random() * (%s - 1))::INT,
+            (ARRAY['ver_proyecto','editar_proyecto','ver_lista_proyectos','descargar_documento',
+                   'login','ver_dashboard','ver_control'])[1 + (random() * 6)::INT],
+            'proyecto',
+            p,
+            'Proyecto ' || p || ' ' ||
+                (ARRAY['pavimentación','alcantarillado','plaza','sede vecinal','luminarias',
+                       'ciclovía','consultorio','escuela'])[1 + p % 8],
+            (ARRAY['Vista de detalle','Edición de campos','Descarga de anexo',
+                   'Cambio de estado','Inicio de sesión', NULL])[1 + (random() * 5)::INT],
+            NOW() - (g * INTERVAL '1 second')
+        FROM (SELECT g, 1 + (random() * 60000)::INT AS p
+              FROM generate_series(1, %s) g) s
+    """, (usuarios, filas))
+    print(f"  {filas:,} filas generadas en {time.perf_counter() - t:.1f}s")
+    cur.execute("CREATE INDEX ON control_actividad (fecha DESC, id DESC)")
+    cur.execute("CREATE INDEX ON control_actividad (user_id)")
+    cur.execute("ANALYZE users")
+    cur.execute("ANALYZE control_actividad")
+
+
+def crear_indices_trgm(cur):
+    t = time.perf_counter()
+    cur.execute(f"""
+        CREATE INDEX ON control_actividad
+        USING gin ({TEXTO_SQL.replace('ca.', '')} gin_trgm_ops)
+    """)
+    cur.execute("CREATE INDEX ON users USING gin (nombre gin_trgm_ops)")
+    cur.execute("ANALYZE control_actividad")
+    print(f"  índices de trigramas creados en {time.perf_counter() - t:.1f}s")
+
+
+def medir(cur, sql, params, repeticiones):
+    tiempos = []
+    for _ in range(repeticiones):
+        t = time.perf_counter()
+        cur.execute(sql, params)
+        cur.fetchall()
+        tiempos.append((time.perf_counter() - t) * 1000)
+    return statistics.median(tiempos)
+
+
+def correr(cur, etiqueta, repeticiones):
+    print(f"\n== {etiqueta} ==")
+    print(f"{'término':<18} {'consulta':<8} {'anterior ms':>12} {'actual ms':>10} {'x':>7}")
+    for termino in TERMINOS:
+        patron = f"%{termino}%"
+        for nombre, plantilla in CONSULTAS.items():
+            antes = medir(cur, plantilla.format(filtro=FILTRO_ANTERIOR),
+                          [patron] * 3, repeticiones)
+            ahora = medir(cur, plantilla.format(filtro=FILTRO_ACTUAL),
+                          [patron] * 2, repeticiones)
+            print(f"{termino:<18} {nombre:<8} {antes:>12.1f} {ahora:>10.1f} {antes / ahora:>7.1f}")
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Benchmark del filtro q de /control/actividad")
+    ap.add_argument("--filas", type=int, default=3_000_000)
+    ap.add_argument("--usuarios", type=int, default=5_000)
+    ap.add_argument("--repeticiones", type=int, default=5)
+    ap.add_argument("--conservar", action="store_true", help="no borrar el esquema al terminar")
+    args = ap.parse_args()
+
+    conn = psycopg2.connect(DB_URL)
+    conn.autocommit = True
+    try:
+        with conn.cursor() as cur:
+            print("Preparando datos sintéticos...")
+            preparar(cur, args.filas, args.usuarios)
+            correr(cur, "sin índices de trigramas", args.repeticiones)
+            crear_indices_trgm(cur)
+            correr(cur, "con índices de trigramas", args.repeticiones)
+
+            cur.execute(CONSULTAS["pagina"].format(filtro=FILTRO_ACTUAL).replace("SELECT", "EXPLAIN SELECT", 1),
+                        [f"%{TERMINOS[0]}%"] * 2)
+            print("\nPlan (actual, primera página):")
+            for (linea,) in cur.fetchall():
+                print("  " + linea)
+    finally:
+        if not args.conservar:
+            with conn.cursor() as cur:
+                cur.execute(f"DROP SCHEMA IF EXISTS {ESQUEMA} CASCADE")
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
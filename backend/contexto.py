@@ -0,0 +1,108 @@
+# contexto.py - Fragmentación de texto y ranking BM25 local para el chat
+import re
+import math
+import unicodedata
+from collections import Counter
+
+# -----------------------
+# CONFIG
+# -----------------------
+CHUNK_PALABRAS = 220        # ~300 tokens por fragmento
+CHUNK_SOLAPE = 40           # palabras repetidas entre fragmentos consecutivos
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+STOPWORDS = set("""
+a al algo como con de del desde donde e el ella en entre es esta este esto
+fue ha hay la las le les lo los mas me mi muy no nos o para pero por que
+se ser si sin sobre su sus tambien te tiene un una uno unos unas y ya
+""".split())
+
+_WORD_RE = re.compile(r"\S+")
+_TERM_RE = re.compile(r"\w+")
+
+
+def estimar_tokens(texto):
+    """Aproximación de tokens de un LLM (~4 caracteres por token)."""
+    return max(1, math.ceil(len(texto) / 4))
+
+
+def normalizar(texto):
+    texto = unicodedata.normalize("NFKD", texto.lower())
+    return "".join(c for c in texto if not unicodedata.combining(c))
+
+
+def terminos(texto):
+    return [t for t in _TERM_RE.findall(normalizar(texto))
+            if len(t) > 1 and t not in STOPWORDS]
+
+
+def fragmentar(texto, palabras=CHUNK_PALABRAS, solape=CHUNK_SOLAPE):
+    """
+    Divide el texto en ventanas de `palabras` con `solape` palabras en común.
+    Cada fragmento conserva el formato original (saltos de línea, tabs).
+    Retorna lista de (texto, tokens).
+    """
+    spans = [m.span() for m in _WORD_RE.finditer(texto or "")]
+    if not spans:
+        return []
+    paso = max(1, palabras - solape)
+    chunks = []
+    for i in range(0, len(spans), paso):
+        ventana = spans[i:i + palabras]
+        frag = texto[ventana[0][0]:ventana[-1][1]]
+        chunks.append((frag, estimar_tokens(frag)))
+        if i + palabras >= len(spans):
+            break
+    return chunks
+
+
+class BM25Index:
+    """Índice BM25 en memoria sobre una lista de fragmentos."""
+
+    def __init__(self, textos):
+        self.tf = [Counter(terminos(t)) for t in textos]
+        self.largos = [sum(c.values()) for c in self.tf]
+        self.n = len(textos)
+        self.avgdl = (sum(self.largos) / self.n) if self.n else 0
+        df = Counter()
+        for c in self.tf:
+            df.update(c.keys())
+        self.idf = {
+            t: math.log(1 + (self.n - f + 0.5) / (f + 0.5))
+            for t, f in df.items()
+        }
+
+    def puntajes(self, consulta):
+        q = set(terminos(consulta))
+        scores = [0.0] * self.n
+        if not q or not self.avgdl:
+            return scores
+        for i, tf in enumerate(self.tf):
+            norm = BM25_K1 * (1 - BM25_B + BM25_B * self.largos[i] / self.avgdl)
+            s = 0.0
+            for t in q:
+                f = tf.get(t)
+                if f:
+                    s += self.idf[t] * f * (BM25_K1 + 1) / (f + norm)
+            scores[i] = s
+        return scores
+
+
+def empaquetar(chunks, puntajes, budget):
+    """
+    Elige los fragmentos de mayor puntaje que quepan en `budget` tokens.
+    Sin puntajes (consulta vacía) respeta el orden original.
+    """
+    orden = range(len(chunks))
+    if puntajes is not None:
+        orden = sorted((i for i in orden if puntajes[i] > 0), key=lambda i: -puntajes[i])
+    elegidos = []
+    usados = 0
+    for i in orden:
+        tk = chunks[i]["tokens"]
+        if usados + tk > budget:
+            continue
+        elegidos.append(i)
+        usados += tk
+    return elegidos, usados
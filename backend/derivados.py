@@ -0,0 +1,300 @@
+# derivados.py - Miniaturas y caché en disco de archivos derivados
+import os
+import io
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image, ImageOps
+
+# Rasterizado de la primera página de PDFs (opcional, requiere poppler)
+try:
+    from pdf2image import convert_from_path
+except ImportError:
+    convert_from_path = None
+
+logger = logging.getLogger(__name__)
+
+# -----------------------
+# CONFIG
+# -----------------------
+DERIVADOS_DIR = os.getenv(
+    "DERIVADOS_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache", "derivados")
+)
+MINIATURAS_MAX_MB = int(os.getenv("MINIATURAS_MAX_MB", 512))
+MINIATURA_PX = 320
+MINIATURA_EXT = {"pdf", "png", "jpg", "jpeg", "webp"}
+REDIM_MAX_MB = int(os.getenv("REDIM_MAX_MB", 1024))
+REDIM_MAX_PX = 2048
+# Lados permitidos: cada pedido se sube al siguiente, así la cantidad de
+# derivados por foto está acotada (240 = variante thumb de la app móvil)
+REDIM_TAMANOS = (160, 240, 320, 640, 1280, 2048)
+REDIM_FORMATOS = {"webp": ("WEBP", "image/webp"), "jpg": ("JPEG", "image/jpeg"),
+                  "jpeg": ("JPEG", "image/jpeg"), "png": ("PNG", "image/png")}
+
+
+class DiskLRUCache:
+    """
+    Caché de archivos en disco acotada por tamaño total.
+    El orden LRU se mantiene en memoria y se persiste vía mtime (se "toca"
+    el archivo en cada acierto), así sobrevive a reinicios del proceso.
+    """
+
+    def __init__(self, root, max_bytes):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()    # key -> tamaño en bytes
+        self.total = 0
+        os.makedirs(root, exist_ok=True)
+        self._scan()
+
+    def _scan(self):
+        found = []
+        for dirpath, _, files in os.walk(self.root):
+            for name in files:
+                if name.endswith(".tmp"):
+                    continue
+                path = os.path.join(dirpath, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                found.append((st.st_mtime, os.path.relpath(path, self.root), st.st_size))
+        for _, key, size in sorted(found):
+            self.entries[key] = size
+            self.total += size
+        self._evict()
+
+    def path(self, key):
+        return os.path.join(self.root, key)
+
+    def get(self, key):
+        """Ruta del archivo si está en caché (y lo marca como recién usado)."""
+        path = self.path(key)
+        with self.lock:
+            if key not in self.entries:
+                return None
+            if not os.path.exists(path):
+                self.total -= self.entries.pop(key)
+                return None
+            self.entries.move_to_end(key)
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return path
+
+    def put(self, key, data):
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as fh:
+            fh.write(data)
+        os.replace(tmp, path)
+        with self.lock:
+            self.total -= self.entries.pop(key, 0)
+            self.entries[key] = len(data)
+            self.total += len(data)
+            self._evict()
+        return path
+
+    def discard(self, key):
+        with self.lock:
+            if key in self.entries:
+                self.total -= self.entries.pop(key)
+        try:
+            os.remove(self.path(key))
+        except OSError:
+            pass
+
+    def _evict(self):
+        # Se llama con el lock tomado; nunca expulsa el último agregado
+        while self.total > self.max_bytes and len(self.entries) > 1:
+            key, size = self.entries.popitem(last=False)
+            self.total -= size
+            try:
+                os.remove(self.path(key))
+            except OSError:
+                pass
+
+
+miniaturas_cache = DiskLRUCache(
+    os.path.join(DERIVADOS_DIR, "miniaturas"),
+    MINIATURAS_MAX_MB * 1024 * 1024
+)
+
+redim_cache = DiskLRUCache(
+    os.path.join(DERIVADOS_DIR, "redim"),
+    REDIM_MAX_MB * 1024 * 1024
+)
+
+_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="miniaturas")
+
+
+class SingleFlight:
+    """
+    Deduplica trabajos concurrentes con la misma clave: el primer hilo
+    ejecuta la función y los demás esperan y reciben el mismo resultado.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.vuelos = {}    # key -> [Event, resultado, excepción]
+
+    def do(self, key, fn):
+        with self.lock:
+            vuelo = self.vuelos.get(key)
+            lider = vuelo is None
+            if lider:
+                vuelo = self.vuelos[key] = [threading.Event(), None, None]
+        if not lider:
+            vuelo[0].wait()
+            if vuelo[2] is not None:
+                raise vuelo[2]
+            return vuelo[1]
+        try:
+            vuelo[1] = fn()
+            return vuelo[1]
+        except Exception as e:
+            vuelo[2] = e
+            raise
+        finally:
+            with self.lock:
+                self.vuelos.pop(key, None)
+            vuelo[0].set()
+
+
+_redim_vuelos = SingleFlight()
+
+
+def miniatura_key(src_path, extension):
+    """Clave estable por archivo fuente (los archivos subidos no se sobrescriben)."""
+    digest = hashlib.sha1(os.path.abspath(src_path).encode("utf-8")).hexdigest()
+    ext = "png" if extension == "pdf" else "webp"
+    return os.path.join(digest[:2], f"{digest}.{ext}")
+
+
+def miniatura_mimetype(key):
+    return "image/png" if key.endswith(".png") else "image/webp"
+
+
+def render_miniatura(src_path, extension):
+    """PNG de la primera página para PDFs, WebP reducido para imágenes."""
+    if extension == "pdf":
+        if convert_from_path is None:
+            return None
+        pages = convert_from_path(src_path, dpi=72, first_page=1, last_page=1,
+                                  size=(MINIATURA_PX, None))
+        if not pages:
+            return None
+        img = pages[0]
+        fmt, opts = "PNG", {"optimize": True}
+    else:
+        img = Image.open(src_path)
+        img.draft("RGB", (MINIATURA_PX, MINIATURA_PX))
+        fmt, opts = "WEBP", {"quality": 80, "method": 4}
+
+    if img.mode not in ("RGB", "RGBA"):
+        img = img.convert("RGBA" if "A" in img.getbands() else "RGB")
+    img.thumbnail((MINIATURA_PX, MINIATURA_PX), Image.Resampling.LANCZOS)
+    out = io.BytesIO()
+    img.save(out, format=fmt, **opts)
+    return out.getvalue()
+
+
+def obtener_miniatura(src_path, extension):
+    """Retorna (ruta, mimetype) de la miniatura, generándola si no está en caché."""
+    extension = (extension or "").lower()
+    if extension not in MINIATURA_EXT or not os.path.exists(src_path):
+        return None
+    key = miniatura_key(src_path, extension)
+    path = miniaturas_cache.get(key)
+    if path is None:
+        data = render_miniatura(src_path, extension)
+        if not data:
+            return None
+        path = miniaturas_cache.put(key, data)
+    return path, miniatura_mimetype(key)
+
+
+def generar_miniatura_async(src_path, extension):
+    """Encola la generación tras un upload; los errores solo se registran."""
+    extension = (extension or "").lower()
+    if extension not in MINIATURA_EXT:
+        return
+
+    def _job():
+        try:
+            obtener_miniatura(src_path, extension)
+        except Exception as e:
+            logger.warning(f"No se pudo generar miniatura de {src_path}: {e}")
+
+    _executor.submit(_job)
+
+
+def redim_key(src_path, w, h, fmt):
+    """La clave incluye mtime y tamaño: si el original cambia, cambia la URL en caché."""
+    st = os.stat(src_path)
+    base = f"{os.path.abspath(src_path)}|{st.st_mtime_ns}|{st.st_size}"
+    digest = hashlib.sha1(base.encode("utf-8")).hexdigest()
+    return os.path.join(digest[:2], f"{digest}_{w or 0}x{h or 0}.{fmt}")
+
+
+def render_redimension(src_path, w, h, fmt):
+    """Reduce la imagen para caber en w x h (sin ampliar) y la codifica en fmt."""
+    formato, _ = REDIM_FORMATOS[fmt]
+    img = Image.open(src_path)
+    img.draft("RGB", (w or REDIM_MAX_PX, h or REDIM_MAX_PX))
+    img = ImageOps.exif_transpose(img)
+    if formato == "JPEG":
+        img = img.convert("RGB")
+    elif img.mode not in ("RGB", "RGBA"):
+        img = img.convert("RGBA" if "A" in img.getbands() else "RGB")
+    img.thumbnail((w or REDIM_MAX_PX, h or REDIM_MAX_PX), Image.Resampling.LANCZOS)
+    opts = {
+        "WEBP": {"quality": 80, "method": 4},
+        "JPEG": {"quality": 82, "optimize": True, "progressive": True},
+        "PNG": {"optimize": True},
+    }[formato]
+    out = io.BytesIO()
+    img.save(out, format=formato, **opts)
+    return out.getvalue()
+
+
+def tamano_redim(px):
+    """Sube px al siguiente lado de REDIM_TAMANOS; None si es 0/None. ValueError si excede."""
+    if not px:
+        return None
+    for t in REDIM_TAMANOS:
+        if px <= t:
+            return t
+    raise ValueError(f"tamaño máximo {REDIM_MAX_PX}px")
+
+
+def obtener_redimension(src_path, w=None, h=None, fmt="webp"):
+    """
+    Retorna (ruta, mimetype) del derivado w x h en fmt, generándolo una sola
+    vez aunque lleguen varias peticiones simultáneas por la misma clave.
+    """
+    fmt = (fmt or "webp").lower()
+    if fmt not in REDIM_FORMATOS or not os.path.exists(src_path):
+        return None
+    w, h = tamano_redim(w), tamano_redim(h)
+    key = redim_key(src_path, w, h, fmt)
+    mimetype = REDIM_FORMATOS[fmt][1]
+
+    path = redim_cache.get(key)
+    if path is not None:
+        return path, mimetype
+
+    def _render():
+        cached = redim_cache.get(key)
+        if cached is not None:
+            return cached
+        return redim_cache.put(key, render_redimension(src_path, w, h, fmt))
+
+    return _redim_vuelos.do(key, _render), mimetype
@@ -0,0 +1,189 @@
+# eventos.py - Fan-out de LISTEN/NOTIFY de PostgreSQL hacia streams SSE
+import json
+import time
+import queue
+import select
+import logging
+import threading
+from collections import deque
+
+import psycopg2
+import psycopg2.extensions
+
+logger = logging.getLogger(__name__)
+
+# -----------------------
+# CONFIG
+# -----------------------
+HEARTBEAT_S = 15        # comentario SSE si no hay eventos (mantiene vivos proxies)
+BUFFER_EVENTOS = 1000   # eventos recientes para reanudar con Last-Event-ID
+COLA_MAX = 500          # eventos pendientes por suscriptor antes de cortarlo
+RETRY_MS = 3000
+
+
+class Suscripcion:
+    def __init__(self, canal, filtro):
+        self.canal = canal
+        self.filtro = filtro
+        self.cola = queue.Queue(maxsize=COLA_MAX)
+        self.desbordada = False
+
+
+class Notificador:
+    """
+    Un hilo por proceso escucha los canales con una conexión dedicada (fuera
+    del pool) y reparte cada NOTIFY a las suscripciones cuyo filtro acepta el
+    payload. Los ids de evento son "<epoca>-<seq>": la época cambia al
+    reiniciar el proceso o al reconectar el listener, y en ese caso el cliente
+    recibe un evento `reset` para que recargue en vez de asumir continuidad.
+    """
+
+    def __init__(self, dsn, canales, **connect_kwargs):
+        self.dsn = dsn
+        self.canales = list(canales)
+        self.connect_kwargs = connect_kwargs
+        self.lock = threading.Lock()
+        self.suscripciones = set()
+        self.buffer = deque(maxlen=BUFFER_EVENTOS)
+        self.seq = 0
+        self.epoca = str(int(time.time()))
+        self.hilo = None
+
+    # -- listener ---------------------------------------------------------
+    def iniciar(self):
+        with self.lock:
+            if self.hilo is None or not self.hilo.is_alive():
+                self.hilo = threading.Thread(target=self._loop, name="notificador", daemon=True)
+                self.hilo.start()
+
+    def _loop(self):
+        espera = 1
+        primera = True
+        while True:
+            conn = None
+            try:
+                conn = psycopg2.connect(self.dsn, **self.connect_kwargs)
+                conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+                with conn.cursor() as cur:
+                    for canal in self.canales:
+                        cur.execute(f"LISTEN {canal}")
+                if not primera:
+                    # Pudieron perderse eventos mientras no había conexión
+                    self._reset()
+                primera = False
+                espera = 1
+                logger.info(f"Notificador escuchando: {', '.join(self.canales)}")
+
+                while True:
+                    if select.select([conn], [], [], HEARTBEAT_S) == ([], [], []):
+                        continue
+                    conn.poll()
+                    while conn.notifies:
+                        n = conn.notifies.pop(0)
+                        try:
+                            datos = json.loads(n.payload) if n.payload else {}
+                        except ValueError:
+                            datos = {"payload": n.payload}
+                        self.publicar(n.channel, datos)
+            except Exception as e:
+                logger.warning(f"Notificador desconectado: {e}; reintento en {espera}s")
+                time.sleep(espera)
+                espera = min(espera * 2, 30)
+            finally:
+                if conn is not None:
+                    try:
+                        conn.close()
+                    except Exception:
+                        pass
+
+    def _reset(self):
+        with self.lock:
+            self.epoca = str(int(time.time()))
+            self.seq = 0
+            self.buffer.clear()
+            for sub in self.suscripciones:
+                sub.desbordada = True
+                try:
+                    sub.cola.put_nowait(None)
+                except queue.Full:
+                    pass
+
+    # -- fan-out ----------------------------------------------------------
+    def publicar(self, canal, datos):
+        with self.lock:
+            self.seq += 1
+            ev = (self.seq, canal, datos)
+            self.buffer.append(ev)
+            for sub in self.suscripciones:
+                if sub.canal != canal or sub.desbordada:
+                    continue
+                try:
+                    if sub.filtro(datos):
+                        sub.cola.put_nowait(ev)
+                except queue.Full:
+                    sub.desbordada = True
+                except Exception:
+                    pass
+
+    def suscribir(self, canal, filtro, ultimo_id=None):
+        """
+        Registra la suscripción y retorna (sub, pendientes, reanudable).
+        `pendientes` son los eventos del buffer posteriores a ultimo_id.
+        """
+        sub = Suscripcion(canal, filtro)
+        pendientes = []
+        reanudable = True
+        with self.lock:
+            if ultimo_id:
+                epoca, _, seq = ultimo_id.partition("-")
+                try:
+                    seq = int(seq)
+                except ValueError:
+                    seq = -1
+                inicio = self.buffer[0][0] if self.buffer else self.seq + 1
+                if epoca != self.epoca or seq < inicio - 1 or seq > self.seq:
+                    reanudable = False
+                else:
+                    pendientes = [ev for ev in self.buffer
+                                  if ev[0] > seq and ev[1] == canal and filtro(ev[2])]
+            self.suscripciones.add(sub)
+        return sub, pendientes, reanudable
+
+    def cancelar(self, sub):
+        with self.lock:
+            self.suscripciones.discard(sub)
+
+    # -- SSE --------------------------------------------------------------
+    def _sse(self, ev):
+        seq, _, datos = ev
+        tipo = datos.get("tipo", "mensaje") if isinstance(datos, dict) else "mensaje"
+        data = json.dumps(datos, separators=(",", ":"), default=str)
+        return f"id: {self.epoca}-{seq}\nevent: {tipo}\ndata: {data}\n\n"
+
+    def stream(self, canal, filtro, ultimo_id=None):
+        """Generador de texto SSE con heartbeat; termina si el cliente no da abasto."""
+        self.iniciar()
+        sub, pendientes, reanudable = self.suscribir(canal, filtro, ultimo_id)
+
+        def gen():
+            try:
+                yield f"retry: {RETRY_MS}\n\n"
+                if not reanudable:
+                    yield f"event: reset\ndata: {{}}\n\n"
+                for ev in pendientes:
+                    yield self._sse(ev)
+                while True:
+                    try:
+                        ev = sub.cola.get(timeout=HEARTBEAT_S)
+                    except queue.Empty:
+                        yield ": ping\n\n"
+                        continue
+                    if ev is None or sub.desbordada:
+                        # Se perdieron eventos: el cliente debe recargar y reconectar
+                        yield "event: reset\ndata: {}\n\n"
+                        return
+                    yield self._sse(ev)
+            finally:
+                self.cancelar(sub)
+
+        return gen()
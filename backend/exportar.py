@@ -0,0 +1,188 @@
+# exportar.py - Exportación masiva en streaming: COPY TO STDOUT -> gzip/Parquet -> HTTP
+import os
+import zlib
+import queue
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+# -----------------------
+# CONFIG
+# -----------------------
+BLOQUE = 64 * 1024      # tamaño de lectura de COPY y de los bloques enviados
+COLA_BLOQUES = 16       # bloques en vuelo entre COPY y el cliente (memoria acotada)
+GZIP_NIVEL = 6
+
+_FIN = object()
+
+
+class Cancelado(Exception):
+    """El cliente cerró la conexión: el productor debe abortar el COPY."""
+
+
+class SalidaCola:
+    """
+    Archivo de solo escritura que comprime (gzip opcional) y encola bloques.
+    Si el cliente descarga más lento de lo que PostgreSQL produce, `put`
+    bloquea y el COPY se detiene: la memoria usada no depende del rango.
+    """
+
+    def __init__(self, cola, cancelado, comprimir):
+        self.cola = cola
+        self.cancelado = cancelado
+        self.z = zlib.compressobj(GZIP_NIVEL, zlib.DEFLATED, 31) if comprimir else None
+        self.buf = bytearray()
+        self.escritos = 0
+        self.closed = False
+
+    def write(self, data):
+        if self.cancelado.is_set():
+            raise Cancelado()
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        self.escritos += len(data)
+        self.buf += self.z.compress(data) if self.z else data
+        if len(self.buf) >= BLOQUE:
+            self._emitir()
+        return len(data)
+
+    def tell(self):
+        return self.escritos
+
+    def flush(self):
+        pass
+
+    def _emitir(self):
+        if not self.buf:
+            return
+        bloque = bytes(self.buf)
+        self.buf.clear()
+        while True:
+            try:
+                self.cola.put(bloque, timeout=1)
+                return
+            except queue.Full:
+                if self.cancelado.is_set():
+                    raise Cancelado()
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        if self.z:
+            self.buf += self.z.flush()
+        self._emitir()
+
+
+class Exportacion:
+    """
+    Corre `productor(salida)` en un hilo y expone sus bloques como iterable
+    WSGI. `cerrar()` (registrar con response.call_on_close) cancela el
+    productor si el cliente se fue y retorna True si terminó completo.
+    """
+
+    def __init__(self, productor, comprimir=True):
+        self.cola = queue.Queue(maxsize=COLA_BLOQUES)
+        self.cancelado = threading.Event()
+        self.salida = SalidaCola(self.cola, self.cancelado, comprimir)
+        self.productor = productor
+        self.error = None
+        self.completo = False
+        self.hilo = threading.Thread(target=self._correr, name="exportacion", daemon=True)
+        self.hilo.start()
+
+    def _correr(self):
+        try:
+            self.productor(self.salida)
+            self.salida.close()
+            self.completo = True
+        except Cancelado:
+            pass
+        except Exception as e:
+            self.error = e
+            logger.error(f"Error en exportación: {e}")
+        finally:
+            while True:
+                try:
+                    self.cola.put(_FIN, timeout=1)
+                    break
+                except queue.Full:
+                    if self.cancelado.is_set():
+                        break
+
+    def bloques(self):
+        while True:
+            bloque = self.cola.get()
+            if bloque is _FIN:
+                # Si hubo error el archivo queda truncado (gzip/Parquet inválido):
+                # el cliente lo detecta al descomprimir o leer el footer
+                return
+            yield bloque
+
+    def cerrar(self):
+        self.cancelado.set()
+        self.hilo.join()
+        return self.completo
+
+
+def copiar(conn, sql):
+    """Productor: COPY ... TO STDOUT de `sql` (ya con parámetros interpolados)."""
+    def productor(salida):
+        with conn.cursor() as cur:
+            cur.copy_expert(sql, salida, size=BLOQUE)
+    return productor
+
+
+def _tipos_arrow(tipos):
+    import pyarrow as pa
+    mapa = {
+        "int32": pa.int32(), "int64": pa.int64(), "bool": pa.bool_(), "string": pa.string(),
+        "timestamp": pa.timestamp("us"), "timestamptz": pa.timestamp("us", tz="UTC"),
+    }
+    return {col: mapa[t] for col, t in tipos.items()}
+
+
+def copiar_parquet(conn, sql_csv, tipos):
+    """
+    Productor: COPY a CSV por un pipe, pyarrow lo lee por bloques y escribe
+    Parquet (zstd) hacia la salida. Los tipos se fijan de antemano para que
+    no cambien entre bloques. Requiere pyarrow.
+    """
+    import pyarrow as pa
+    import pyarrow.csv as pacsv
+    import pyarrow.parquet as pq
+
+    def productor(salida):
+        r, w = os.pipe()
+        errores = []
+
+        def copiar_csv():
+            try:
+                with os.fdopen(w, "wb") as fw, conn.cursor() as cur:
+                    cur.copy_expert(sql_csv, fw, size=BLOQUE)
+            except Exception as e:
+                errores.append(e)
+
+        hilo = threading.Thread(target=copiar_csv, name="exportacion_csv", daemon=True)
+        hilo.start()
+        try:
+            with os.fdopen(r, "rb") as fr:
+                # COPY escribe los booleanos como t/f, NULL como campo vacío sin
+                # comillas y los textos con saltos de línea entre comillas
+                lector = pacsv.open_csv(
+                    fr, parse_options=pacsv.ParseOptions(newlines_in_values=True),
+                    convert_options=pacsv.ConvertOptions(
+                        column_types=_tipos_arrow(tipos),
+                        true_values=["t"], false_values=["f"],
+                        strings_can_be_null=True, quoted_strings_can_be_null=False))
+                with pq.ParquetWriter(pa.PythonFile(salida, mode="w"), lector.schema,
+                                      compression="zstd") as writer:
+                    for lote in lector:
+                        writer.write_batch(lote)
+        finally:
+            hilo.join()
+        if errores:
+            raise errores[0]
+
+    return productor
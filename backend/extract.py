@@ -5,62 +5,390 @@ from PIL import Image
 import pytesseract
 import subprocess
 import pathlib
-import time
+import os
+import hashlib
+import logging
+import threading
+import queue
+import shutil
+import tempfile
+from datetime import datetime, date
+from concurrent.futures import ProcessPoolExecutor, Future
+
+import word97
+
+# Rasterizado de páginas escaneadas (opcional, requiere poppler)
+try:
+    from pdf2image import convert_from_path
+except ImportError:
+    convert_from_path = None
+
+# Lectura de .xls legacy (opcional; openpyxl solo lee .xlsx)
+try:
+    import xlrd
+except ImportError:
+    xlrd = None
+
+logger = logging.getLogger(__name__)
+
+SOFFICE = (
+    os.getenv("SOFFICE_PATH")
+    or shutil.which("soffice")
+    or r"C:\Program Files\LibreOffice\program\soffice.exe"
+)
+
+# -----------------------
+# CONFIG EXTRACCIÓN PDF
+# -----------------------
+CACHE_DIR = os.getenv(
+    "EXTRACT_CACHE_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache", "texto")
+)
+PDF_WORKERS = int(os.getenv("PDF_WORKERS", max(1, (os.cpu_count() or 2) - 1)))
+PDF_PARALLEL_MIN_PAGES = 8      # bajo este número no vale la pena repartir
+PDF_OCR_DPI = 300
+PDF_OCR_LANG = os.getenv("OCR_LANG", "spa")
+
+_pdf_pool = None
+_pdf_pool_lock = threading.Lock()
+
+
+def _get_pdf_pool():
+    global _pdf_pool
+    with _pdf_pool_lock:
+        if _pdf_pool is None:
+            _pdf_pool = ProcessPoolExecutor(max_workers=PDF_WORKERS)
+        return _pdf_pool
+
+
+def _doc_key(file_path):
+    """Clave de caché: ruta + tamaño + mtime (cambia si el archivo se reemplaza)."""
+    st = os.stat(file_path)
+    raw = f"{os.path.abspath(file_path)}|{st.st_size}|{st.st_mtime_ns}"
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+def _page_cache_path(key, page_num):
+    return os.path.join(CACHE_DIR, key[:2], key, f"{page_num}.txt")
+
+
+def _read_page_cache(key, page_num):
+    path = _page_cache_path(key, page_num)
+    try:
+        with open(path, encoding="utf-8") as fh:
+            return fh.read()
+    except FileNotFoundError:
+        return None
+
+
+def _write_page_cache(key, page_num, text):
+    path = _page_cache_path(key, page_num)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as fh:
+        fh.write(text)
+    os.replace(tmp, path)
+
+
+def _ocr_pdf_page(file_path, page_num):
+    """Rasteriza una página (1-based) y la pasa por tesseract. None si no hay OCR."""
+    if convert_from_path is None:
+        return None
+    images = convert_from_path(
+        file_path, dpi=PDF_OCR_DPI,
+        first_page=page_num, last_page=page_num
+    )
+    return "\n".join(
+        pytesseract.image_to_string(img, lang=PDF_OCR_LANG) for img in images
+    )
+
+
+def _extract_pdf_pages_worker(file_path, page_nums):
+    """
+    Ejecutado en un proceso del pool: abre el PDF una sola vez y extrae
+    el lote de páginas. Si la capa de texto está vacía, aplica OCR.
+    Retorna (num_pagina, texto, cacheable): una página sin texto cuyo OCR
+    falló o no está disponible no se cachea, para reintentarla después.
+    """
+    reader = PdfReader(file_path)
+    result = []
+    for n in page_nums:
+        try:
+            text = reader.pages[n - 1].extract_text() or ""
+        except Exception:
+            text = ""
+        cacheable = True
+        if not text.strip():
+            try:
+                ocr = _ocr_pdf_page(file_path, n)
+            except Exception as e:
+                logger.warning(f"OCR falló en página {n} de {file_path}: {e}")
+                ocr = None
+            if ocr is None:
+                cacheable = False
+            else:
+                text = ocr
+        result.append((n, text, cacheable))
+    return result
+
+
+def pdf_page_count(file_path):
+    return len(PdfReader(file_path).pages)
+
+
+def extract_pdf_pages(file_path, first=1, last=None):
+    """
+    Retorna lista de (num_pagina, texto) para el rango [first, last] (1-based).
+    Las páginas ya extraídas salen de la caché; las faltantes se reparten
+    en lotes contiguos entre los procesos del pool.
+    """
+    total = pdf_page_count(file_path)
+    first = max(1, int(first or 1))
+    last = total if last is None else min(total, int(last))
+    if first > last:
+        return []
+
+    key = _doc_key(file_path)
+    pages = {}
+    missing = []
+    for n in range(first, last + 1):
+        cached = _read_page_cache(key, n)
+        if cached is None:
+            missing.append(n)
+        else:
+            pages[n] = cached
+
+    if missing:
+        if len(missing) < PDF_PARALLEL_MIN_PAGES or PDF_WORKERS <= 1:
+            extracted = _extract_pdf_pages_worker(file_path, missing)
+        else:
+            size = -(-len(missing) // PDF_WORKERS)
+            batches = [missing[i:i + size] for i in range(0, len(missing), size)]
+            pool = _get_pdf_pool()
+            futures = [pool.submit(_extract_pdf_pages_worker, file_path, b) for b in batches]
+            extracted = [item for f in futures for item in f.result()]
+
+        for n, text, cacheable in extracted:
+            pages[n] = text
+            if not cacheable:
+                continue
+            try:
+                _write_page_cache(key, n, text)
+            except OSError as e:
+                logger.warning(f"No se pudo cachear página {n} de {file_path}: {e}")
+
+    return [(n, pages[n]) for n in range(first, last + 1)]
+
+
+# -----------------------
+# CONVERSIÓN .doc
+# -----------------------
+DOC_WORKERS = int(os.getenv("DOC_WORKERS", 2))
+DOC_TIMEOUT = int(os.getenv("DOC_TIMEOUT", 60))
+DOC_QUEUE_MAX = int(os.getenv("DOC_QUEUE_MAX", 50))
+
+
+class DocConverter:
+    """
+    Pool de workers de larga vida que convierten .doc con LibreOffice.
+    Cada worker usa su propio perfil de LO (se crea una sola vez y queda
+    caliente) y cada trabajo escribe en su propio directorio temporal,
+    así las conversiones concurrentes no se pisan.
+    """
+
+    def __init__(self, workers=DOC_WORKERS, timeout=DOC_TIMEOUT, maxsize=DOC_QUEUE_MAX):
+        self.timeout = timeout
+        self.jobs = queue.Queue(maxsize=maxsize)
+        self.threads = []
+        for i in range(workers):
+            t = threading.Thread(target=self._worker, args=(i,), daemon=True,
+                                 name=f"doc-converter-{i}")
+            t.start()
+            self.threads.append(t)
+
+    def _worker(self, idx):
+        profile = tempfile.mkdtemp(prefix=f"lo_profile_{idx}_")
+        profile_url = pathlib.Path(profile).as_uri()
+        while True:
+            archivo, fut = self.jobs.get()
+            try:
+                if fut.set_running_or_notify_cancel():
+                    try:
+                        fut.set_result(self._convert(archivo, profile_url))
+                    except Exception as e:
+                        fut.set_exception(e)
+            finally:
+                self.jobs.task_done()
+
+    def _convert(self, archivo, profile_url):
+        archivo = pathlib.Path(archivo)
+        with tempfile.TemporaryDirectory(prefix="lo_job_") as outdir:
+            subprocess.run([
+                SOFFICE,
+                f"-env:UserInstallation={profile_url}",
+                "--headless", "--norestore",
+                "--convert-to", "txt:Text (encoded):UTF8",
+                str(archivo),
+                "--outdir", outdir
+            ], check=True, timeout=self.timeout,
+               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+            txt_path = pathlib.Path(outdir) / f"{archivo.stem}.txt"
+            if not txt_path.exists():
+                raise FileNotFoundError("LibreOffice no generó el .txt")
+            return txt_path.read_text(encoding="utf-8", errors="ignore")
+
+    def submit(self, archivo):
+        """Encola una conversión. Lanza queue.Full si la cola está saturada."""
+        fut = Future()
+        self.jobs.put((str(archivo), fut), timeout=self.timeout)
+        return fut
+
+    def convert(self, archivo):
+        return self.submit(archivo).result(timeout=self.timeout * 2)
+
+
+_doc_converter = None
+_doc_converter_lock = threading.Lock()
+
+
+def soffice_disponible():
+    return bool(SOFFICE) and os.path.exists(SOFFICE)
+
+
+def get_doc_converter():
+    global _doc_converter
+    with _doc_converter_lock:
+        if _doc_converter is None:
+            _doc_converter = DocConverter()
+        return _doc_converter
 
-SOFFICE = r"C:\Program Files\LibreOffice\program\soffice.exe"
 
 def extract_doc(archivo):
-    archivo = pathlib.Path(archivo)
-    outdir = archivo.parent
+    """
+    Texto de un .doc. Primero el lector Word97 en Python puro (rápido y sin
+    procesos externos); si el formato no lo soporta (Word 6/95, cifrado, etc.)
+    se encola en el pool de LibreOffice, cuando está instalado.
+    """
+    try:
+        return word97.extract_text_from_path(archivo)
+    except word97.Word97Error as e:
+        if not soffice_disponible():
+            raise
+        logger.info(f"Word97 no soportado para {archivo} ({e}), usando LibreOffice")
+    return get_doc_converter().convert(archivo)
+
+
+# -----------------------
+# PLANILLAS (xls / xlsx)
+# -----------------------
+SHEET_MAX = int(os.getenv("SHEET_MAX", 20))
+SHEET_MAX_CELLS = int(os.getenv("SHEET_MAX_CELLS", 200_000))
+
+
+def _cell_str(value):
+    if value is None:
+        return ""
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    if isinstance(value, datetime):
+        return value.date().isoformat() if value.time() == datetime.min.time() else value.isoformat(sep=" ")
+    if isinstance(value, date):
+        return value.isoformat()
+    return str(value).replace("\t", " ").replace("\r", " ").replace("\n", " ").strip()
 
-    # 1️⃣ Convertir
-    subprocess.run([
-        SOFFICE,
-        "--headless",
-        "--convert-to", "txt:Text",
-        str(archivo),
-        "--outdir", str(outdir)
-    ], check=True)
 
-    # 2️⃣ Esperar un pelín (Windows + LO lo necesita)
-    time.sleep(0.5)
+def _rows_to_tsv(sheets, max_sheets, max_cells):
+    """
+    Recorre (nombre_hoja, iterador_de_filas) y arma TSV por hoja, cortando
+    al llegar a los límites de hojas o celdas para acotar memoria y tamaño.
+    """
+    out = []
+    cells = 0
+    for i, (name, rows) in enumerate(sheets):
+        if i >= max_sheets:
+            out.append(f"[... hojas omitidas desde la {i + 1}]")
+            break
+        lines = []
+        for row in rows:
+            values = [_cell_str(v) for v in row]
+            while values and not values[-1]:
+                values.pop()
+            if not values:
+                continue
+            if cells + len(values) > max_cells:
+                lines.append("[... truncado por límite de celdas]")
+                cells = max_cells
+                break
+            cells += len(values)
+            lines.append("\t".join(values))
+        if lines:
+            out.append(f"## Hoja: {name}")
+            out.extend(lines)
+        if cells >= max_cells:
+            break
+    return "\n".join(out)
 
-    # 3️⃣ Buscar el txt generado
-    txt_files = list(outdir.glob("*.txt"))
 
-    if not txt_files:
-        raise FileNotFoundError("LibreOffice no generó ningún .txt")
+def _xlsx_sheets(wb):
+    for ws in wb.worksheets:
+        yield ws.title, ws.iter_rows(values_only=True)
 
-    # el más reciente (el recién convertido)
-    txt_path = max(txt_files, key=lambda p: p.stat().st_mtime)
 
-    # 4️⃣ Leer contenido
-    return txt_path.read_text(encoding="utf-8", errors="ignore")
+def _xls_sheets(book):
+    for idx in range(book.nsheets):
+        sh = book.sheet_by_index(idx)
+
+        def rows(sh=sh):
+            for r in range(sh.nrows):
+                row = []
+                for c in sh.row_slice(r):
+                    if c.ctype == xlrd.XL_CELL_DATE:
+                        try:
+                            row.append(xlrd.xldate_as_datetime(c.value, book.datemode))
+                            continue
+                        except Exception:
+                            pass
+                    row.append(c.value if c.ctype not in (xlrd.XL_CELL_EMPTY, xlrd.XL_CELL_BLANK) else None)
+                yield row
+
+        yield sh.name, rows()
+        book.unload_sheet(idx)
+
+
+def extract_spreadsheet(file_path, extension, max_sheets=SHEET_MAX, max_cells=SHEET_MAX_CELLS):
+    """Extrae una planilla fila a fila (streaming) como TSV por hoja."""
+    if extension == "xls":
+        if xlrd is None:
+            raise ImportError("xlrd no instalado: no se pueden leer .xls")
+        book = xlrd.open_workbook(file_path, on_demand=True)
+        try:
+            return _rows_to_tsv(_xls_sheets(book), max_sheets, max_cells)
+        finally:
+            book.release_resources()
+
+    wb = load_workbook(file_path, read_only=True, data_only=True)
+    try:
+        return _rows_to_tsv(_xlsx_sheets(wb), max_sheets, max_cells)
+    finally:
+        wb.close()
 
 
 def extract_text_from_file(file_path, extension):
     try:
         if extension == "pdf":
-            reader = PdfReader(file_path)
-            return "\n".join(page.extract_text() or "" for page in reader.pages)
+            return "\n".join(text for _, text in extract_pdf_pages(file_path))
 
         elif extension == "docx":
             doc = Document(file_path)
             return "\n".join(p.text for p in doc.paragraphs)
-        
+
         elif extension == "doc":
             doc = extract_doc(file_path)
             return doc
 
         elif extension in ("xls", "xlsx"):
-            wb = load_workbook(file_path, data_only=True)
-            text = []
-            for sheet in wb:
-                for row in sheet.iter_rows():
-                    for cell in row:
-                        if cell.value:
-                            text.append(str(cell.value))
-            return "\n".join(text)
+            return extract_spreadsheet(file_path, extension)
 
         elif extension in ("png", "jpg", "jpeg"):
             img = Image.open(file_path)
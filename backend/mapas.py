@@ -0,0 +1,235 @@
+# mapas.py - Utilidades geográficas para los mapas (viewport, grilla de clusters, tiles)
+import math
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+
+# -----------------------
+# CONFIG
+# -----------------------
+ZOOM_PUNTOS = 16        # desde este zoom se entregan reportes individuales
+ZOOM_MAX = 22
+CELDA_PX = 64           # lado de la celda de clustering en píxeles de pantalla
+MAX_PUNTOS = 2000       # tope de reportes individuales por respuesta
+TILES_MAX = 5000        # tiles GeoJSON retenidos en memoria (LRU)
+CELDA_DUP_GRADOS = 0.0005   # ~55 m; debe coincidir con celda_x/celda_y en database.sql
+METROS_POR_GRADO = 111320.0
+
+
+def parse_bbox(valor):
+    """
+    'oeste,sur,este,norte' (orden de Leaflet toBBoxString) -> tupla de floats.
+    Leaflet entrega longitudes fuera de ±180 con zoom bajo o al cruzar el
+    antimeridiano: se recortan a [-180, 180] / [-90, 90] y, si el rango
+    queda vacío o invertido, se usa el rango completo de ese eje.
+    Lanza ValueError si el formato no es válido.
+    """
+    partes = [float(x) for x in (valor or "").split(",")]
+    if len(partes) != 4 or not all(math.isfinite(x) for x in partes):
+        raise ValueError("bbox debe ser oeste,sur,este,norte")
+    oeste, sur, este, norte = partes
+    oeste, este = max(-180.0, min(180.0, oeste)), max(-180.0, min(180.0, este))
+    sur, norte = max(-90.0, min(90.0, sur)), max(-90.0, min(90.0, norte))
+    if oeste >= este:
+        oeste, este = -180.0, 180.0
+    if sur >= norte:
+        sur, norte = -90.0, 90.0
+    return oeste, sur, este, norte
+
+
+def parse_ids(valor):
+    """'1,2,3' -> [1, 2, 3]; None si no viene el parámetro."""
+    if not valor:
+        return None
+    return [int(x) for x in valor.split(",") if x.strip().isdigit()]
+
+
+def tamano_celda(zoom):
+    """Lado de la celda en grados: CELDA_PX píxeles al zoom dado (tiles de 256 px)."""
+    return 360.0 / (2 ** zoom) * CELDA_PX / 256
+
+
+def distancia_m(lat1, lon1, lat2, lon2):
+    """Distancia haversine en metros."""
+    p1, p2 = math.radians(lat1), math.radians(lat2)
+    dp = p2 - p1
+    dl = math.radians(lon2 - lon1)
+    a = math.sin(dp / 2) ** 2 + math.cos(p1) * math.cos(p2) * math.sin(dl / 2) ** 2
+    return 2 * 6371000.0 * math.asin(math.sqrt(a))
+
+
+def rango_celdas_dup(lat, lon, radio_m):
+    """
+    (x0, x1, y0, y1) de las celdas de duplicados que cubren un círculo de
+    radio_m alrededor del punto; con radios menores a la celda son 3x3.
+    """
+    cx = math.floor(lon / CELDA_DUP_GRADOS)
+    cy = math.floor(lat / CELDA_DUP_GRADOS)
+    ry = math.ceil(radio_m / (CELDA_DUP_GRADOS * METROS_POR_GRADO))
+    rx = math.ceil(radio_m / (CELDA_DUP_GRADOS * METROS_POR_GRADO * max(0.01, math.cos(math.radians(lat)))))
+    return cx - rx, cx + rx, cy - ry, cy + ry
+
+
+# -----------------------
+# TILES (esquema XYZ / Web Mercator, GeoJSON)
+# -----------------------
+def tile_valido(z, x, y):
+    return 0 <= z <= ZOOM_MAX and 0 <= x < 2 ** z and 0 <= y < 2 ** z
+
+
+def _lat_tile(y, n):
+    return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * y / n))))
+
+
+def tile_bbox(z, x, y):
+    """(oeste, sur, este, norte) en grados del tile z/x/y."""
+    n = 2 ** z
+    return (x / n * 360.0 - 180.0, _lat_tile(y + 1, n),
+            (x + 1) / n * 360.0 - 180.0, _lat_tile(y, n))
+
+
+def intersecta(a, b):
+    return a[0] <= b[2] and b[0] <= a[2] and a[1] <= b[3] and b[1] <= a[3]
+
+
+def decimales_zoom(z):
+    """Decimales suficientes para precisión de un píxel al zoom dado."""
+    grados_px = 360.0 / (256 * 2 ** z)
+    return max(1, min(7, math.ceil(-math.log10(grados_px))))
+
+
+def _posiciones(coords):
+    if coords and isinstance(coords[0], (int, float)):
+        yield coords
+        return
+    for c in coords or ():
+        yield from _posiciones(c)
+
+
+def _geometrias(geom):
+    if not geom:
+        return
+    if geom.get("type") == "GeometryCollection":
+        for g in geom.get("geometries") or ():
+            yield from _geometrias(g)
+    else:
+        yield geom
+
+
+def bbox_geometria(geom):
+    """bbox (oeste, sur, este, norte) de una geometría GeoJSON o None si está vacía."""
+    xs, ys = [], []
+    for g in _geometrias(geom):
+        for pos in _posiciones(g.get("coordinates")):
+            xs.append(pos[0])
+            ys.append(pos[1])
+    if not xs:
+        return None
+    return min(xs), min(ys), max(xs), max(ys)
+
+
+def features_geojson(geojson):
+    """Normaliza FeatureCollection / Feature / geometría suelta a lista de Features."""
+    if not isinstance(geojson, dict):
+        return []
+    tipo = geojson.get("type")
+    if tipo == "FeatureCollection":
+        return [f for f in geojson.get("features") or () if isinstance(f, dict)]
+    if tipo == "Feature":
+        return [geojson]
+    return [{"type": "Feature", "geometry": geojson, "properties": {}}]
+
+
+def bbox_geojson(geojson):
+    cajas = [b for b in (bbox_geometria(f.get("geometry")) for f in features_geojson(geojson)) if b]
+    if not cajas:
+        return None
+    return (min(b[0] for b in cajas), min(b[1] for b in cajas),
+            max(b[2] for b in cajas), max(b[3] for b in cajas))
+
+
+def _redondear(coords, d):
+    if coords and isinstance(coords[0], (int, float)):
+        return [round(c, d) for c in coords]
+    return [_redondear(c, d) for c in coords]
+
+
+def redondear_geometria(geom, d):
+    if geom.get("type") == "GeometryCollection":
+        return {"type": "GeometryCollection",
+                "geometries": [redondear_geometria(g, d) for g in geom.get("geometries") or ()]}
+    return {"type": geom["type"], "coordinates": _redondear(geom.get("coordinates") or [], d)}
+
+
+def recortar_geojson(geojson, bbox, z, propiedades):
+    """
+    Features del geojson cuyo bbox toca el tile, con coordenadas redondeadas
+    a la precisión del zoom. Las geometrías no se cortan: Leaflet dibuja la
+    feature completa y el cliente deduplica por `propiedades` + índice.
+    """
+    d = decimales_zoom(z)
+    out = []
+    for i, f in enumerate(features_geojson(geojson)):
+        geom = f.get("geometry")
+        caja = bbox_geometria(geom)
+        if not caja or not intersecta(caja, bbox):
+            continue
+        props = dict(f.get("properties") or {})
+        props.update(propiedades)
+        props["feature_idx"] = i
+        out.append({"type": "Feature", "geometry": redondear_geometria(geom, d),
+                    "properties": props})
+    return out
+
+
+def coleccion(features):
+    """FeatureCollection serializada + ETag (hash del contenido)."""
+    data = json.dumps({"type": "FeatureCollection", "features": features},
+                      separators=(",", ":"), default=str).encode("utf-8")
+    return data, hashlib.sha1(data).hexdigest()
+
+
+class TileCache:
+    """
+    Caché LRU en memoria de tiles ya serializados: (capa, z, x, y) -> (bytes, etag).
+    La invalidación borra solo los tiles de la capa que tocan el bbox modificado.
+    """
+
+    def __init__(self, max_tiles=TILES_MAX):
+        self.max_tiles = max_tiles
+        self.lock = threading.Lock()
+        self.tiles = OrderedDict()
+        self.generacion = 0     # sube en cada invalidación
+
+    def get(self, key):
+        with self.lock:
+            val = self.tiles.get(key)
+            if val is not None:
+                self.tiles.move_to_end(key)
+            return val
+
+    def put(self, key, val, generacion=None):
+        """
+        Si se pasa la generación leída antes de consultar la BD y hubo una
+        invalidación entremedio, el tile puede estar desactualizado: no se guarda.
+        """
+        with self.lock:
+            if generacion is not None and generacion != self.generacion:
+                return
+            self.tiles[key] = val
+            self.tiles.move_to_end(key)
+            while len(self.tiles) > self.max_tiles:
+                self.tiles.popitem(last=False)
+
+    def invalidar(self, capa, bbox):
+        """Descarta los tiles de `capa` que intersectan bbox (un punto es un bbox degenerado)."""
+        if bbox is None:
+            return 0
+        with self.lock:
+            afectados = [k for k in self.tiles
+                         if k[0] == capa and intersecta(tile_bbox(*k[1:]), bbox)]
+            for k in afectados:
+                del self.tiles[k]
+            self.generacion += 1
+        return len(afectados)
@@ -0,0 +1,125 @@
+# particiones.py - Mantenimiento de las particiones mensuales de control_actividad
+import os
+import gzip
+import logging
+
+logger = logging.getLogger(__name__)
+
+# -----------------------
+# CONFIG
+# -----------------------
+PARTICIONES_ADELANTE = 3     # meses futuros que deben existir siempre
+RETENCION_MESES = int(os.getenv("CONTROL_RETENCION_MESES", 12))   # 0 = sin retención
+ARCHIVO_DIR = os.getenv("CONTROL_ARCHIVO_DIR",
+                        os.path.join(os.path.dirname(os.path.abspath(__file__)), "archivo_control"))
+ARCHIVO_FORMATO = os.getenv("CONTROL_ARCHIVO_FORMATO", "csv").lower()  # csv | parquet
+LOCK_MANTENCION = 724001     # pg_advisory_lock: un solo proceso mantiene a la vez
+
+
+def asegurar_particiones(conn, meses=PARTICIONES_ADELANTE):
+    """Crea las particiones del mes actual y los `meses` siguientes. Retorna cuántas creó."""
+    with conn.cursor() as cur:
+        cur.execute("SELECT control_asegurar_particiones(%s)", (meses,))
+        creadas = cur.fetchone()[0]
+    conn.commit()
+    return creadas
+
+
+def particiones_vencidas(conn, meses=RETENCION_MESES):
+    with conn.cursor() as cur:
+        cur.execute("SELECT tabla, mes FROM control_particiones_vencidas(%s)", (meses,))
+        return cur.fetchall()
+
+
+def _exportar_csv(conn, tabla, destino):
+    """COPY de la partición a CSV.gz en streaming; retorna filas escritas."""
+    tmp = destino + ".tmp"
+    with conn.cursor() as cur, gzip.open(tmp, "wb") as f:
+        cur.copy_expert(f'COPY (SELECT * FROM "{tabla}" ORDER BY fecha, id) '
+                        f'TO STDOUT WITH (FORMAT csv, HEADER true)', f)
+        filas = cur.rowcount
+    os.replace(tmp, destino)
+    return filas
+
+
+def _csv_a_parquet(origen, destino):
+    """Convierte el CSV.gz a Parquet por bloques (sin cargar la partición en memoria)."""
+    import pyarrow.csv as pacsv
+    import pyarrow.parquet as pq
+
+    tmp = destino + ".tmp"
+    lector = pacsv.open_csv(origen)
+    with pq.ParquetWriter(tmp, lector.schema, compression="zstd") as writer:
+        for lote in lector:
+            writer.write_batch(lote)
+    os.replace(tmp, destino)
+
+
+def exportar_particion(conn, tabla, directorio=ARCHIVO_DIR, formato=ARCHIVO_FORMATO):
+    """
+    Exporta una partición a `directorio`. Parquet requiere pyarrow; si no está
+    instalado se deja el CSV.gz. Retorna (ruta, filas).
+    """
+    os.makedirs(directorio, exist_ok=True)
+    ruta_csv = os.path.join(directorio, f"{tabla}.csv.gz")
+    filas = _exportar_csv(conn, tabla, ruta_csv)
+
+    with conn.cursor() as cur:
+        cur.execute(f'SELECT COUNT(*) FROM "{tabla}"')
+        esperadas = cur.fetchone()[0]
+    if filas >= 0 and filas != esperadas:
+        raise RuntimeError(f"{tabla}: se exportaron {filas} filas de {esperadas}")
+
+    if formato != "parquet":
+        return ruta_csv, esperadas
+    try:
+        ruta_pq = os.path.join(directorio, f"{tabla}.parquet")
+        _csv_a_parquet(ruta_csv, ruta_pq)
+        os.remove(ruta_csv)
+        return ruta_pq, esperadas
+    except ImportError:
+        logger.warning("pyarrow no instalado: archivo de control queda en CSV.gz")
+        return ruta_csv, esperadas
+
+
+def archivar_vencidas(conn, meses=RETENCION_MESES, directorio=ARCHIVO_DIR, formato=ARCHIVO_FORMATO):
+    """
+    Exporta, desacopla y elimina las particiones fuera de la retención.
+    Los totales históricos siguen en control_rollup_hora.
+    """
+    if meses <= 0:
+        return []
+    archivadas = []
+    for tabla, mes in particiones_vencidas(conn, meses):
+        ruta, filas = exportar_particion(conn, tabla, directorio, formato)
+        conn.commit()
+        with conn.cursor() as cur:
+            cur.execute(f'ALTER TABLE control_actividad DETACH PARTITION "{tabla}"')
+            cur.execute(f'DROP TABLE "{tabla}"')
+        conn.commit()
+        logger.info(f"Partición {tabla} archivada en {ruta} ({filas} filas)")
+        archivadas.append({"tabla": tabla, "mes": mes.isoformat(), "archivo": ruta, "filas": filas})
+    return archivadas
+
+
+def mantener(conn):
+    """
+    Crea particiones futuras y aplica la retención. Si otro proceso ya está
+    manteniendo (advisory lock tomado), no hace nada y retorna None.
+    """
+    with conn.cursor() as cur:
+        cur.execute("SELECT pg_try_advisory_lock(%s)", (LOCK_MANTENCION,))
+        if not cur.fetchone()[0]:
+            conn.rollback()
+            return None
+    try:
+        creadas = asegurar_particiones(conn)
+        archivadas = archivar_vencidas(conn)
+        return {"creadas": creadas, "archivadas": archivadas}
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        with conn.cursor() as cur:
+            cur.execute("SELECT pg_advisory_unlock(%s)", (LOCK_MANTENCION,))
+        conn.commit()
@@ -0,0 +1,89 @@
+# resumenes.py - Actualización incremental de los resúmenes del módulo de control
+import os
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+# -----------------------
+# CONFIG
+# -----------------------
+INTERVALO_S = int(os.getenv("CONTROL_RESUMEN_INTERVALO_S", 60))
+LOTE_IDS = 50000            # ids de control_actividad por transacción
+ESPERA_MAX_S = 2.0          # espera máxima por escritores en curso al fijar el horizonte
+PAUSA_XID_S = 0.2           # margen entre nextval() y la asignación del xid del escritor
+
+
+def horizonte(conn):
+    """
+    Mayor id de control_actividad tal que toda fila con id menor o igual ya
+    está confirmada (o abortada), sin bloquear la tabla.
+
+    Un id entregado por la secuencia puede pertenecer a una transacción que
+    aún no confirma. Se lee el último valor de la secuencia y, tras una
+    pausa, el xmax del snapshot: toda transacción que tomó un id hasta ese
+    valor tiene un xid menor. Cuando el xmin de un snapshot posterior
+    alcanza ese xmax ya no queda ninguna abierta. Retorna None si los
+    escritores no terminaron dentro de ESPERA_MAX_S.
+    """
+    with conn.cursor() as cur:
+        cur.execute("SELECT COALESCE(pg_sequence_last_value('control_actividad_id_seq'), 0)")
+        h = cur.fetchone()[0]
+        conn.commit()
+        # nextval() se evalúa antes de que el INSERT obtenga su xid
+        time.sleep(PAUSA_XID_S)
+        cur.execute("SELECT txid_snapshot_xmax(txid_current_snapshot())")
+        xmax = cur.fetchone()[0]
+        conn.commit()
+
+        limite = time.monotonic() + ESPERA_MAX_S
+        while True:
+            cur.execute("SELECT txid_snapshot_xmin(txid_current_snapshot())")
+            xmin = cur.fetchone()[0]
+            conn.commit()
+            if xmin >= xmax:
+                return h
+            if time.monotonic() >= limite:
+                return None
+            time.sleep(0.1)
+
+
+def estado(cur):
+    """(watermark, computed_at) actuales."""
+    cur.execute("SELECT watermark, computed_at FROM control_resumen_estado")
+    row = cur.fetchone()
+    return (row[0], row[1]) if row else (0, None)
+
+
+def actualizar(conn, lote=LOTE_IDS):
+    """
+    Aplica a control_resumen_usuario / control_resumen_proyecto las filas
+    nuevas desde el watermark, en lotes de `lote` ids (una transacción por
+    lote). Varios procesos pueden llamarla a la vez: el FOR UPDATE sobre la
+    fila de estado los serializa.
+    """
+    h = horizonte(conn)
+    if h is None:
+        logger.info("Resúmenes de control: escritores en curso, se reintenta en la próxima vuelta")
+        with conn.cursor() as cur:
+            w, computed_at = estado(cur)
+        conn.commit()
+        return {"procesadas": 0, "watermark": w, "computed_at": computed_at, "al_dia": False}
+
+    procesadas = 0
+    with conn.cursor() as cur:
+        while True:
+            cur.execute("SELECT watermark FROM control_resumen_estado FOR UPDATE")
+            desde = cur.fetchone()[0]
+            if desde >= h:
+                cur.execute("UPDATE control_resumen_estado SET computed_at = NOW() "
+                            "RETURNING watermark, computed_at")
+                w, computed_at = cur.fetchone()
+                conn.commit()
+                break
+            hasta = min(desde + lote, h)
+            cur.execute("SELECT control_resumenes_aplicar(%s, %s)", (desde, hasta))
+            procesadas += cur.fetchone()[0]
+            cur.execute("UPDATE control_resumen_estado SET watermark = %s", (hasta,))
+            conn.commit()
+    return {"procesadas": procesadas, "watermark": w, "computed_at": computed_at, "al_dia": True}
@@ -0,0 +1,214 @@
+# word97.py - Extracción de texto de .doc (Word 97-2003) en Python puro
+#
+# Se usa cuando LibreOffice no está instalado. Lee el contenedor OLE2
+# (Compound File Binary) y recorre la tabla de piezas (Clx/PlcPcd) del
+# stream WordDocument para reconstruir el texto del cuerpo principal.
+import struct
+
+OLE_SIGNATURE = b"\xD0\xCF\x11\xE0\xA1\xB1\x1A\xE1"
+ENDOFCHAIN = 0xFFFFFFFE
+FREESECT = 0xFFFFFFFF
+
+WORD_IDENT = 0xA5EC
+FIB_FLAG_ENCRYPTED = 0x0100
+FIB_FLAG_TABLE1 = 0x0200
+
+
+class Word97Error(Exception):
+    pass
+
+
+class OleFile:
+    """Lector mínimo de Compound File Binary: solo lo necesario para leer streams."""
+
+    def __init__(self, data):
+        if data[:8] != OLE_SIGNATURE:
+            raise Word97Error("No es un archivo OLE2")
+        self.data = data
+        try:
+            self._parse()
+        except (struct.error, IndexError, ValueError) as e:
+            # Header o cadenas truncadas/corruptas
+            raise Word97Error(f"Contenedor OLE2 dañado: {e}") from e
+
+    def _parse(self):
+        data = self.data
+        (self.sector_shift, self.mini_shift) = struct.unpack_from("<HH", data, 0x1E)
+        self.sector_size = 1 << self.sector_shift
+        self.mini_size = 1 << self.mini_shift
+        (n_fat, first_dir, _, self.mini_cutoff,
+         first_minifat, n_minifat, first_difat, n_difat) = struct.unpack_from("<IIIIIIII", data, 0x2C)
+
+        # DIFAT: 109 entradas en el header + cadena de sectores DIFAT
+        difat = list(struct.unpack_from("<109I", data, 0x4C))
+        per_sector = self.sector_size // 4 - 1
+        sect = first_difat
+        for _ in range(n_difat):
+            if sect in (ENDOFCHAIN, FREESECT):
+                break
+            entries = struct.unpack_from(f"<{per_sector + 1}I", self._sector(sect))
+            difat.extend(entries[:per_sector])
+            sect = entries[per_sector]
+        fat_sectors = [s for s in difat if s not in (ENDOFCHAIN, FREESECT)][:n_fat]
+
+        self.fat = []
+        for s in fat_sectors:
+            self.fat.extend(struct.unpack_from(f"<{self.sector_size // 4}I", self._sector(s)))
+
+        self.entries = self._read_directory(self._read_chain(first_dir), self.sector_size)
+        root = self.entries[0]
+        self.mini_stream = self._read_chain(root["start"])[:root["size"]]
+
+        minifat_raw = self._read_chain(first_minifat) if n_minifat else b""
+        self.minifat = list(struct.unpack_from(f"<{len(minifat_raw) // 4}I", minifat_raw))
+
+    def _sector(self, n):
+        off = (n + 1) << self.sector_shift
+        return self.data[off:off + self.sector_size]
+
+    def _read_chain(self, start):
+        out = []
+        sect = start
+        seen = set()
+        while sect not in (ENDOFCHAIN, FREESECT) and sect < len(self.fat):
+            if sect in seen:
+                raise Word97Error("Cadena FAT circular")
+            seen.add(sect)
+            out.append(self._sector(sect))
+            sect = self.fat[sect]
+        return b"".join(out)
+
+    def _read_mini_chain(self, start):
+        out = []
+        sect = start
+        seen = set()
+        while sect not in (ENDOFCHAIN, FREESECT) and sect < len(self.minifat):
+            if sect in seen:
+                raise Word97Error("Cadena MiniFAT circular")
+            seen.add(sect)
+            off = sect * self.mini_size
+            out.append(self.mini_stream[off:off + self.mini_size])
+            sect = self.minifat[sect]
+        return b"".join(out)
+
+    @staticmethod
+    def _read_directory(raw, sector_size):
+        entries = []
+        for off in range(0, len(raw) - 127, 128):
+            name_len, obj_type = struct.unpack_from("<HB", raw, off + 64)
+            name = raw[off:off + max(0, name_len - 2)].decode("utf-16-le", errors="ignore")
+            start, size = struct.unpack_from("<IQ", raw, off + 116)
+            if sector_size == 512:  # v3: los 32 bits altos pueden traer basura
+                size &= 0xFFFFFFFF
+            entries.append({
+                "name": name,
+                "type": obj_type,
+                "start": start,
+                "size": size,
+            })
+        return entries
+
+    def open_stream(self, name):
+        for e in self.entries:
+            if e["type"] == 2 and e["name"] == name:
+                if e["size"] < self.mini_cutoff:
+                    return self._read_mini_chain(e["start"])[:e["size"]]
+                return self._read_chain(e["start"])[:e["size"]]
+        raise Word97Error(f"Stream {name} no encontrado")
+
+
+def _clean(text):
+    """Quita códigos de campo y convierte marcas de Word en texto plano."""
+    out = []
+    fields = []     # pila: True mientras se está en la instrucción del campo
+    for ch in text:
+        code = ord(ch)
+        if code == 0x13:            # inicio de campo
+            fields.append(True)
+            continue
+        if code == 0x14:            # separador: empieza el resultado visible
+            if fields:
+                fields[-1] = False
+            continue
+        if code == 0x15:            # fin de campo
+            if fields:
+                fields.pop()
+            continue
+        if any(fields):
+            continue
+        if ch in "\r\x0b\x0c":
+            out.append("\n")
+        elif code == 0x07:          # fin de celda / fila
+            out.append("\t")
+        elif code == 0x1E:          # guion no separable
+            out.append("-")
+        elif code < 0x20 and ch not in "\t\n":
+            continue
+        else:
+            out.append(ch)
+    return "".join(out)
+
+
+def extract_text(data):
+    """Retorna el texto del cuerpo principal de un .doc a partir de sus bytes."""
+    try:
+        return _extract_text(data)
+    except (struct.error, IndexError, ValueError) as e:
+        # FIB o tabla de piezas con offsets fuera de rango
+        raise Word97Error(f"Estructura de documento dañada: {e}") from e
+
+
+def _extract_text(data):
+    ole = OleFile(data)
+    wd = ole.open_stream("WordDocument")
+    ident, = struct.unpack_from("<H", wd, 0)
+    if ident != WORD_IDENT:
+        raise Word97Error("Stream WordDocument inválido")
+    flags, = struct.unpack_from("<H", wd, 0x0A)
+    if flags & FIB_FLAG_ENCRYPTED:
+        raise Word97Error("Documento cifrado")
+
+    table = ole.open_stream("1Table" if flags & FIB_FLAG_TABLE1 else "0Table")
+
+    # FibBase(32) + csw + fibRgW + cslw + fibRgLw + cbRgFcLcb + fibRgFcLcb
+    csw, = struct.unpack_from("<H", wd, 32)
+    lw_off = 34 + csw * 2
+    cslw, = struct.unpack_from("<H", wd, lw_off)
+    ccp_text, = struct.unpack_from("<i", wd, lw_off + 2 + 3 * 4)
+    fclcb_off = lw_off + 2 + cslw * 4 + 2
+    fc_clx, lcb_clx = struct.unpack_from("<II", wd, fclcb_off + 33 * 8)
+    if not lcb_clx:
+        raise Word97Error("Documento sin tabla de piezas")
+
+    clx = table[fc_clx:fc_clx + lcb_clx]
+    pos = 0
+    while pos < len(clx) and clx[pos] == 0x01:     # Prc: se saltan
+        cb, = struct.unpack_from("<h", clx, pos + 1)
+        pos += 3 + cb
+    if pos >= len(clx) or clx[pos] != 0x02:
+        raise Word97Error("Pcdt no encontrado")
+    lcb, = struct.unpack_from("<I", clx, pos + 1)
+    plc = clx[pos + 5:pos + 5 + lcb]
+    n = (lcb - 4) // 12
+    cps = struct.unpack_from(f"<{n + 1}I", plc, 0)
+
+    parts = []
+    remaining = ccp_text
+    for i in range(n):
+        if remaining <= 0:
+            break
+        fc, = struct.unpack_from("<I", plc, (n + 1) * 4 + i * 8 + 2)
+        count = min(cps[i + 1] - cps[i], remaining)
+        if fc & 0x40000000:
+            off = (fc & ~0x40000000) // 2
+            parts.append(wd[off:off + count].decode("cp1252", errors="replace"))
+        else:
+            parts.append(wd[fc:fc + count * 2].decode("utf-16-le", errors="replace"))
+        remaining -= count
+
+    return _clean("".join(parts))
+
+
+def extract_text_from_path(path):
+    with open(path, "rb") as fh:
+        return extract_text(fh.read())
@@ -0,0 +1,171 @@
+-- ============================================================
+-- CONTEXTO DOCUMENTAL PARA EL CHAT
+-- Compatibilidad: PostgreSQL (Railway)
+-- Texto extraído de proyectos_documentos dividido en fragmentos
+-- solapados con su conteo de tokens, y un resumen compacto por
+-- proyecto. El ranking BM25 se calcula en el backend (contexto.py).
+-- ============================================================
+
+-- ───────────────────────────────────────────────────────────
+-- 1. TABLA: proyectos_documentos_chunks
+-- ───────────────────────────────────────────────────────────
+CREATE TABLE IF NOT EXISTS proyectos_documentos_chunks (
+    id              BIGSERIAL PRIMARY KEY,
+    documento_id    INT NOT NULL REFERENCES proyectos_documentos(documento_id) ON DELETE CASCADE,
+    proyecto_id     INT NOT NULL REFERENCES proyectos(id) ON DELETE CASCADE,
+    orden           INT NOT NULL,        -- posición del fragmento dentro del documento
+    texto           TEXT NOT NULL,
+    tokens          INT NOT NULL,        -- estimación de tokens del fragmento
+    UNIQUE (documento_id, orden)
+);
+
+CREATE INDEX IF NOT EXISTS idx_chunks_proyecto ON proyectos_documentos_chunks (proyecto_id, documento_id, orden);
+
+-- ───────────────────────────────────────────────────────────
+-- 2. Marca de indexación en proyectos_documentos
+--    NULL = pendiente (se indexa al primer uso o tras el upload)
+-- ───────────────────────────────────────────────────────────
+ALTER TABLE proyectos_documentos ADD COLUMN IF NOT EXISTS indexado_en TIMESTAMP WITH TIME ZONE;
+
+-- Extracción fallida o sin texto: no se marca indexado_en; se registra el
+-- intento y se reintenta hasta INDEXADO_MAX_INTENTOS (app21.py)
+ALTER TABLE proyectos_documentos ADD COLUMN IF NOT EXISTS indexado_intentos INT NOT NULL DEFAULT 0;
+ALTER TABLE proyectos_documentos ADD COLUMN IF NOT EXISTS indexado_error TEXT;
+
+-- Reclamo de indexación en curso (transacción corta): la extracción corre
+-- sin locks de fila; un reclamo de más de 30 min se considera abandonado
+ALTER TABLE proyectos_documentos ADD COLUMN IF NOT EXISTS indexando_desde TIMESTAMP WITH TIME ZONE;
+
+-- ───────────────────────────────────────────────────────────
+-- 3. TABLA: proyectos_digest
+--    Resumen compacto por proyecto para /proyectos_chat?budget=
+--    Se mantiene por triggers en proyectos, hitos y observaciones
+-- ───────────────────────────────────────────────────────────
+CREATE TABLE IF NOT EXISTS proyectos_digest (
+    proyecto_id       INT PRIMARY KEY REFERENCES proyectos(id) ON DELETE CASCADE,
+    digest            JSONB NOT NULL,
+    texto             TEXT NOT NULL,      -- línea compacta lista para el prompt
+    tokens            INT NOT NULL,
+    area_id           INT,
+    estado_id         INT,
+    financiamiento_id INT,
+    ult_modificacion  TIMESTAMP,
+    actualizado_en    TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT NOW()
+);
+
+CREATE INDEX IF NOT EXISTS idx_digest_ult_mod ON proyectos_digest (ult_modificacion DESC);
+
+CREATE OR REPLACE FUNCTION refrescar_digest_proyecto(p_id INT)
+RETURNS VOID AS $$
+BEGIN
+    INSERT INTO proyectos_digest (
+        proyecto_id, digest, texto, tokens,
+        area_id, estado_id, financiamiento_id, ult_modificacion, actualizado_en
+    )
+    SELECT
+        p.id,
+        d.digest,
+        d.texto,
+        CEIL(LENGTH(d.texto) / 4.0)::INT,
+        p.area_id, p.estado_proyecto_id, p.financiamiento_id,
+        GREATEST(p.fecha_actualizacion, uh.creado_en, uo.creado_en),
+        NOW()
+    FROM proyectos p
+    LEFT JOIN areas a                 ON a.id = p.area_id
+    LEFT JOIN financiamientos f       ON f.id = p.financiamiento_id
+    LEFT JOIN etapas_proyecto ep      ON ep.id = p.etapa_proyecto_id
+    LEFT JOIN estados_proyecto es     ON es.id = p.estado_proyecto_id
+    LEFT JOIN estados_postulacion epo ON epo.id = p.estado_postulacion_id
+    LEFT JOIN sectores s              ON s.id = p.sector_id
+    LEFT JOIN LATERAL (
+        SELECT h.fecha, h.creado_en, LEFT(h.observacion, 160) AS observacion, hc.nombre AS tipo
+        FROM proyectos_hitos h
+        LEFT JOIN hitoscalendario hc ON hc.id = h.categoria_hito
+        WHERE h.proyecto_id = p.id
+        ORDER BY h.fecha DESC, h.id DESC
+        LIMIT 1
+    ) uh ON TRUE
+    LEFT JOIN LATERAL (
+        SELECT o.fecha, o.creado_en, LEFT(o.observacion, 160) AS observacion
+        FROM proyectos_observaciones o
+        WHERE o.proyecto_id = p.id
+        ORDER BY o.fecha DESC, o.id DESC
+        LIMIT 1
+    ) uo ON TRUE
+    CROSS JOIN LATERAL (
+        SELECT
+            jsonb_strip_nulls(jsonb_build_object(
+                'id', p.id,
+                'nombre', p.nombre,
+                'area', a.nombre,
+                'estado', es.nombre,
+                'etapa', ep.nombre,
+                'postulacion', epo.nombre,
+                'financiamiento', f.nombre,
+                'sector', s.nombre,
+                'monto', p.monto,
+                'avance', p.avance_total_porcentaje,
+                'anno_ejecucion', p.anno_ejecucion,
+                'ult_hito', CASE WHEN uh.fecha IS NOT NULL THEN jsonb_build_object(
+                    'fecha', uh.fecha, 'tipo', uh.tipo, 'obs', uh.observacion) END,
+                'ult_observacion', CASE WHEN uo.fecha IS NOT NULL THEN jsonb_build_object(
+                    'fecha', uo.fecha, 'obs', uo.observacion) END
+            )) AS digest,
+            CONCAT_WS(' | ',
+                '[ID:' || p.id || '] ' || COALESCE(p.nombre, 'S/N'),
+                'Área: ' || a.nombre,
+                'Estado: ' || es.nombre,
+                'Etapa: ' || ep.nombre,
+                'Fin: ' || f.nombre,
+                'Monto: ' || p.monto,
+                'Avance: ' || p.avance_total_porcentaje || '%',
+                'Hito ' || uh.fecha || ': ' || COALESCE(uh.tipo, '') || ' ' || COALESCE(uh.observacion, ''),
+                'Obs ' || uo.fecha || ': ' || uo.observacion
+            ) AS texto
+    ) d
+    WHERE p.id = p_id
+    ON CONFLICT (proyecto_id) DO UPDATE SET
+        digest            = EXCLUDED.digest,
+        texto             = EXCLUDED.texto,
+        tokens            = EXCLUDED.tokens,
+        area_id           = EXCLUDED.area_id,
+        estado_id         = EXCLUDED.estado_id,
+        financiamiento_id = EXCLUDED.financiamiento_id,
+        ult_modificacion  = EXCLUDED.ult_modificacion,
+        actualizado_en    = NOW();
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION trg_refrescar_digest()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_TABLE_NAME = 'proyectos' THEN
+        IF TG_OP <> 'DELETE' THEN
+            PERFORM refrescar_digest_proyecto(NEW.id);
+        END IF;
+    ELSE
+        PERFORM refrescar_digest_proyecto(
+            CASE TG_OP WHEN 'DELETE' THEN OLD.proyecto_id ELSE NEW.proyecto_id END
+        );
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_digest_proyectos ON proyectos;
+CREATE TRIGGER trg_digest_proyectos
+AFTER INSERT OR UPDATE ON proyectos
+FOR EACH ROW EXECUTE FUNCTION trg_refrescar_digest();
+
+DROP TRIGGER IF EXISTS trg_digest_hitos ON proyectos_hitos;
+CREATE TRIGGER trg_digest_hitos
+AFTER INSERT OR UPDATE OR DELETE ON proyectos_hitos
+FOR EACH ROW EXECUTE FUNCTION trg_refrescar_digest();
+
+DROP TRIGGER IF EXISTS trg_digest_observaciones ON proyectos_observaciones;
+CREATE TRIGGER trg_digest_observaciones
+AFTER INSERT OR UPDATE OR DELETE ON proyectos_observaciones
+FOR EACH ROW EXECUTE FUNCTION trg_refrescar_digest();
+
+-- Carga inicial
+SELECT refrescar_digest_proyecto(id) FROM proyectos;
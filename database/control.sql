@@ -55,7 +55,7 @@ CREATE TABLE IF NOT EXISTS control_actividad (
 -- Índices para consultas frecuentes en el panel de control
 CREATE INDEX IF NOT EXISTS idx_ctrl_user_id   ON control_actividad (user_id);
 CREATE INDEX IF NOT EXISTS idx_ctrl_accion    ON control_actividad (accion);
-CREATE INDEX IF NOT EXISTS idx_ctrl_fecha     ON control_actividad (fecha DESC);
+CREATE INDEX IF NOT EXISTS idx_ctrl_fecha_id  ON control_actividad (fecha DESC, id DESC);
 CREATE INDEX IF NOT EXISTS idx_ctrl_modulo    ON control_actividad (modulo);
 CREATE INDEX IF NOT EXISTS idx_ctrl_entidad   ON control_actividad (entidad_tipo, entidad_id);
 
@@ -202,3 +202,489 @@ WHERE NOT EXISTS (
     SELECT 1 FROM control_actividad
     WHERE accion = 'sistema_iniciado' AND modulo = 'sistema'
 );
+
+-- ───────────────────────────────────────────────────────────
+-- 7. ROLLUP HORARIO: control_rollup_hora
+--    Conteos por (hora, usuario, módulo, acción, entidad) mantenidos
+--    por un trigger de sentencia (un upsert agregado por INSERT, también
+--    para inserciones multi-fila). /control/kpi y el PDF leen de aquí y
+--    solo tocan filas crudas para la hora parcial y las últimas acciones.
+--    Las dimensiones nulas se guardan como 0 / '' para poder usar la PK.
+-- ───────────────────────────────────────────────────────────
+CREATE TABLE IF NOT EXISTS control_rollup_hora (
+    hora            TIMESTAMP WITH TIME ZONE NOT NULL,   -- inicio de la hora (UTC)
+    user_id         INT NOT NULL DEFAULT 0,
+    modulo          VARCHAR(40) NOT NULL DEFAULT '',
+    accion          VARCHAR(80) NOT NULL,
+    entidad_tipo    VARCHAR(40) NOT NULL DEFAULT '',
+    entidad_id      INT NOT NULL DEFAULT 0,
+    entidad_nombre  TEXT,                                -- último nombre visto
+    total           INT NOT NULL DEFAULT 0,
+    fallidas        INT NOT NULL DEFAULT 0,
+    ultima          TIMESTAMP WITH TIME ZONE,
+    PRIMARY KEY (hora, user_id, modulo, accion, entidad_tipo, entidad_id)
+);
+
+CREATE INDEX IF NOT EXISTS idx_rollup_hora_user     ON control_rollup_hora (user_id);
+CREATE INDEX IF NOT EXISTS idx_rollup_hora_entidad  ON control_rollup_hora (entidad_tipo, entidad_id);
+
+CREATE OR REPLACE FUNCTION control_rollup_insert()
+RETURNS TRIGGER AS $$
+BEGIN
+    INSERT INTO control_rollup_hora AS r
+        (hora, user_id, modulo, accion, entidad_tipo, entidad_id,
+         entidad_nombre, total, fallidas, ultima)
+    SELECT
+        date_trunc('hour', n.fecha AT TIME ZONE 'UTC') AT TIME ZONE 'UTC',
+        COALESCE(n.user_id, 0), COALESCE(n.modulo, ''), n.accion,
+        COALESCE(n.entidad_tipo, ''), COALESCE(n.entidad_id, 0),
+        (ARRAY_AGG(n.entidad_nombre ORDER BY n.fecha DESC, n.id DESC)
+            FILTER (WHERE n.entidad_nombre IS NOT NULL))[1],
+        COUNT(*),
+        COUNT(*) FILTER (WHERE n.exitoso = FALSE),
+        MAX(n.fecha)
+    FROM nuevas n
+    GROUP BY 1, 2, 3, 4, 5, 6
+    ORDER BY 1, 2, 3, 4, 5, 6          -- orden estable de locks entre sesiones
+    ON CONFLICT (hora, user_id, modulo, accion, entidad_tipo, entidad_id) DO UPDATE
+        SET total          = r.total + EXCLUDED.total,
+            fallidas       = r.fallidas + EXCLUDED.fallidas,
+            ultima         = GREATEST(r.ultima, EXCLUDED.ultima),
+            entidad_nombre = CASE
+                WHEN EXCLUDED.entidad_nombre IS NOT NULL
+                     AND (r.ultima IS NULL OR EXCLUDED.ultima >= r.ultima)
+                THEN EXCLUDED.entidad_nombre
+                ELSE COALESCE(r.entidad_nombre, EXCLUDED.entidad_nombre)
+            END;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Carga inicial + trigger en la misma transacción (sin perder filas entre
+-- ambos). Solo la primera vez: después de aplicar retención (sección 8) el
+-- rollup conserva historia que ya no está en control_actividad.
+DO $$
+BEGIN
+    IF EXISTS (SELECT 1 FROM pg_trigger WHERE tgname = 'trg_control_rollup') THEN
+        RETURN;
+    END IF;
+
+    LOCK TABLE control_actividad IN SHARE ROW EXCLUSIVE MODE;
+    DELETE FROM control_rollup_hora;
+    INSERT INTO control_rollup_hora
+        (hora, user_id, modulo, accion, entidad_tipo, entidad_id,
+         entidad_nombre, total, fallidas, ultima)
+    SELECT
+        date_trunc('hour', fecha AT TIME ZONE 'UTC') AT TIME ZONE 'UTC',
+        COALESCE(user_id, 0), COALESCE(modulo, ''), accion,
+        COALESCE(entidad_tipo, ''), COALESCE(entidad_id, 0),
+        (ARRAY_AGG(entidad_nombre ORDER BY fecha DESC, id DESC)
+            FILTER (WHERE entidad_nombre IS NOT NULL))[1],
+        COUNT(*), COUNT(*) FILTER (WHERE exitoso = FALSE), MAX(fecha)
+    FROM control_actividad
+    GROUP BY 1, 2, 3, 4, 5, 6;
+
+    CREATE TRIGGER trg_control_rollup
+    AFTER INSERT ON control_actividad
+    REFERENCING NEW TABLE AS nuevas
+    FOR EACH STATEMENT EXECUTE FUNCTION control_rollup_insert();
+END;
+$$;
+
+-- ───────────────────────────────────────────────────────────
+-- 8. PARTICIONADO MENSUAL DE control_actividad
+--    Particiones por rango de `fecha` (meses calendario de Santiago),
+--    nombradas control_actividad_pYYYYMM, más una DEFAULT de resguardo.
+--    El backend (particiones.py) crea los meses siguientes y archiva
+--    (CSV.gz / Parquet) y elimina los que salen de la retención.
+-- ───────────────────────────────────────────────────────────
+CREATE OR REPLACE FUNCTION control_crear_particiones(p_desde DATE, p_hasta DATE)
+RETURNS INT AS $$
+DECLARE
+    v_mes    DATE := date_trunc('month', p_desde)::DATE;
+    v_ini    TIMESTAMPTZ;
+    v_fin    TIMESTAMPTZ;
+    v_nombre TEXT;
+    v_n      INT := 0;
+BEGIN
+    WHILE v_mes <= p_hasta LOOP
+        v_nombre := 'control_actividad_p' || to_char(v_mes, 'YYYYMM');
+        v_ini := v_mes::TIMESTAMP AT TIME ZONE 'America/Santiago';
+        v_fin := (v_mes + INTERVAL '1 month')::TIMESTAMP AT TIME ZONE 'America/Santiago';
+
+        IF to_regclass(v_nombre) IS NULL THEN
+            -- Filas que cayeron en DEFAULT para este mes se mueven a la
+            -- partición nueva (si no, CREATE ... PARTITION OF falla)
+            CREATE TEMP TABLE IF NOT EXISTS _ctrl_mover
+                (LIKE control_actividad) ON COMMIT DROP;
+            DELETE FROM _ctrl_mover;
+            WITH m AS (
+                DELETE FROM control_actividad_default
+                WHERE fecha >= v_ini AND fecha < v_fin
+                RETURNING *
+            )
+            INSERT INTO _ctrl_mover SELECT * FROM m;
+
+            EXECUTE format('CREATE TABLE %I PARTITION OF control_actividad FOR VALUES FROM (%L) TO (%L)',
+                           v_nombre, v_ini, v_fin);
+            -- Directo a la partición: el trigger de rollup (de sentencia,
+            -- sobre la tabla padre) no vuelve a contar estas filas
+            EXECUTE format('INSERT INTO %I SELECT * FROM _ctrl_mover', v_nombre);
+            v_n := v_n + 1;
+        END IF;
+        v_mes := (v_mes + INTERVAL '1 month')::DATE;
+    END LOOP;
+    RETURN v_n;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Mes actual + p_meses siguientes
+CREATE OR REPLACE FUNCTION control_asegurar_particiones(p_meses INT DEFAULT 3)
+RETURNS INT AS $$
+    SELECT control_crear_particiones(
+        (NOW() AT TIME ZONE 'America/Santiago')::DATE,
+        ((NOW() AT TIME ZONE 'America/Santiago') + make_interval(months => p_meses))::DATE);
+$$ LANGUAGE sql;
+
+-- Particiones completas más antiguas que la retención (en meses)
+CREATE OR REPLACE FUNCTION control_particiones_vencidas(p_meses INT)
+RETURNS TABLE (tabla TEXT, mes DATE) AS $$
+    SELECT c.relname::TEXT,
+           to_date(substring(c.relname FROM 'p(\d{6})$'), 'YYYYMM') AS mes
+    FROM pg_inherits i
+    JOIN pg_class c ON c.oid = i.inhrelid
+    WHERE i.inhparent = 'control_actividad'::regclass
+      AND c.relname ~ '^control_actividad_p\d{6}$'
+      AND to_date(substring(c.relname FROM 'p(\d{6})$'), 'YYYYMM')
+          < (date_trunc('month', NOW() AT TIME ZONE 'America/Santiago')
+             - make_interval(months => p_meses))::DATE
+    ORDER BY mes;
+$$ LANGUAGE sql STABLE;
+
+-- Migración de la tabla plana a particionada (una sola vez)
+DO $$
+DECLARE
+    v_min DATE;
+BEGIN
+    IF EXISTS (SELECT 1 FROM pg_partitioned_table
+               WHERE partrelid = 'control_actividad'::regclass) THEN
+        RETURN;
+    END IF;
+
+    LOCK TABLE control_actividad IN ACCESS EXCLUSIVE MODE;
+
+    -- Dependientes de la tabla vieja: se recrean al final
+    DROP MATERIALIZED VIEW IF EXISTS control_resumen_usuario;
+    DROP MATERIALIZED VIEW IF EXISTS control_resumen_proyecto;
+    DROP TRIGGER IF EXISTS trg_control_rollup ON control_actividad;
+
+    ALTER TABLE control_actividad RENAME TO control_actividad_plana;
+    ALTER TABLE control_actividad_plana RENAME CONSTRAINT control_actividad_pkey TO control_actividad_plana_pkey;
+    DROP INDEX IF EXISTS idx_ctrl_user_id, idx_ctrl_accion, idx_ctrl_fecha, idx_ctrl_fecha_id,
+                         idx_ctrl_modulo, idx_ctrl_entidad;
+
+    -- La PK de una tabla particionada debe incluir la clave de partición
+    CREATE TABLE control_actividad (
+        id              BIGINT NOT NULL DEFAULT nextval('control_actividad_id_seq'),
+        user_id         INT REFERENCES users(user_id) ON DELETE SET NULL,
+        accion          VARCHAR(80) NOT NULL,
+        modulo          VARCHAR(40) DEFAULT 'proyectos',
+        entidad_tipo    VARCHAR(40),
+        entidad_id      INT,
+        entidad_nombre  TEXT,
+        exitoso         BOOLEAN DEFAULT TRUE,
+        detalle         TEXT,
+        ip_origen       INET,
+        user_agent      TEXT,
+        endpoint        VARCHAR(200),
+        datos_antes     JSONB,
+        datos_despues   JSONB,
+        fecha           TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT NOW(),
+        PRIMARY KEY (id, fecha)
+    ) PARTITION BY RANGE (fecha);
+    ALTER SEQUENCE control_actividad_id_seq OWNED BY control_actividad.id;
+
+    CREATE INDEX idx_ctrl_user_id   ON control_actividad (user_id);
+    CREATE INDEX idx_ctrl_accion    ON control_actividad (accion);
+    CREATE INDEX idx_ctrl_fecha_id  ON control_actividad (fecha DESC, id DESC);
+    CREATE INDEX idx_ctrl_modulo    ON control_actividad (modulo);
+    CREATE INDEX idx_ctrl_entidad   ON control_actividad (entidad_tipo, entidad_id);
+
+    CREATE TABLE control_actividad_default PARTITION OF control_actividad DEFAULT;
+
+    SELECT MIN(fecha AT TIME ZONE 'America/Santiago')::DATE INTO v_min FROM control_actividad_plana;
+    PERFORM control_crear_particiones(
+        COALESCE(v_min, (NOW() AT TIME ZONE 'America/Santiago')::DATE),
+        ((NOW() AT TIME ZONE 'America/Santiago') + INTERVAL '3 months')::DATE);
+
+    -- Sin trigger de rollup todavía: esas filas ya están contadas
+    INSERT INTO control_actividad SELECT * FROM control_actividad_plana;
+    DROP TABLE control_actividad_plana;
+
+    CREATE TRIGGER trg_control_rollup
+    AFTER INSERT ON control_actividad
+    REFERENCING NEW TABLE AS nuevas
+    FOR EACH STATEMENT EXECUTE FUNCTION control_rollup_insert();
+END;
+$$;
+
+-- Las vistas materializadas de las secciones 3 y 4 se reemplazan por
+-- tablas incrementales en la sección 11.
+
+-- ───────────────────────────────────────────────────────────
+-- 9. ÍNDICE KEYSET DE /control/actividad
+--    idx_ctrl_fecha_id (fecha DESC, id DESC), creado en la sección 1,
+--    sirve el cursor de paginación y todo ORDER BY fecha DESC; el
+--    antiguo idx_ctrl_fecha queda redundante.
+-- ───────────────────────────────────────────────────────────
+DROP INDEX IF EXISTS idx_ctrl_fecha;
+
+-- ───────────────────────────────────────────────────────────
+-- 10. BÚSQUEDA DE TEXTO LIBRE (q) CON TRIGRAMAS
+--     Misma expresión que CONTROL_TEXTO_SQL en app21.py: si cambia
+--     una hay que cambiar la otra o el índice deja de usarse.
+--     El nombre de usuario se resuelve contra users (índice propio)
+--     y se filtra por idx_ctrl_user_id.
+-- ───────────────────────────────────────────────────────────
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+CREATE INDEX IF NOT EXISTS idx_ctrl_texto_trgm ON control_actividad
+    USING gin ((COALESCE(detalle, '') || E'\n' || COALESCE(entidad_nombre, '')) gin_trgm_ops);
+
+CREATE INDEX IF NOT EXISTS idx_users_nombre_trgm ON users
+    USING gin (nombre gin_trgm_ops);
+
+-- ───────────────────────────────────────────────────────────
+-- 11. RESÚMENES INCREMENTALES (reemplazan las vistas materializadas)
+--     control_resumen_usuario / control_resumen_proyecto pasan a ser
+--     tablas de contadores que el backend (resumenes.py) actualiza con
+--     las filas de control_actividad con id > watermark. Los conteos
+--     distintos (proyectos por usuario, usuarios por proyecto, días
+--     activos) se sostienen con tablas de pares: solo los pares nuevos
+--     (INSERT ... ON CONFLICT DO NOTHING RETURNING) suman.
+--     Nombre, email, etc. se leen de users/proyectos al consultar.
+-- ───────────────────────────────────────────────────────────
+DO $$
+BEGIN
+    IF EXISTS (SELECT 1 FROM pg_matviews WHERE matviewname = 'control_resumen_usuario') THEN
+        DROP MATERIALIZED VIEW control_resumen_usuario;
+    END IF;
+    IF EXISTS (SELECT 1 FROM pg_matviews WHERE matviewname = 'control_resumen_proyecto') THEN
+        DROP MATERIALIZED VIEW control_resumen_proyecto;
+    END IF;
+END;
+$$;
+
+CREATE TABLE IF NOT EXISTS control_resumen_usuario (
+    user_id                         INT PRIMARY KEY,
+    total_acciones                  BIGINT NOT NULL DEFAULT 0,
+    acciones_proyectos              BIGINT NOT NULL DEFAULT 0,
+    vistas_proyecto                 BIGINT NOT NULL DEFAULT 0,
+    ediciones_proyecto              BIGINT NOT NULL DEFAULT 0,
+    creaciones_proyecto             BIGINT NOT NULL DEFAULT 0,
+    total_lecturas                  BIGINT NOT NULL DEFAULT 0,
+    total_escrituras                BIGINT NOT NULL DEFAULT 0,
+    acciones_fallidas               BIGINT NOT NULL DEFAULT 0,
+    proyectos_distintos_accedidos   BIGINT NOT NULL DEFAULT 0,
+    dias_activo                     BIGINT NOT NULL DEFAULT 0,
+    primera_actividad               TIMESTAMP WITH TIME ZONE,
+    ultima_actividad                TIMESTAMP WITH TIME ZONE
+);
+
+CREATE TABLE IF NOT EXISTS control_resumen_proyecto (
+    proyecto_id         INT PRIMARY KEY,
+    total_acciones      BIGINT NOT NULL DEFAULT 0,
+    total_vistas        BIGINT NOT NULL DEFAULT 0,
+    total_ediciones     BIGINT NOT NULL DEFAULT 0,
+    usuarios_distintos  BIGINT NOT NULL DEFAULT 0,
+    primera_actividad   TIMESTAMP WITH TIME ZONE,
+    ultima_actividad    TIMESTAMP WITH TIME ZONE
+);
+
+CREATE TABLE IF NOT EXISTS control_resumen_usuario_proyecto (
+    user_id      INT NOT NULL,
+    proyecto_id  INT NOT NULL,
+    PRIMARY KEY (user_id, proyecto_id)
+);
+
+CREATE TABLE IF NOT EXISTS control_resumen_usuario_dia (
+    user_id  INT NOT NULL,
+    dia      DATE NOT NULL,
+    PRIMARY KEY (user_id, dia)
+);
+
+-- Una sola fila: hasta qué id se procesó y cuándo se dejó al día
+CREATE TABLE IF NOT EXISTS control_resumen_estado (
+    id           BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+    watermark    BIGINT NOT NULL DEFAULT 0,
+    computed_at  TIMESTAMP WITH TIME ZONE
+);
+INSERT INTO control_resumen_estado (id) VALUES (TRUE) ON CONFLICT DO NOTHING;
+
+-- Si el script se vuelve a ejecutar, las secciones 3 y 4 crean estos
+-- índices sobre las tablas (redundantes con la PK)
+DROP INDEX IF EXISTS uidx_ctrl_resumen, uidx_ctrl_resumen_proy;
+
+-- Aplica las filas con p_desde < id <= p_hasta; retorna cuántas procesó
+CREATE OR REPLACE FUNCTION control_resumenes_aplicar(p_desde BIGINT, p_hasta BIGINT)
+RETURNS BIGINT AS $$
+DECLARE
+    v_n BIGINT;
+BEGIN
+    DROP TABLE IF EXISTS _ctrl_nuevas, _ctrl_pares_nuevos, _ctrl_dias_nuevos;
+
+    CREATE TEMP TABLE _ctrl_nuevas ON COMMIT DROP AS
+    SELECT user_id, accion, modulo, entidad_tipo, entidad_id, exitoso, fecha
+    FROM control_actividad
+    WHERE id > p_desde AND id <= p_hasta;
+    GET DIAGNOSTICS v_n = ROW_COUNT;
+    IF v_n = 0 THEN
+        RETURN 0;
+    END IF;
+
+    CREATE TEMP TABLE _ctrl_pares_nuevos (user_id INT, proyecto_id INT) ON COMMIT DROP;
+    WITH ins AS (
+        INSERT INTO control_resumen_usuario_proyecto (user_id, proyecto_id)
+        SELECT DISTINCT user_id, entidad_id
+        FROM _ctrl_nuevas
+        WHERE user_id IS NOT NULL AND entidad_tipo = 'proyecto' AND entidad_id IS NOT NULL
+        ON CONFLICT DO NOTHING
+        RETURNING user_id, proyecto_id
+    )
+    INSERT INTO _ctrl_pares_nuevos SELECT * FROM ins;
+
+    CREATE TEMP TABLE _ctrl_dias_nuevos (user_id INT) ON COMMIT DROP;
+    WITH ins AS (
+        INSERT INTO control_resumen_usuario_dia (user_id, dia)
+        SELECT DISTINCT user_id, DATE(fecha AT TIME ZONE 'America/Santiago')
+        FROM _ctrl_nuevas
+        WHERE user_id IS NOT NULL
+        ON CONFLICT DO NOTHING
+        RETURNING user_id
+    )
+    INSERT INTO _ctrl_dias_nuevos SELECT * FROM ins;
+
+    INSERT INTO control_resumen_usuario AS r
+        (user_id, total_acciones, acciones_proyectos, vistas_proyecto, ediciones_proyecto,
+         creaciones_proyecto, total_lecturas, total_escrituras, acciones_fallidas,
+         proyectos_distintos_accedidos, dias_activo, primera_actividad, ultima_actividad)
+    SELECT a.user_id, a.total, a.proyectos, a.vistas, a.ediciones, a.creaciones,
+           a.lecturas, a.escrituras, a.fallidas,
+           COALESCE(p.n, 0), COALESCE(d.n, 0), a.primera, a.ultima
+    FROM (
+        SELECT user_id,
+               COUNT(*)                                                AS total,
+               COUNT(*) FILTER (WHERE modulo = 'proyectos')            AS proyectos,
+               COUNT(*) FILTER (WHERE accion = 'ver_proyecto')         AS vistas,
+               COUNT(*) FILTER (WHERE accion = 'editar_proyecto')      AS ediciones,
+               COUNT(*) FILTER (WHERE accion = 'crear_proyecto')       AS creaciones,
+               COUNT(*) FILTER (WHERE accion LIKE 'ver_%')             AS lecturas,
+               COUNT(*) FILTER (WHERE accion LIKE '%editar%' OR accion LIKE '%crear%'
+                                   OR accion LIKE '%eliminar%')        AS escrituras,
+               COUNT(*) FILTER (WHERE exitoso = FALSE)                 AS fallidas,
+               MIN(fecha) AS primera,
+               MAX(fecha) AS ultima
+        FROM _ctrl_nuevas
+        WHERE user_id IS NOT NULL
+        GROUP BY user_id
+    ) a
+    LEFT JOIN (SELECT user_id, COUNT(*) AS n FROM _ctrl_pares_nuevos GROUP BY user_id) p USING (user_id)
+    LEFT JOIN (SELECT user_id, COUNT(*) AS n FROM _ctrl_dias_nuevos GROUP BY user_id) d USING (user_id)
+    ON CONFLICT (user_id) DO UPDATE SET
+        total_acciones                = r.total_acciones + EXCLUDED.total_acciones,
+        acciones_proyectos            = r.acciones_proyectos + EXCLUDED.acciones_proyectos,
+        vistas_proyecto               = r.vistas_proyecto + EXCLUDED.vistas_proyecto,
+        ediciones_proyecto            = r.ediciones_proyecto + EXCLUDED.ediciones_proyecto,
+        creaciones_proyecto           = r.creaciones_proyecto + EXCLUDED.creaciones_proyecto,
+        total_lecturas                = r.total_lecturas + EXCLUDED.total_lecturas,
+        total_escrituras              = r.total_escrituras + EXCLUDED.total_escrituras,
+        acciones_fallidas             = r.acciones_fallidas + EXCLUDED.acciones_fallidas,
+        proyectos_distintos_accedidos = r.proyectos_distintos_accedidos + EXCLUDED.proyectos_distintos_accedidos,
+        dias_activo                   = r.dias_activo + EXCLUDED.dias_activo,
+        primera_actividad             = LEAST(r.primera_actividad, EXCLUDED.primera_actividad),
+        ultima_actividad              = GREATEST(r.ultima_actividad, EXCLUDED.ultima_actividad);
+
+    INSERT INTO control_resumen_proyecto AS r
+        (proyecto_id, total_acciones, total_vistas, total_ediciones,
+         usuarios_distintos, primera_actividad, ultima_actividad)
+    SELECT a.proyecto_id, a.total, a.vistas, a.ediciones, COALESCE(p.n, 0), a.primera, a.ultima
+    FROM (
+        SELECT entidad_id AS proyecto_id,
+               COUNT(*)                                         AS total,
+               COUNT(*) FILTER (WHERE accion = 'ver_proyecto')    AS vistas,
+               COUNT(*) FILTER (WHERE accion = 'editar_proyecto') AS ediciones,
+               MIN(fecha) AS primera,
+               MAX(fecha) AS ultima
+        FROM _ctrl_nuevas
+        WHERE entidad_tipo = 'proyecto' AND entidad_id IS NOT NULL
+        GROUP BY entidad_id
+    ) a
+    LEFT JOIN (SELECT proyecto_id, COUNT(*) AS n FROM _ctrl_pares_nuevos GROUP BY proyecto_id) p USING (proyecto_id)
+    ON CONFLICT (proyecto_id) DO UPDATE SET
+        total_acciones     = r.total_acciones + EXCLUDED.total_acciones,
+        total_vistas       = r.total_vistas + EXCLUDED.total_vistas,
+        total_ediciones    = r.total_ediciones + EXCLUDED.total_ediciones,
+        usuarios_distintos = r.usuarios_distintos + EXCLUDED.usuarios_distintos,
+        primera_actividad  = LEAST(r.primera_actividad, EXCLUDED.primera_actividad),
+        ultima_actividad   = GREATEST(r.ultima_actividad, EXCLUDED.ultima_actividad);
+
+    RETURN v_n;
+END;
+$$ LANGUAGE plpgsql;
+
+-- ───────────────────────────────────────────────────────────
+-- 12. EVENTOS EN VIVO (LISTEN/NOTIFY -> SSE)
+--     Un NOTIFY por fila insertada en el canal control_eventos; se
+--     entrega al confirmar la transacción. El backend (eventos.py)
+--     escucha con una conexión por proceso y reparte a los streams
+--     de /control/eventos. Inserciones masivas (cargas, migraciones)
+--     envían un solo evento `lote` para que el panel recargue.
+--     Textos recortados: el payload de NOTIFY tiene límite de 8000 bytes.
+-- ───────────────────────────────────────────────────────────
+CREATE OR REPLACE FUNCTION control_notificar_insert()
+RETURNS TRIGGER AS $$
+DECLARE
+    v_n  INT;
+    v_ev JSONB;
+BEGIN
+    SELECT COUNT(*) INTO v_n FROM nuevas;
+    IF v_n > 100 THEN
+        PERFORM pg_notify('control_eventos', jsonb_build_object(
+            'tipo', 'lote',
+            'total', v_n,
+            'hasta_id', (SELECT MAX(id) FROM nuevas)
+        )::text);
+        RETURN NULL;
+    END IF;
+
+    FOR v_ev IN
+        SELECT jsonb_build_object(
+            'tipo', 'actividad',
+            'id', n.id,
+            'user_id', n.user_id,
+            'nombre_usuario', u.nombre,
+            'accion', n.accion,
+            'modulo', n.modulo,
+            'entidad_tipo', n.entidad_tipo,
+            'entidad_id', n.entidad_id,
+            'entidad_nombre', LEFT(n.entidad_nombre, 200),
+            'exitoso', n.exitoso,
+            'detalle', LEFT(n.detalle, 200),
+            'ip_origen', n.ip_origen::TEXT,
+            'fecha', n.fecha
+        )
+        FROM nuevas n
+        LEFT JOIN users u ON u.user_id = n.user_id
+        ORDER BY n.id
+    LOOP
+        PERFORM pg_notify('control_eventos', v_ev::text);
+    END LOOP;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_control_notify ON control_actividad;
+CREATE TRIGGER trg_control_notify
+AFTER INSERT ON control_actividad
+REFERENCING NEW TABLE AS nuevas
+FOR EACH STATEMENT EXECUTE FUNCTION control_notificar_insert();
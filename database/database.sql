@@ -107,3 +107,238 @@ FOR EACH ROW
 EXECUTE FUNCTION generar_folio();
 
 -- FIN
+
+-- ============================================
+-- PROCESAMIENTO DE FOTOS (fuera del request)
+-- ============================================
+-- estado_proceso: pendiente | listo | error
+-- Las fotos existentes quedan 'listo' (se sirven como original); los INSERT
+-- del backend marcan 'pendiente' explícitamente.
+ALTER TABLE reportes_fotos ADD COLUMN IF NOT EXISTS estado_proceso VARCHAR(20) NOT NULL DEFAULT 'listo';
+ALTER TABLE reportes_fotos ALTER COLUMN estado_proceso SET DEFAULT 'listo';
+ALTER TABLE reportes_fotos ADD COLUMN IF NOT EXISTS variantes JSONB;        -- {thumb|medium|full: {w, h, jpg, webp}}
+ALTER TABLE reportes_fotos ADD COLUMN IF NOT EXISTS latitud NUMERIC(10,7);  -- EXIF GPS
+ALTER TABLE reportes_fotos ADD COLUMN IF NOT EXISTS longitud NUMERIC(10,7);
+ALTER TABLE reportes_fotos ADD COLUMN IF NOT EXISTS fecha_captura TIMESTAMP;
+ALTER TABLE reportes_fotos ADD COLUMN IF NOT EXISTS ancho_px INTEGER;
+ALTER TABLE reportes_fotos ADD COLUMN IF NOT EXISTS alto_px INTEGER;
+ALTER TABLE reportes_fotos ADD COLUMN IF NOT EXISTS procesado_en TIMESTAMP;
+
+-- Barrido periódico (reencolar_fotos_pendientes en app21.py): retoma las
+-- pendientes cuyo proceso se perdió (reinicio con la cola en memoria)
+CREATE INDEX IF NOT EXISTS idx_fotos_pendientes ON reportes_fotos(subido_en) WHERE estado_proceso = 'pendiente';
+
+-- ============================================
+-- ÍNDICE ESPACIAL PARA EL MAPA (/api/mobile/reportes/mapa)
+-- ============================================
+-- GiST nativo sobre point (sin PostGIS); la consulta usa la misma expresión
+-- con el operador <@ box(...) para filtrar por viewport.
+CREATE INDEX IF NOT EXISTS idx_reportes_geo ON reportes_ciudadanos
+    USING gist (point(longitud::float8, latitud::float8))
+    WHERE activo = TRUE;
+
+-- ============================================
+-- SINCRONIZACIÓN OFFLINE (/api/mobile/sync)
+-- ============================================
+-- Claves de idempotencia por usuario con el resultado de cada operación.
+-- Se retienen SYNC_RETENCION_HORAS (72 h por defecto); el backend purga las vencidas.
+CREATE TABLE IF NOT EXISTS mobile_sync_claves (
+    user_id INTEGER NOT NULL REFERENCES users(user_id) ON DELETE CASCADE,
+    clave VARCHAR(100) NOT NULL,
+    tipo VARCHAR(40) NOT NULL,
+    resultado JSONB NOT NULL DEFAULT '{}'::jsonb,
+    creado_en TIMESTAMP NOT NULL DEFAULT NOW(),
+    PRIMARY KEY (user_id, clave)
+);
+
+CREATE INDEX IF NOT EXISTS idx_sync_claves_fecha ON mobile_sync_claves(creado_en);
+
+-- ============================================
+-- DUPLICADOS CERCANOS (crear_reporte / sumarse / fusionar)
+-- ============================================
+-- Celda de grilla de 0.0005° (~55 m, igual que CELDA_DUP_GRADOS en mapas.py).
+-- La búsqueda lee solo las celdas vecinas de la misma categoría.
+ALTER TABLE reportes_ciudadanos ADD COLUMN IF NOT EXISTS celda_x INTEGER
+    GENERATED ALWAYS AS (floor(longitud / 0.0005)::int) STORED;
+ALTER TABLE reportes_ciudadanos ADD COLUMN IF NOT EXISTS celda_y INTEGER
+    GENERATED ALWAYS AS (floor(latitud / 0.0005)::int) STORED;
+ALTER TABLE reportes_ciudadanos ADD COLUMN IF NOT EXISTS fusionado_en INTEGER REFERENCES reportes_ciudadanos(id);
+
+CREATE INDEX IF NOT EXISTS idx_reportes_dup ON reportes_ciudadanos (categoria_id, celda_x, celda_y, fecha_reporte)
+    WHERE activo = TRUE;
+
+-- Vecinos que se suman a un reporte existente en vez de duplicarlo
+CREATE TABLE IF NOT EXISTS reportes_adhesiones (
+    reporte_id INTEGER NOT NULL REFERENCES reportes_ciudadanos(id) ON DELETE CASCADE,
+    user_id INTEGER NOT NULL REFERENCES users(user_id) ON DELETE CASCADE,
+    creado_en TIMESTAMP NOT NULL DEFAULT NOW(),
+    PRIMARY KEY (reporte_id, user_id)
+);
+
+-- ============================================
+-- ESTADÍSTICAS INCREMENTALES (/api/mobile/reportes/estadisticas, perfil)
+-- ============================================
+-- Contadores de reportes activos mantenidos por trigger, en tres niveles:
+--   'usuario'    -> (user_id, estado_id)
+--   'cat_estado' -> (categoria_id, estado_id, gravedad_id)
+--   'dia'        -> (dia de fecha_reporte, categoria_id, estado_id)
+-- Las dimensiones que no aplican al nivel quedan en 0 / 1970-01-01 para
+-- que la PK sirva de clave de upsert.
+CREATE TABLE IF NOT EXISTS reportes_rollup (
+    nivel VARCHAR(12) NOT NULL,
+    user_id INTEGER NOT NULL DEFAULT 0,
+    categoria_id INTEGER NOT NULL DEFAULT 0,
+    estado_id INTEGER NOT NULL DEFAULT 0,
+    gravedad_id INTEGER NOT NULL DEFAULT 0,
+    dia DATE NOT NULL DEFAULT '1970-01-01',
+    total INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (nivel, user_id, categoria_id, estado_id, gravedad_id, dia)
+);
+
+CREATE OR REPLACE FUNCTION reportes_rollup_sumar(r reportes_ciudadanos, delta INTEGER) RETURNS VOID AS $$
+BEGIN
+    IF r.activo IS NOT TRUE THEN
+        RETURN;
+    END IF;
+
+    INSERT INTO reportes_rollup (nivel, user_id, estado_id, total)
+    VALUES ('usuario', r.reportado_por, r.estado_id, delta)
+    ON CONFLICT (nivel, user_id, categoria_id, estado_id, gravedad_id, dia)
+    DO UPDATE SET total = reportes_rollup.total + EXCLUDED.total;
+
+    INSERT INTO reportes_rollup (nivel, categoria_id, estado_id, gravedad_id, total)
+    VALUES ('cat_estado', r.categoria_id, r.estado_id, COALESCE(r.gravedad_id, 0), delta)
+    ON CONFLICT (nivel, user_id, categoria_id, estado_id, gravedad_id, dia)
+    DO UPDATE SET total = reportes_rollup.total + EXCLUDED.total;
+
+    INSERT INTO reportes_rollup (nivel, categoria_id, estado_id, dia, total)
+    VALUES ('dia', r.categoria_id, r.estado_id, COALESCE(r.fecha_reporte, NOW())::date, delta)
+    ON CONFLICT (nivel, user_id, categoria_id, estado_id, gravedad_id, dia)
+    DO UPDATE SET total = reportes_rollup.total + EXCLUDED.total;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION trg_reportes_rollup() RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        PERFORM reportes_rollup_sumar(OLD, -1);
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        PERFORM reportes_rollup_sumar(NEW, 1);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trig_reportes_rollup_ins ON reportes_ciudadanos;
+CREATE TRIGGER trig_reportes_rollup_ins
+AFTER INSERT OR DELETE ON reportes_ciudadanos
+FOR EACH ROW EXECUTE FUNCTION trg_reportes_rollup();
+
+-- Solo cuando cambia una dimensión contada (no en cada edición de texto)
+DROP TRIGGER IF EXISTS trig_reportes_rollup_upd ON reportes_ciudadanos;
+CREATE TRIGGER trig_reportes_rollup_upd
+AFTER UPDATE ON reportes_ciudadanos
+FOR EACH ROW
+WHEN (OLD.estado_id IS DISTINCT FROM NEW.estado_id
+   OR OLD.categoria_id IS DISTINCT FROM NEW.categoria_id
+   OR OLD.gravedad_id IS DISTINCT FROM NEW.gravedad_id
+   OR OLD.activo IS DISTINCT FROM NEW.activo
+   OR OLD.reportado_por IS DISTINCT FROM NEW.reportado_por
+   OR OLD.fecha_reporte::date IS DISTINCT FROM NEW.fecha_reporte::date)
+EXECUTE FUNCTION trg_reportes_rollup();
+
+-- Reconstrucción completa (carga inicial o verificación)
+CREATE OR REPLACE FUNCTION reconstruir_reportes_rollup() RETURNS VOID AS $$
+BEGIN
+    LOCK TABLE reportes_ciudadanos IN SHARE MODE;
+    DELETE FROM reportes_rollup;
+
+    INSERT INTO reportes_rollup (nivel, user_id, estado_id, total)
+    SELECT 'usuario', reportado_por, estado_id, COUNT(*)
+    FROM reportes_ciudadanos WHERE activo = TRUE
+    GROUP BY reportado_por, estado_id;
+
+    INSERT INTO reportes_rollup (nivel, categoria_id, estado_id, gravedad_id, total)
+    SELECT 'cat_estado', categoria_id, estado_id, COALESCE(gravedad_id, 0), COUNT(*)
+    FROM reportes_ciudadanos WHERE activo = TRUE
+    GROUP BY categoria_id, estado_id, COALESCE(gravedad_id, 0);
+
+    INSERT INTO reportes_rollup (nivel, categoria_id, estado_id, dia, total)
+    SELECT 'dia', categoria_id, estado_id, COALESCE(fecha_reporte, NOW())::date, COUNT(*)
+    FROM reportes_ciudadanos WHERE activo = TRUE
+    GROUP BY categoria_id, estado_id, COALESCE(fecha_reporte, NOW())::date;
+END;
+$$ LANGUAGE plpgsql;
+
+SELECT reconstruir_reportes_rollup();
+
+-- ============================================
+-- EVENTOS EN VIVO (LISTEN/NOTIFY -> /api/mobile/reportes/eventos)
+-- ============================================
+-- Payload compacto (límite de 8000 bytes de NOTIFY). user_id es el autor
+-- del reporte para que el stream pueda filtrar "mis reportes".
+CREATE OR REPLACE FUNCTION notificar_evento_reporte() RETURNS TRIGGER AS $$
+DECLARE
+    payload JSONB;
+BEGIN
+    IF TG_TABLE_NAME = 'reportes_ciudadanos' THEN
+        payload := jsonb_build_object(
+            'tipo', CASE WHEN TG_OP = 'INSERT' THEN 'reporte_creado' ELSE 'reporte_actualizado' END,
+            'reporte_id', NEW.id,
+            'user_id', NEW.reportado_por,
+            'categoria_id', NEW.categoria_id,
+            'estado_id', NEW.estado_id,
+            'gravedad_id', NEW.gravedad_id,
+            'activo', NEW.activo,
+            'latitud', NEW.latitud,
+            'longitud', NEW.longitud,
+            'actualizado_por', NEW.actualizado_por,
+            'fecha', NOW()
+        );
+    ELSE
+        payload := jsonb_build_object(
+            'tipo', 'comentario',
+            'reporte_id', NEW.reporte_id,
+            'comentario_id', NEW.id,
+            'autor_id', NEW.user_id,
+            'user_id', (SELECT reportado_por FROM reportes_ciudadanos WHERE id = NEW.reporte_id),
+            'comentario', LEFT(NEW.comentario, 200),
+            'fecha', NEW.creado_en
+        );
+    END IF;
+    PERFORM pg_notify('reportes_eventos', payload::text);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trig_reportes_notify ON reportes_ciudadanos;
+CREATE TRIGGER trig_reportes_notify
+AFTER INSERT OR UPDATE ON reportes_ciudadanos
+FOR EACH ROW EXECUTE FUNCTION notificar_evento_reporte();
+
+DROP TRIGGER IF EXISTS trig_comentarios_notify ON reportes_comentarios;
+CREATE TRIGGER trig_comentarios_notify
+AFTER INSERT ON reportes_comentarios
+FOR EACH ROW EXECUTE FUNCTION notificar_evento_reporte();
+
+-- ============================================
+-- BÚSQUEDA ADMIN (/api/mobile/reportes/buscar)
+-- ============================================
+-- Keyset sobre (fecha_reporte, id) DESC, con el filtro más selectivo primero.
+CREATE INDEX IF NOT EXISTS idx_reportes_keyset ON reportes_ciudadanos (fecha_reporte DESC, id DESC)
+    WHERE activo = TRUE;
+CREATE INDEX IF NOT EXISTS idx_reportes_estado_keyset ON reportes_ciudadanos (estado_id, fecha_reporte DESC, id DESC)
+    WHERE activo = TRUE;
+CREATE INDEX IF NOT EXISTS idx_reportes_categoria_keyset ON reportes_ciudadanos (categoria_id, fecha_reporte DESC, id DESC)
+    WHERE activo = TRUE;
+CREATE INDEX IF NOT EXISTS idx_reportes_gravedad_keyset ON reportes_ciudadanos (gravedad_id, fecha_reporte DESC, id DESC)
+    WHERE activo = TRUE;
+CREATE INDEX IF NOT EXISTS idx_reportes_autor_keyset ON reportes_ciudadanos (reportado_por, fecha_reporte DESC, id DESC)
+    WHERE activo = TRUE;
+
+-- Texto libre (q): trigramas sobre la misma expresión que REPORTE_TEXTO_SQL
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+CREATE INDEX IF NOT EXISTS idx_reportes_texto_trgm ON reportes_ciudadanos
+    USING gin ((COALESCE(numero_folio, '') || ' ' || direccion_referencia || ' ' || COALESCE(descripcion, '')) gin_trgm_ops)
+    WHERE activo = TRUE;
@@ -401,3 +401,16 @@ ON CONFLICT (nombre) DO NOTHING;
 
 
 
+
+-- ============================================
+-- BBOX DE GEOMAPAS (tiles /tiles/geomapas/{z}/{x}/{y})
+-- ============================================
+-- Se calcula en el backend al crear el geomapa; los existentes se completan
+-- la primera vez que se pide un tile.
+ALTER TABLE proyectos_geomapas ADD COLUMN IF NOT EXISTS bbox_oeste DOUBLE PRECISION;
+ALTER TABLE proyectos_geomapas ADD COLUMN IF NOT EXISTS bbox_sur   DOUBLE PRECISION;
+ALTER TABLE proyectos_geomapas ADD COLUMN IF NOT EXISTS bbox_este  DOUBLE PRECISION;
+ALTER TABLE proyectos_geomapas ADD COLUMN IF NOT EXISTS bbox_norte DOUBLE PRECISION;
+
+CREATE INDEX IF NOT EXISTS idx_geomapas_bbox ON proyectos_geomapas
+    USING gist (box(point(bbox_oeste, bbox_sur), point(bbox_este, bbox_norte)));
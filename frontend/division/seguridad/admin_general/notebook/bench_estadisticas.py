@@ -0,0 +1,145 @@
+"""
+bench_estadisticas.py
+=====================
+Compara tiempos y resultados de las medias móviles / históricos de
+proceso.py (secciones 6-8): versión anterior con
+groupby().transform(lambda ...) contra estadisticas.Agrupado.
+
+Uso:
+    python bench_estadisticas.py                      # ESTADISTICA_DELITO.csv nacional
+    python bench_estadisticas.py --csv ruta.csv
+    python bench_estadisticas.py --sintetico --semanas 300
+
+Con --sintetico genera un dataset con la forma del nacional
+(345 comunas x 21 delitos + Total x N semanas, frecuencias Poisson).
+Sale con código 1 si alguna columna no es idéntica (NaN incluidos).
+"""
+
+import os
+import sys
+import time
+import argparse
+
+import numpy as np
+import pandas as pd
+
+import estadisticas
+
+RUTAS_CSV = [
+    r"../estadistica_stop/ESTADISTICA_DELITO.csv",
+    r"estadistica_stop/ESTADISTICA_DELITO.csv",
+    r"..\data\input\ESTADISTICA_DELITO.csv",
+]
+
+GRUPO = ['delito', 'codcom']
+GRUPO_ANUAL = ['delito', 'codcom', 'año']
+
+
+def cargar_nacional(ruta):
+    """Misma preparación que proceso.py hasta la sección 5 (totales, año, orden)."""
+    df = pd.read_csv(ruta)
+    totales = df.groupby(['codcom', 'id_semana'], as_index=False)['frecuencia'].sum()
+    totales['delito'] = 'Total'
+    dim_tiempo = df[['id_semana', 'semana_detalle', 'fecha']].drop_duplicates()
+    totales = totales.merge(dim_tiempo, on='id_semana', how='left')
+    totales = totales.reindex(columns=df.columns, fill_value=np.nan)
+    df = pd.concat([df, totales], ignore_index=True)
+    df['fecha'] = pd.to_datetime(df['fecha'], errors='coerce')
+    df['año'] = df['fecha'].dt.year
+    return df.sort_values(['codcom', 'delito', 'id_semana']).reset_index(drop=True)
+
+
+def generar_sintetico(semanas, comunas=345, delitos=21, semilla=0):
+    rng = np.random.default_rng(semilla)
+    nombres = [f"Delito {i}" for i in range(delitos)] + ['Total']
+    idx = pd.MultiIndex.from_product([range(13101, 13101 + comunas), nombres, range(1, semanas + 1)],
+                                     names=['codcom', 'delito', 'id_semana'])
+    df = idx.to_frame(index=False)
+    lam = rng.gamma(1.5, 3.0, comunas * len(nombres)).repeat(semanas)
+    df['frecuencia'] = rng.poisson(lam)
+    df['fecha'] = pd.Timestamp('2019-01-07') + pd.to_timedelta((df['id_semana'] - 1) * 7, unit='D')
+    df['año'] = df['fecha'].dt.year
+    return df
+
+
+def version_anterior(df):
+    g = df.groupby(GRUPO)['frecuencia']
+    ga = df.groupby(GRUPO_ANUAL)['frecuencia']
+    return {
+        'media_movil_4s': g.transform(lambda x: x.rolling(4, min_periods=1).mean()),
+        'media_movil_8s': g.transform(lambda x: x.rolling(8, min_periods=1).mean()),
+        'promedio_hist': g.transform(lambda x: x.expanding().mean()),
+        'std_hist': g.transform(lambda x: x.expanding().std()),
+        'max_hist': g.transform(lambda x: x.expanding().max()),
+        'promedio_hist_anual': ga.transform(lambda x: x.expanding().mean()),
+        'std_hist_anual': ga.transform(lambda x: x.expanding().std()),
+        'max_hist_anual': ga.transform(lambda x: x.expanding().max()),
+    }
+
+
+def version_actual(df):
+    est = estadisticas.Agrupado(df, GRUPO, 'frecuencia')
+    est_anual = estadisticas.Agrupado(df, GRUPO_ANUAL, 'frecuencia')
+    return {
+        'media_movil_4s': est.media_movil(4),
+        'media_movil_8s': est.media_movil(8),
+        'promedio_hist': est.promedio(),
+        'std_hist': est.desviacion(),
+        'max_hist': est.maximo(),
+        'promedio_hist_anual': est_anual.promedio(),
+        'std_hist_anual': est_anual.desviacion(),
+        'max_hist_anual': est_anual.maximo(),
+    }
+
+
+def medir(fn, df, repeticiones):
+    tiempos = []
+    for _ in range(repeticiones):
+        t = time.perf_counter()
+        res = fn(df)
+        tiempos.append(time.perf_counter() - t)
+    return min(tiempos), res
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Benchmark de estadísticas por grupo de proceso.py")
+    ap.add_argument('--csv', help="ruta a ESTADISTICA_DELITO.csv")
+    ap.add_argument('--sintetico', action='store_true', help="usar datos sintéticos")
+    ap.add_argument('--semanas', type=int, default=300)
+    ap.add_argument('--repeticiones', type=int, default=3)
+    args = ap.parse_args()
+
+    if args.sintetico:
+        df = generar_sintetico(args.semanas)
+        origen = f"sintético ({args.semanas} semanas)"
+    else:
+        ruta = args.csv or next((r for r in RUTAS_CSV if os.path.exists(r)), None)
+        if not ruta or not os.path.exists(ruta):
+            sys.exit("No se encontró ESTADISTICA_DELITO.csv (usar --csv o --sintetico)")
+        df = cargar_nacional(ruta)
+        origen = ruta
+
+    print(f"Datos: {origen} · {len(df):,} filas · "
+          f"{df.groupby(GRUPO).ngroups:,} grupos delito-comuna · "
+          f"{df.groupby(GRUPO_ANUAL).ngroups:,} grupos anuales")
+
+    t_ant, antes = medir(version_anterior, df, args.repeticiones)
+    t_act, ahora = medir(version_actual, df, args.repeticiones)
+    print(f"\nanterior (transform + lambda): {t_ant:8.2f} s")
+    print(f"actual   (estadisticas.py)   : {t_act:8.2f} s   x{t_ant / t_act:.1f}")
+
+    print(f"\n{'columna':<22} {'idéntica':>9} {'máx |Δ|':>10}")
+    todo_igual = True
+    for col in antes:
+        a = antes[col].to_numpy(dtype='float64')
+        b = ahora[col].to_numpy(dtype='float64')
+        igual = np.array_equal(a, b, equal_nan=True)
+        delta = np.nanmax(np.abs(a - b)) if len(a) and not np.isnan(a - b).all() else 0.0
+        todo_igual &= igual
+        print(f"{col:<22} {'sí' if igual else 'NO':>9} {delta:>10.3g}")
+
+    sys.exit(0 if todo_igual else 1)
+
+
+if __name__ == "__main__":
+    main()
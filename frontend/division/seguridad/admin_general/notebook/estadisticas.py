@@ -0,0 +1,114 @@
+"""
+estadisticas.py
+===============
+Estadísticas móviles e históricas por grupo, sin una lambda por grupo.
+
+Equivalen a:
+    df.groupby(claves)[col].transform(lambda x: x.rolling(n, min_periods=1).mean())
+    df.groupby(claves)[col].transform(lambda x: x.expanding().mean())
+    df.groupby(claves)[col].transform(lambda x: x.expanding().std())
+    df.groupby(claves)[col].transform(lambda x: x.expanding().max())
+
+Cada grupo se procesa en el orden de filas del DataFrame, igual que
+transform. Las filas se ordenan una sola vez por grupo (sort estable) y se
+calcula todo sobre arreglos contiguos:
+  - medias (móvil e histórica): suma acumulada segmentada. Con valores
+    enteros (frecuencias) las sumas son exactas en float64 y el resultado
+    es idéntico al de pandas; si no, se usa rolling agrupado.
+  - desviación estándar: rolling/expanding agrupado de pandas (mismo kernel
+    que la versión por grupo, resultado idéntico bit a bit).
+  - máximo: groupby().cummax() por id de grupo sobre el arreglo ordenado.
+Las filas con clave nula quedan en NaN, como en transform (dropna=True).
+
+Uso:
+    import estadisticas
+    est = estadisticas.Agrupado(df, ['delito', 'codcom'], 'frecuencia')
+    df['media_movil_4s'] = est.media_movil(4)
+    df['promedio_hist'] = est.promedio()
+"""
+
+import numpy as np
+import pandas as pd
+
+# Sumas exactas en float64 mientras no superen 2**53
+_LIMITE_EXACTO = 2.0 ** 53
+
+
+class Agrupado:
+    def __init__(self, df, claves, col):
+        self.index = df.index
+        # ngroup marca las claves nulas con -1 o NaN según la versión de pandas
+        gid = df.groupby(claves, sort=False).ngroup().fillna(-1).to_numpy(dtype='int64')
+        validas = gid >= 0
+
+        # Orden estable por grupo: cada grupo contiguo, en su orden original
+        self.orden = np.argsort(gid, kind='stable')[np.count_nonzero(~validas):]
+        g = gid[self.orden]
+        self.inicio = np.r_[True, g[1:] != g[:-1]] if len(g) else np.zeros(0, dtype=bool)
+        self.g = g
+
+        # Posición dentro del grupo (0, 1, 2, ...)
+        n = len(g)
+        pos_inicio = np.flatnonzero(self.inicio)
+        tam = np.diff(np.r_[pos_inicio, n])
+        self.pos = np.arange(n) - np.repeat(pos_inicio, tam)
+
+        self.v = df[col].to_numpy(dtype='float64', na_value=np.nan)[self.orden]
+        self.obs = ~np.isnan(self.v)
+
+        v0 = np.where(self.obs, self.v, 0.0)
+        self.exacto = bool(np.all(v0 == np.round(v0)) and np.abs(v0).sum() < _LIMITE_EXACTO)
+        self._cs = _cumsum_segmentada(v0, pos_inicio, tam)
+        self._cn = _cumsum_segmentada(self.obs.astype('float64'), pos_inicio, tam)
+
+    def _a_serie(self, valores):
+        out = np.full(len(self.index), np.nan)
+        out[self.orden] = valores
+        return pd.Series(out, index=self.index)
+
+    def _ventana(self, acum, n):
+        """Suma de las últimas n filas del grupo (o menos al inicio)."""
+        atras = np.zeros_like(acum)
+        lejos = self.pos >= n
+        atras[lejos] = acum[np.flatnonzero(lejos) - n]
+        return acum - atras
+
+    def media_movil(self, n):
+        if not self.exacto:
+            return self._rolling_agrupado(n, 'mean')
+        s = self._ventana(self._cs, n)
+        c = self._ventana(self._cn, n)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return self._a_serie(np.where(c > 0, s / c, np.nan))
+
+    def promedio(self):
+        if not self.exacto:
+            return self._rolling_agrupado(None, 'mean')
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return self._a_serie(np.where(self._cn > 0, self._cs / self._cn, np.nan))
+
+    def desviacion(self):
+        return self._rolling_agrupado(None, 'std')
+
+    def maximo(self):
+        # expanding().max() conserva el máximo previo en filas NaN; cummax deja NaN
+        gb = pd.Series(self.v).groupby(self.g, sort=False)
+        m = gb.cummax().groupby(self.g, sort=False).ffill()
+        return self._a_serie(m.to_numpy())
+
+    def _rolling_agrupado(self, n, func):
+        """rolling(n)/expanding() agrupado sobre el frame ya ordenado por grupo."""
+        s = pd.Series(self.v, index=self.g)
+        gb = s.groupby(level=0, sort=False)
+        r = gb.rolling(n, min_periods=1) if n else gb.expanding()
+        valores = getattr(r, func)().to_numpy()
+        return self._a_serie(valores)
+
+
+def _cumsum_segmentada(x, pos_inicio, tam):
+    """Suma acumulada que se reinicia al comienzo de cada grupo."""
+    cs = np.cumsum(x)
+    if not len(cs):
+        return cs
+    base = np.r_[0.0, cs[pos_inicio[1:] - 1]]
+    return cs - np.repeat(base, tam)
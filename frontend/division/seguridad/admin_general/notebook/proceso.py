@@ -7,6 +7,8 @@ import os
 import sys
 import datetime
 
+import estadisticas
+
 # Suppress warnings
 warnings.filterwarnings('ignore')
 
@@ -177,24 +179,29 @@ verificar_integridad(df, pd.DataFrame(index=range(df_len_before)), "Merge Acumul
 # 6. MEDIAS MÓVILES
 # =========================================
 print("Calculando Medias Móviles...")
-df['media_movil_4s'] = df.groupby(['delito','codcom'])['frecuencia'].transform(lambda x: x.rolling(4, min_periods=1).mean())
-df['media_movil_8s'] = df.groupby(['delito','codcom'])['frecuencia'].transform(lambda x: x.rolling(8, min_periods=1).mean())
+# Vectorizado por grupo (ver estadisticas.py y bench_estadisticas.py); mismo
+# resultado que groupby().transform(lambda x: x.rolling(...)/x.expanding()...)
+est_grupo = estadisticas.Agrupado(df, ['delito','codcom'], 'frecuencia')
+df['media_movil_4s'] = est_grupo.media_movil(4)
+df['media_movil_8s'] = est_grupo.media_movil(8)
 
 # =========================================
 # 7. HISTÓRICOS
 # =========================================
 print("Calculando Históricos...")
-df['promedio_hist'] = df.groupby(['delito','codcom'])['frecuencia'].transform(lambda x: x.expanding().mean())
-df['std_hist'] = df.groupby(['delito','codcom'])['frecuencia'].transform(lambda x: x.expanding().std())
-df['max_hist'] = df.groupby(['delito','codcom'])['frecuencia'].transform(lambda x: x.expanding().max())
+df['promedio_hist'] = est_grupo.promedio()
+df['std_hist'] = est_grupo.desviacion()
+df['max_hist'] = est_grupo.maximo()
 
 # =========================================
 # 8. ESTADÍSTICAS AÑO ANTERIOR
 # =========================================
 print("Calculando Stats Año Anterior...")
-df['promedio_hist_anual'] = df.groupby(['delito','codcom','año'])['frecuencia'].transform(lambda x: x.expanding().mean())
-df['std_hist_anual'] = df.groupby(['delito','codcom','año'])['frecuencia'].transform(lambda x: x.expanding().std())
-df['max_hist_anual'] = df.groupby(['delito','codcom','año'])['frecuencia'].transform(lambda x: x.expanding().max())
+est_anual = estadisticas.Agrupado(df, ['delito','codcom','año'], 'frecuencia')
+df['promedio_hist_anual'] = est_anual.promedio()
+df['std_hist_anual'] = est_anual.desviacion()
+df['max_hist_anual'] = est_anual.maximo()
+del est_grupo, est_anual
 
 stats_prev = df[['delito','codcom','año','semana_numero','promedio_hist_anual','std_hist_anual','max_hist_anual']].copy()
 stats_prev = stats_prev.drop_duplicates(subset=['delito','codcom','año','semana_numero'])
@@ -95,3 +95,49 @@ const api = {
         return this.request(endpoint, { ...options, method: 'DELETE' });
     }
 };
+
+// Registro de acciones de solo lectura (ver_proyecto, ver_dashboard, ...).
+// Se acumulan y se envían en lote a /control/registrar; al salir de la página
+// lo pendiente se envía con sendBeacon (text/plain para evitar el preflight).
+const registroActividad = {
+    pendientes: [],
+    timer: null,
+    MAX_LOTE: 50,
+    ESPERA_MS: 5000,
+
+    registrar(evento) {
+        this.pendientes.push(evento);
+        if (this.pendientes.length >= this.MAX_LOTE) {
+            this.enviar();
+        } else if (!this.timer) {
+            this.timer = setTimeout(() => this.enviar(), this.ESPERA_MS);
+        }
+    },
+
+    tomar() {
+        clearTimeout(this.timer);
+        this.timer = null;
+        return this.pendientes.splice(0, this.pendientes.length);
+    },
+
+    enviar() {
+        const lote = this.tomar();
+        if (!lote.length || !API_CONFIG.token) return;
+        api.post('/control/registrar', lote).catch(() => { }); // silencioso — no interrumpe la UI
+    },
+
+    enviarAlSalir() {
+        const lote = this.tomar();
+        if (!lote.length || !API_CONFIG.token) return;
+        const url = `${API_CONFIG.BASE_URL}/control/registrar?token=${encodeURIComponent(API_CONFIG.token)}`;
+        const cuerpo = new Blob([JSON.stringify(lote)], { type: 'text/plain' });
+        if (!(navigator.sendBeacon && navigator.sendBeacon(url, cuerpo))) {
+            fetch(url, { method: 'POST', body: cuerpo, keepalive: true }).catch(() => { });
+        }
+    }
+};
+
+window.addEventListener('pagehide', () => registroActividad.enviarAlSalir());
+document.addEventListener('visibilitychange', () => {
+    if (document.visibilityState === 'hidden') registroActividad.enviarAlSalir();
+});
@@ -0,0 +1,89 @@
+// Capa Leaflet que carga tiles GeoJSON de /tiles/{capa}/{z}/{x}/{y}.
+// El navegador revalida cada tile con ETag, así que volver a un área ya
+// vista solo cuesta un 304.
+const geoTiles = {
+
+    layer(baseUrl, capa, options = {}) {
+        const token = options.token;
+        const geojsonOptions = options.geojson || {};
+
+        const GeoJSONTiles = L.GridLayer.extend({
+            initialize(opts) {
+                L.GridLayer.prototype.initialize.call(this, opts);
+                this._features = L.geoJSON(null, geojsonOptions);
+                this._porTile = {};
+                this._vistas = {};      // feature_key -> nº de tiles que la contienen
+            },
+
+            onAdd(map) {
+                L.GridLayer.prototype.onAdd.call(this, map);
+                this._features.addTo(map);
+                this.on('tileunload', this._descargar, this);
+            },
+
+            onRemove(map) {
+                this.off('tileunload', this._descargar, this);
+                this._features.clearLayers();
+                this._porTile = {};
+                this._vistas = {};
+                map.removeLayer(this._features);
+                L.GridLayer.prototype.onRemove.call(this, map);
+            },
+
+            createTile(coords, done) {
+                const tile = document.createElement('div');
+                const key = this._tileCoordsToKey(coords);
+                let url = `${baseUrl}/tiles/${capa}/${coords.z}/${coords.x}/${coords.y}`;
+                if (token) url += `?token=${encodeURIComponent(token)}`;
+
+                fetch(url, { cache: 'no-cache' })
+                    .then(r => r.ok ? r.json() : { features: [] })
+                    .then(fc => {
+                        this._porTile[key] = [];
+                        fc.features.forEach(f => this._agregar(key, f));
+                        done(null, tile);
+                    })
+                    .catch(err => done(err, tile));
+                return tile;
+            },
+
+            _featureKey(f) {
+                const p = f.properties || {};
+                if (p.cluster) return null;     // los clusters son propios de cada tile
+                if (p.geomapa_id !== undefined) return `g${p.geomapa_id}:${p.feature_idx}`;
+                return p.id !== undefined ? `r${p.id}` : null;
+            },
+
+            _agregar(key, f) {
+                const fk = this._featureKey(f);
+                if (fk && this._vistas[fk]) {
+                    // Geometría que cruza varios tiles: se dibuja una sola vez
+                    this._vistas[fk].n += 1;
+                    this._porTile[key].push(fk);
+                    return;
+                }
+                const capaLeaflet = L.geoJSON(f, geojsonOptions);
+                this._features.addLayer(capaLeaflet);
+                const ref = fk || `t${key}:${this._porTile[key].length}`;
+                this._vistas[ref] = { n: 1, capa: capaLeaflet };
+                this._porTile[key].push(ref);
+            },
+
+            _descargar(e) {
+                const key = this._tileCoordsToKey(e.coords);
+                (this._porTile[key] || []).forEach(ref => {
+                    const v = this._vistas[ref];
+                    if (!v) return;
+                    v.n -= 1;
+                    if (v.n <= 0) {
+                        this._features.removeLayer(v.capa);
+                        delete this._vistas[ref];
+                    }
+                });
+                delete this._porTile[key];
+            }
+        });
+
+        return new GeoJSONTiles(options.grid || {});
+    }
+};
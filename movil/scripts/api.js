@@ -46,7 +46,10 @@ const api = {
             const data = await response.json();
 
             if (!response.ok) {
-                throw new Error(data.msg || data.message || 'Error en la petición');
+                const err = new Error(data.msg || data.message || 'Error en la petición');
+                err.status = response.status;
+                err.data = data;
+                throw err;
             }
 
             return data;
@@ -96,6 +99,20 @@ const api = {
         });
     },
 
+    async joinReport(reportId, comentario = null) {
+        return await this.request(`/api/mobile/reportes/${reportId}/sumarse`, {
+            method: 'POST',
+            body: JSON.stringify(comentario ? { comentario } : {})
+        });
+    },
+
+    async mergeReports(reportId, duplicados) {
+        return await this.request(`/api/mobile/reportes/${reportId}/fusionar`, {
+            method: 'POST',
+            body: JSON.stringify({ duplicados })
+        });
+    },
+
     async getMyReports() {
         return await this.request('/api/mobile/reportes/mis-reportes', {
             method: 'GET'
@@ -115,6 +132,35 @@ const api = {
         });
     },
 
+    async getMapReports(bbox, zoom, filtros = {}) {
+        const params = new URLSearchParams({ bbox, zoom });
+        if (filtros.categoria) params.set('categoria', filtros.categoria);
+        if (filtros.estado) params.set('estado', filtros.estado);
+        return await this.request(`/api/mobile/reportes/mapa?${params}`, {
+            method: 'GET',
+            auth: false
+        });
+    },
+
+    // ===== EVENTOS EN VIVO (SSE) =====
+
+    // EventSource no admite headers: el token viaja en la query
+    eventsUrl(params = {}) {
+        const q = new URLSearchParams({ ...params, token: this.token || '' });
+        return `${API_BASE}/api/mobile/reportes/eventos?${q}`;
+    },
+
+    // ===== SINCRONIZACIÓN OFFLINE =====
+
+    // ops: [{ clave, tipo, ref?, datos }] — la clave debe generarse al crear
+    // la operación (crypto.randomUUID()) y reutilizarse en cada reintento
+    async sync(ops, atomico = false) {
+        return await this.request('/api/mobile/sync', {
+            method: 'POST',
+            body: JSON.stringify({ operaciones: ops, atomico })
+        });
+    },
+
     // ===== FOTOS =====
 
     async uploadPhotos(reportId, files, metadata = {}) {
@@ -99,6 +99,8 @@ const app = {
     },
 
     onViewChange(viewName) {
+        // Cada vista abre su propio stream de eventos si lo necesita
+        live.close();
         switch (viewName) {
             case 'home':
                 reports.loadMyReports();
@@ -351,7 +353,25 @@ const reports = {
                 descripcion: formData.get('descripcion')
             };
 
-            const result = await api.createReport(reportData);
+            let result;
+            try {
+                result = await api.createReport(reportData);
+            } catch (error) {
+                if (error.status !== 409) throw error;
+
+                // Ya hay un reporte similar cerca: ofrecer sumarse en vez de duplicar
+                const dup = error.data.duplicados[0];
+                ui.hideLoading();
+                const sumarse = confirm(
+                    `Ya existe un reporte similar a ${Math.round(dup.distancia_m)} m ` +
+                    `(folio ${dup.numero_folio || dup.id}, ${dup.estado}).\n\n` +
+                    '¿Quieres sumarte a ese reporte? (Cancelar crea uno nuevo)'
+                );
+                ui.showLoading();
+                result = sumarse
+                    ? await api.joinReport(dup.id, reportData.descripcion)
+                    : await api.createReport({ ...reportData, forzar: true });
+            }
 
             // Si hay fotos, subirlas
             if (appState.selectedPhotos.length > 0 && result.id) {
@@ -418,6 +438,9 @@ const reports = {
             const photos = await api.getPhotos(reportId);
             const comments = await api.getComments(reportId);
 
+            // Recargar el detalle cuando cambie el estado o llegue un comentario
+            live.open({ reporte_id: reportId }, () => this.showDetail(reportId));
+
             // Construir galería de fotos
             let photosHtml = '';
             if (photos.length > 0) {
@@ -426,8 +449,8 @@ const reports = {
                         <h4>Evidencias Fotográficas (${photos.length})</h4>
                         <div class="photo-gallery">
                             ${photos.map(p => `
-                                <div class="photo-card" onclick="ui.showImageModal('${API_BASE}${p.ruta_archivo}')">
-                                    <div class="photo-wrapper" style="background-image: url('${API_BASE}${p.ruta_archivo}')"></div>
+                                <div class="photo-card" onclick="ui.showImageModal('${API_BASE}${p.variantes?.full?.jpg || p.ruta_archivo}')">
+                                    <div class="photo-wrapper" style="background-image: url('${API_BASE}${p.variantes?.thumb?.jpg || p.ruta_archivo + '?w=240&fmt=webp'}')"></div>
                                 </div>
                             `).join('')}
                         </div>
@@ -602,6 +625,7 @@ const maps = {
         if (appState.maps.full) {
             appState.maps.full.invalidateSize();
             this.loadMapMarkers();
+            live.open({}, () => this.loadMapMarkers());
             return;
         }
 
@@ -616,15 +640,25 @@ const maps = {
             attribution: '© OpenStreetMap'
         }).addTo(appState.maps.full);
 
+        // Capa que se reemplaza en cada movimiento del mapa
+        appState.maps.fullLayer = L.layerGroup().addTo(appState.maps.full);
+        appState.maps.full.on('moveend', () => this.loadMapMarkers());
+
         // Cargar reportes
         await this.loadMapMarkers();
+        live.open({}, () => this.loadMapMarkers());
     },
 
     async loadMapMarkers() {
-        if (!appState.maps.full) return;
+        const map = appState.maps.full;
+        if (!map) return;
+
+        // Descarta respuestas de movimientos anteriores
+        const seq = (this._mapSeq = (this._mapSeq || 0) + 1);
 
         try {
-            const reports = await api.getAllReports();
+            const data = await api.getMapReports(map.getBounds().toBBoxString(), map.getZoom());
+            if (seq !== this._mapSeq) return;
 
             const colors = {
                 1: '#e67e22', // Bache
@@ -633,7 +667,26 @@ const maps = {
                 4: '#7f8c8d'  // Otro
             };
 
-            reports.forEach(r => {
+            const layer = appState.maps.fullLayer;
+            layer.clearLayers();
+
+            if (data.modo === 'clusters') {
+                data.items.forEach(cl => {
+                    const size = cl.total > 99 ? 44 : cl.total > 9 ? 36 : 28;
+                    const icon = L.divIcon({
+                        className: 'custom-marker',
+                        html: `<div style="background:#2c3e50;color:white;width:${size}px;height:${size}px;line-height:${size}px;border-radius:50%;text-align:center;font-size:12px;font-weight:bold;border:2px solid white;box-shadow:0 2px 4px rgba(0,0,0,0.3)">${cl.total}</div>`,
+                        iconSize: [size, size],
+                        iconAnchor: [size / 2, size / 2]
+                    });
+                    L.marker([cl.latitud, cl.longitud], { icon })
+                        .addTo(layer)
+                        .on('click', () => map.setView([cl.latitud, cl.longitud], Math.min(map.getZoom() + 2, 18)));
+                });
+                return;
+            }
+
+            data.items.forEach(r => {
                 const color = colors[r.categoria_id] || '#999';
 
                 const icon = L.divIcon({
@@ -644,7 +697,7 @@ const maps = {
                 });
 
                 L.marker([r.latitud, r.longitud], { icon })
-                    .addTo(appState.maps.full)
+                    .addTo(layer)
                     .bindPopup(`
                         <strong>${r.categoria}</strong><br>
                         <small>${r.direccion_referencia}</small><br>
@@ -658,6 +711,37 @@ const maps = {
     }
 };
 
+// ==========================================
+// EVENTOS EN VIVO (reemplaza el re-polling)
+// ==========================================
+const live = {
+    source: null,
+    timer: null,
+
+    // onChange se agrupa: una ráfaga de eventos produce una sola recarga
+    open(params, onChange) {
+        this.close();
+        if (!window.EventSource || !api.token) return;
+
+        const disparar = () => {
+            clearTimeout(this.timer);
+            this.timer = setTimeout(onChange, 500);
+        };
+        this.source = new EventSource(api.eventsUrl(params));
+        ['reporte_creado', 'reporte_actualizado', 'comentario', 'reset'].forEach(tipo =>
+            this.source.addEventListener(tipo, disparar)
+        );
+    },
+
+    close() {
+        clearTimeout(this.timer);
+        if (this.source) {
+            this.source.close();
+            this.source = null;
+        }
+    }
+};
+
 // ==========================================
 // INICIALIZAR APP
 // ==========================================